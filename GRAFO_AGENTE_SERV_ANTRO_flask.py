@@ -4,10 +4,11 @@ import os
 import getpass
 import configparser
 import logging
-import sqlite3
-import re
-import numpy as np
 import cohere
+from recuperacion_concurrente import ejecutar_en_paralelo
+from rerank_cascada import crear_rerank_cascada
+from componentes import contenedor, consultas_calentamiento
+from bm25_sqlite import obtener_pool, buscar_bm25, MMAP_SIZE_POR_DEFECTO, CACHE_SIZE_KIB_POR_DEFECTO
 
 # --------------------- Configuración de Logging ---------------------
 glog_filename = 'script_log_antro.log'  # Nombre del archivo de log
@@ -55,6 +56,20 @@ max_results_bm25 = config['SERVICIOS_SIMAP_ANTRO'].getint('max_results_bm25', fa
 rerank_enabled = config['SERVICIOS_SIMAP_ANTRO'].getboolean('rerank_enabled', fallback=False)
 rerank_top_n = config['SERVICIOS_SIMAP_ANTRO'].getint('rerank_top_n', fallback=150)
 rerank_top_k = config['SERVICIOS_SIMAP_ANTRO'].getint('rerank_top_k', fallback=20)
+# Modo de consulta FTS5 (AND, OR, NEAR, PREFIJO) y resaltado opcional (snippet, highlight)
+bm25_modo_consulta = config['SERVICIOS_SIMAP_ANTRO'].get('bm25_modo_consulta', fallback='OR')
+bm25_resaltado = config['SERVICIOS_SIMAP_ANTRO'].get('bm25_resaltado', fallback='').strip() or None
+# Pesos de bm25() por columna del esquema estructurado: chunk_texto, contexto, subtipo
+bm25_pesos = tuple(float(peso) for peso in config['SERVICIOS_SIMAP_ANTRO'].get('bm25_pesos', fallback='1.0,0.5,2.0').split(','))
+# Pool de conexiones de solo lectura al índice BM25 (una por hilo trabajador)
+pool_bm25 = obtener_pool(
+    bm25_db_path,
+    mmap_size=config['SERVICIOS_SIMAP_ANTRO'].getint('bm25_mmap_size', fallback=MMAP_SIZE_POR_DEFECTO),
+    cache_size_kib=config['SERVICIOS_SIMAP_ANTRO'].getint('bm25_cache_size_kib', fallback=CACHE_SIZE_KIB_POR_DEFECTO),
+)
+# Timeouts (segundos) por tramo de la recuperación híbrida concurrente
+timeout_bm25 = config['SERVICIOS_SIMAP_ANTRO'].getfloat('timeout_bm25', fallback=2.0)
+timeout_chroma = config['SERVICIOS_SIMAP_ANTRO'].getfloat('timeout_chroma', fallback=8.0)
 
 # Configuración de API Keys
 api_key = config['DEFAULT'].get('openai_api_key')
@@ -77,8 +92,17 @@ if "USER_AGENT" not in os.environ:
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 
-embeddings = OpenAIEmbeddings(api_key=os.environ['OPENAI_API_KEY'])
-log_message("Embeddings creados con OpenAI.")
+from cache_embeddings import EmbeddingsConCache
+
+# Embeddings con caché de consultas (LRU en memoria + SQLite en disco)
+embeddings = EmbeddingsConCache(
+    OpenAIEmbeddings(api_key=os.environ['OPENAI_API_KEY']),
+    ruta_sqlite=config['DEFAULT'].get('cache_embeddings_path', fallback='cache_embeddings.db'),
+    max_memoria=config['DEFAULT'].getint('cache_embeddings_max_memoria', fallback=2048),
+    ttl_disco_segundos=config['DEFAULT'].getint('cache_embeddings_ttl_segundos', fallback=30 * 86400),
+    max_disco=config['DEFAULT'].getint('cache_embeddings_max_disco', fallback=100000)
+)
+log_message("Embeddings creados con OpenAI (con caché de consultas).")
 
 # Nota: Se reutiliza el vector store existente, aunque ahora se usará solo para la parte semántica (Chroma)
 vector_store = Chroma(
@@ -110,25 +134,17 @@ def reducir_contenido_por_palabras(text, max_palabras=1000000):
     return text
 
 # --------------------- Nuevas Funciones de Recuperación (Script 2) ---------------------
-def clean_query(query):
-    """Limpia la consulta eliminando caracteres especiales para FTS5."""
-    return re.sub(r'[^\w\s]', '', query)
-
 def retrieve_bm25(query):
     """Búsqueda BM25 con SQLite FTS5."""
     log_message("🔍 Consultando BM25...")
     results = []
     try:
-        conn = sqlite3.connect(bm25_db_path)
-        cursor = conn.cursor()
-        safe_query = clean_query(query)
-        cursor.execute(
-            "SELECT chunk_content FROM chunks WHERE chunk_content MATCH ? LIMIT ?",
-            (safe_query, max_results_bm25)
+        # Ranking real con bm25() de FTS5: RRF recibe los resultados en orden de relevancia
+        results = buscar_bm25(
+            pool_bm25, query, max_results_bm25, modo=bm25_modo_consulta, resaltado=bm25_resaltado,
+            pesos=bm25_pesos
         )
-        results = [{"content": row[0], "source": "BM25"} for row in cursor.fetchall()]
-        conn.close()
-        log_message(f"BM25 encontró {len(results)} resultados.")
+        log_message(f"BM25 encontró {len(results)} resultados. Pool: {pool_bm25.metricas()}")
     except Exception as e:
         log_message(f"❌ Error BM25: {str(e)}", level="ERROR")
     return results
@@ -145,7 +161,7 @@ def retrieve_chromadb(query):
             "score": score,
             "source": "ChromaDB"
         } for doc, score in docs]
-        log_message(f"ChromaDB encontró {len(results)} resultados.")
+        log_message(f"ChromaDB encontró {len(results)} resultados. Caché de embeddings: {embeddings.metricas()}")
     except Exception as e:
         log_message(f"❌ Error ChromaDB: {str(e)}", level="ERROR")
     return results
@@ -224,6 +240,9 @@ def cohere_rerank(query, documents):
         log_message(f"❌ Error Cohere: {str(e)}", level="ERROR")
         return documents[:rerank_top_k]
 
+# Reranking en cascada (opcional): prefiltro barato y Cohere solo sobre la lista corta
+cascada = crear_rerank_cascada(config, lambda query, documents, top_k: cohere_rerank(query, documents))
+
 
 def retrieve(query):
     """
@@ -235,9 +254,15 @@ def retrieve(query):
     Retorna:
     list: Lista de documentos ordenados según relevancia.
     """
-    # Búsquedas paralelas
-    bm25_res = retrieve_bm25(query)
-    chroma_res = retrieve_chromadb(query)
+    # Búsquedas paralelas: la latencia es max(bm25, chroma) en lugar de la suma
+    resultados, degradados = ejecutar_en_paralelo(
+        {"bm25": lambda: retrieve_bm25(query), "chroma": lambda: retrieve_chromadb(query)},
+        {"bm25": timeout_bm25, "chroma": timeout_chroma},
+    )
+    if degradados:
+        log_message(f"⚠️ Recuperación degradada, sin resultados de: {', '.join(degradados)}", level="WARNING")
+    bm25_res = resultados["bm25"]
+    chroma_res = resultados["chroma"]
 
     # Fusión híbrida mejorada
     fused = rank_fusion(bm25_res, chroma_res)
@@ -249,13 +274,29 @@ def retrieve(query):
 
     # Reranking contextual (se mantiene igual)
     if rerank_enabled and len(fused) > 1:
-        fused = cohere_rerank(query, fused)
+        if cascada is not None:
+            fused = cascada.reordenar(query, fused, rerank_top_k)
+            log_message(f"Métricas del reranking en cascada: {cascada.metricas()}")
+        else:
+            fused = cohere_rerank(query, fused)
 
     # Resultados finales
     
     return fused
 
 
+# Calentamiento: consultas sintéticas por retrieve (BM25 en SQLite, Chroma y
+# el reranker) antes de que /readyz informe la réplica como lista
+consultas_sinteticas = consultas_calentamiento(config)
+
+def calentar_recuperacion():
+    for consulta in consultas_sinteticas:
+        retrieve(consulta)
+
+if consultas_sinteticas:
+    contenedor.registrar_calentamiento("retrieve_antro", calentar_recuperacion)
+
+
 
 # --------------------- Grafo Conversacional (LangGraph) ---------------------
 from langgraph.graph import MessagesState, StateGraph
@@ -284,7 +325,12 @@ tools = ToolNode([retrieve])
 def generate(state: MessagesState):
     """Genera la respuesta final usando los documentos recuperados."""
     log_message("########### WEB-generate ---------#####################")
-    recent_tool_messages = [msg for msg in reversed(state["messages"]) if msg.type == "tool"]
+    # Solo los ToolMessages del turno actual (los anteriores pertenecen al historial de la sesión)
+    recent_tool_messages = []
+    for msg in reversed(state["messages"]):
+        if msg.type != "tool":
+            break
+        recent_tool_messages.append(msg)
     
     # 1. Extraer y formatear documentos
     docs_content = "\n\n".join([
@@ -294,7 +340,8 @@ def generate(state: MessagesState):
     
     log_message(f"DOCUMENTOS RECUPERADOS:\n{docs_content}")
     # Validar si los documentos contienen términos clave de la pregunta
-    user_question = state["messages"][0].content.lower()
+    human_messages = [msg for msg in state["messages"] if msg.type == "human"]
+    user_question = human_messages[-1].content.lower()
     terms = user_question.split()
     
     if not any(term in docs_content.lower() for term in terms):
@@ -543,7 +590,7 @@ En tu respuesta debes:
 
     prompt = [
         SystemMessage(content=system_message_content),
-        HumanMessage(content=state["messages"][0].content)  # La pregunta original
+        HumanMessage(content=human_messages[-1].content)  # La pregunta actual de la sesión
     ]
     # Debug: Verificar prompt completo
     
@@ -561,26 +608,64 @@ graph_builder.add_node(generate)
 graph_builder.set_entry_point("query_or_respond")
 graph_builder.add_edge("query_or_respond", "tools")
 graph_builder.add_edge("tools", "generate")
-graph = graph_builder.compile()
+
+# Compilamos el grafo una sola vez por proceso; cada petición usa su propio thread_id
+from registro_grafos import obtener_grafo, nuevo_thread_id, liberar_thread
+from checkpoint_sesiones import crear_checkpointer, configuracion_sesiones, thread_id_de_sesion, recortar_historial
+max_mensajes_sesion = configuracion_sesiones(config)["max_mensajes"]
+graph = obtener_grafo("servicios_simap_antro", graph_builder, checkpointer=crear_checkpointer(config))
+
+# Caché semántico de respuestas; se invalida solo cuando cambia el corpus
+from cache_respuestas import crear_cache_respuestas
+from langchain_core.messages import HumanMessage, AIMessage
+cache_respuestas = crear_cache_respuestas(config, embeddings, [fragment_store_directory, bm25_db_path], "servicios_simap_antro")
 
 # --------------------- Función para Procesar Preguntas ---------------------
-def process_question(question_input: str, fecha_desde: str, fecha_hasta: str, k: int):
+def process_question(question_input: str, fecha_desde: str, fecha_hasta: str, k: int, session_id: str = None):
     log_message("############## Iniciando process_question ##############")
-    from langgraph.checkpoint.memory import MemorySaver
-    memory = MemorySaver()
-    graph = graph_builder.compile(checkpointer=memory)
+    # Con sesión se continúa la conversación del agente; sin sesión, thread efímero
+    thread_id = thread_id_de_sesion(session_id) if session_id else nuevo_thread_id()
+    config_thread = {"configurable": {"thread_id": thread_id}}
     try:
+        mensajes_a_eliminar = recortar_historial(graph, config_thread, max_mensajes_sesion) if session_id else []
+
+        # Caché semántico: solo para preguntas que abren conversación (sin historial previo)
+        sin_historial = not session_id or not graph.get_state(config_thread).values.get("messages")
+        if cache_respuestas is not None and sin_historial:
+            try:
+                respuesta_cacheada = cache_respuestas.buscar(question_input)
+            except Exception as e:
+                log_message(f"Caché semántico no disponible: {str(e)}", level="WARNING")
+                respuesta_cacheada = None
+            if respuesta_cacheada is not None:
+                log_message(f"Respuesta servida desde el caché semántico. {cache_respuestas.metricas()}")
+                if session_id:
+                    # Se registra el turno en la sesión para que las repreguntas tengan contexto
+                    graph.update_state(
+                        config_thread,
+                        {"messages": [HumanMessage(content=question_input), AIMessage(content=respuesta_cacheada)]},
+                        as_node="generate",
+                    )
+                return respuesta_cacheada
         for step in graph.stream(
-            {"messages": [{"role": "user", "content": question_input}]},
+            {"messages": mensajes_a_eliminar + [{"role": "user", "content": question_input}]},
             stream_mode="values",
-            config={"configurable": {"thread_id": "user_question"}},
+            config=config_thread,
         ):
             response = step["messages"][-1].content
             log_message("############## Fin process_question jaja ##############")
+        if cache_respuestas is not None and sin_historial:
+            try:
+                cache_respuestas.guardar(question_input, response)
+            except Exception as e:
+                log_message(f"No se pudo guardar en el caché semántico: {str(e)}", level="WARNING")
         return response
     except Exception as e:
         log_message(f"Error en process_question: {str(e)}", level="ERROR")
         return f"Error: {str(e)}"
+    finally:
+        if not session_id:
+            liberar_thread(graph, thread_id)
 
 # --------------------------------------------------------------------
 # Fin del script mejorado
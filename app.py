@@ -1,5 +1,9 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, make_response, jsonify, Response, stream_with_context
+import configparser
+import json
 import logging
+import re
+import uuid
 
 # Configurar logging para guardar toda la salida en un archivo de log
 logging.basicConfig(filename='app_log.log', level=logging.DEBUG, format='%(asctime)s - %(message)s')
@@ -10,19 +14,74 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config['DEBUG'] = False
 
+from componentes import contenedor, medir_import
+
 try:
    
-    from grafo_AGENTE_SERV_flask import process_question as process_question_servicios  
+    with medir_import("grafo_AGENTE_SERV_flask"):
+        from grafo_AGENTE_SERV_flask import process_question as process_question_servicios  
+        from grafo_AGENTE_SERV_flask import stream_question as stream_question_servicios
     
     logger.info("Módulos importados correctamente")
 except ImportError as e:
     logger.error(f"Error al importar módulos: {e}")
+
+# Embeddings, vector store, LLM y grafo se construyen en segundo plano: el
+# proceso atiende enseguida y /readyz informa cuándo terminó el calentamiento
+_config = configparser.ConfigParser()
+_config.read('config.ini')
+_servidor = _config['SERVIDOR'] if _config.has_section('SERVIDOR') else _config['DEFAULT']
+if _servidor.getboolean('calentar_al_inicio', fallback=True):
+    contenedor.calentar(en_segundo_plano=True)
     
 @app.route('/')
 def home():
     return render_template('inicio.html')
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: el proceso responde; no depende de los componentes ni del calentamiento."""
+    return jsonify({"vivo": True}), 200
+
+@app.route('/readyz')
+def readyz():
+    """
+    Readiness: 200 cuando los componentes pesados están construidos y terminaron
+    las consultas sintéticas del calentamiento, 503 mientras tanto. Con
+    calentar_al_inicio = false, 200 apenas arranca el proceso.
+    """
+    estado = contenedor.estado()
+    return jsonify(estado), 200 if estado["listo"] else 503
+
+
+
+COOKIE_SESION = 'avs_sesion'
 
+def sesion_de_pedido(cookie_actual, agente_id):
+    """
+    Identifica la conversación a partir de la cookie de sesión emitida por el servidor.
+
+    El ID de agente del formulario no alcanza para identificarla (cualquiera
+    podría enviar el de otro agente y leer su historial): solo separa, dentro
+    de la misma cookie, las conversaciones de distintos agentes.
+
+    Returns:
+        tuple: (valor de la cookie de sesión, session_id de la conversación)
+    """
+    cookie = cookie_actual if cookie_actual and re.fullmatch(r"[0-9a-f]{32}", cookie_actual) else uuid.uuid4().hex
+    agente_id = (agente_id or "").strip()[:64]
+    return cookie, f"{cookie}-agente-{agente_id}" if agente_id else cookie
+
+def obtener_sesion_agente():
+    """Cookie de sesión, session_id de la conversación e ID de agente del formulario."""
+    agente_id = request.form.get('agente_id', '').strip() or request.args.get('agente_id', '').strip()
+    cookie, session_id = sesion_de_pedido(request.cookies.get(COOKIE_SESION), agente_id)
+    return cookie, session_id, agente_id
+
+def guardar_cookie_sesion(respuesta, cookie):
+    if request.cookies.get(COOKIE_SESION) != cookie:
+        respuesta.set_cookie(COOKIE_SESION, cookie, httponly=True, samesite='Lax')
+    return respuesta
 
 @app.route('/servicios-simap', methods=['GET', 'POST'])
 def servicios_simap():
@@ -31,21 +90,105 @@ def servicios_simap():
     fecha_desde = "2024-01-01"
     fecha_hasta = "2024-12-31"
     k = 50
+    cookie, session_id, agente_id = obtener_sesion_agente()
+    estado = 200
 
     if request.method == 'POST':
-        pregunta = request.form['pregunta']
-        fecha_desde = request.form.get('fecha_desde', "2024-01-01")
-        fecha_hasta = request.form.get('fecha_hasta', "2024-12-31")
-        k = int(request.form.get('k', 50))
         try:
-            logger.info(f"Procesando pregunta de servicios: {pregunta}")
-            resultado = process_question_servicios(pregunta, fecha_desde, fecha_hasta, k)
-            logger.info(f"Resultado obtenido: {resultado}")
+            pregunta, fecha_desde, fecha_hasta, k = datos_pregunta(request.form)
+        except ValueError as e:
+            pregunta = request.form.get('pregunta', '')
+            resultado, estado = f"Petición inválida: {str(e)}", 400
+        else:
+            try:
+                logger.info(f"Procesando pregunta de servicios (sesión {session_id}): {pregunta}")
+                resultado = process_question_servicios(pregunta, fecha_desde, fecha_hasta, k, session_id=session_id)
+                logger.info(f"Resultado obtenido: {resultado}")
+            except Exception as e:
+                logger.error(f"Error al procesar la pregunta de servicios: {str(e)}")
+                resultado = f"Error al procesar la pregunta: {str(e)}"
+
+    respuesta = make_response(render_template('servicios_simap.html', resultado=resultado, pregunta=pregunta, fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, k=k, agente_id=agente_id))
+    respuesta.status_code = estado
+    return guardar_cookie_sesion(respuesta, cookie)
+
+def datos_pregunta(datos):
+    """
+    Pregunta, fechas y k de un formulario o JSON, con los valores por defecto del formulario.
+
+    Raises:
+        ValueError: si `pregunta` no es texto o `k` no es un entero positivo
+    """
+    pregunta = datos.get('pregunta') or ''
+    if not isinstance(pregunta, str):
+        raise ValueError("pregunta debe ser texto")
+    try:
+        k = int(datos.get('k') or 50)
+    except (TypeError, ValueError):
+        raise ValueError("k debe ser un entero positivo")
+    if k <= 0:
+        raise ValueError("k debe ser un entero positivo")
+    return (
+        pregunta.strip(),
+        datos.get('fecha_desde') or "2024-01-01",
+        datos.get('fecha_hasta') or "2024-12-31",
+        k,
+    )
+
+def evento_sse(datos, evento=None):
+    """Serializa un evento Server-Sent Events con los datos en JSON."""
+    linea_evento = f"event: {evento}\n" if evento else ""
+    return f"{linea_evento}data: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@app.route('/servicios-simap/stream', methods=['POST'])
+def servicios_simap_stream():
+    """Respuesta de /servicios-simap token a token (Server-Sent Events), a medida que la genera el LLM."""
+    try:
+        pregunta, fecha_desde, fecha_hasta, k = datos_pregunta(request.form)
+    except ValueError as e:
+        return jsonify({"error": f"Petición inválida: {str(e)}"}), 400
+    if not pregunta:
+        return jsonify({"error": "Falta la pregunta"}), 400
+    cookie, session_id, agente_id = obtener_sesion_agente()
+
+    def eventos():
+        logger.info(f"Procesando pregunta de servicios en streaming (sesión {session_id}): {pregunta}")
+        try:
+            for fragmento in stream_question_servicios(pregunta, fecha_desde, fecha_hasta, k, session_id=session_id):
+                yield evento_sse({"texto": fragmento})
+            yield evento_sse({}, "fin")
         except Exception as e:
-            logger.error(f"Error al procesar la pregunta de servicios: {str(e)}")
-            resultado = f"Error al procesar la pregunta: {str(e)}"
+            logger.error(f"Error al procesar la pregunta de servicios en streaming: {str(e)}")
+            yield evento_sse({"error": f"Error al procesar la pregunta: {str(e)}"}, "error")
+
+    respuesta = Response(stream_with_context(eventos()), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    # Sin buffer en un proxy nginx delante de la app
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return guardar_cookie_sesion(respuesta, cookie)
+
+@app.route('/api/servicios-simap', methods=['POST'])
+def api_servicios_simap():
+    """
+    Versión JSON de /servicios-simap.
 
-    return render_template('servicios_simap.html', resultado=resultado, pregunta=pregunta, fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, k=k)
+    Servida por asgi.py, la misma ruta corre en el event loop (process_question_async).
+    """
+    datos = request.get_json(silent=True)
+    if datos is None:
+        datos = request.form
+    elif not isinstance(datos, dict):
+        return jsonify({"error": "Petición inválida: se esperaba un objeto JSON"}), 400
+    try:
+        pregunta, fecha_desde, fecha_hasta, k = datos_pregunta(datos)
+    except ValueError as e:
+        return jsonify({"error": f"Petición inválida: {str(e)}"}), 400
+    if not pregunta:
+        return jsonify({"error": "Falta la pregunta"}), 400
+    cookie, session_id = sesion_de_pedido(request.cookies.get(COOKIE_SESION), str(datos.get('agente_id') or ''))
+    logger.info(f"Procesando pregunta de servicios por API (sesión {session_id}): {pregunta}")
+    resultado = process_question_servicios(pregunta, fecha_desde, fecha_hasta, k, session_id=session_id)
+    return guardar_cookie_sesion(jsonify({"resultado": resultado}), cookie)
 
 
 
@@ -0,0 +1,109 @@
+"""
+Punto de entrada ASGI: preguntas asíncronas en el event loop del servidor.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+
+POST /api/servicios-simap se atiende con process_question_async (graph.astream,
+ainvoke en el LLM y recuperación asíncrona): mientras una pregunta espera al
+LLM el mismo event loop atiende otras, así un worker sostiene cientos de
+preguntas en vuelo sin un hilo por petición. El resto de las rutas de app.py
+(las páginas HTML) siguen siendo Flask y corren en un pool de hilos (a2wsgi).
+
+Con gunicorn (wsgi.py) la misma ruta existe pero es síncrona: un hilo por
+pregunta en vuelo.
+
+Configuración en config.ini, sección [SERVIDOR]:
+    hilos_wsgi = 16      (hilos para las rutas Flask bajo ASGI)
+"""
+
+import configparser
+import json
+import logging
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+
+from app import app as app_flask, COOKIE_SESION, datos_pregunta, sesion_de_pedido
+from grafo_AGENTE_SERV_flask import process_question_async
+
+RUTA_ASINCRONA = "/api/servicios-simap"
+
+_config = configparser.ConfigParser()
+_config.read('config.ini')
+_servidor = _config['SERVIDOR'] if _config.has_section('SERVIDOR') else _config['DEFAULT']
+_app_wsgi = WSGIMiddleware(app_flask, workers=_servidor.getint('hilos_wsgi', fallback=16))
+
+
+async def _leer_cuerpo(receive):
+    partes = []
+    while True:
+        mensaje = await receive()
+        partes.append(mensaje.get("body", b""))
+        if not mensaje.get("more_body"):
+            return b"".join(partes)
+
+
+def _datos(encabezados, cuerpo):
+    """Campos de la pregunta desde JSON o desde un formulario urlencoded."""
+    if encabezados.get("content-type", "").startswith("application/json"):
+        datos = json.loads(cuerpo or b"{}")
+        if not isinstance(datos, dict):
+            raise ValueError("se esperaba un objeto JSON")
+        return datos
+    return dict(parse_qsl(cuerpo.decode("utf-8")))
+
+
+def _cookie_sesion(encabezados):
+    try:
+        cookies = SimpleCookie(encabezados.get("cookie", ""))
+    except CookieError:
+        return None
+    return cookies[COOKIE_SESION].value if COOKIE_SESION in cookies else None
+
+
+async def _responder_json(send, estado, contenido, cookie=None):
+    cuerpo = json.dumps(contenido, ensure_ascii=False).encode("utf-8")
+    encabezados = [(b"content-type", b"application/json"), (b"content-length", str(len(cuerpo)).encode())]
+    if cookie:
+        encabezados.append((b"set-cookie", cookie.encode("latin-1")))
+    await send({"type": "http.response.start", "status": estado, "headers": encabezados})
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+async def _pregunta_asincrona(scope, receive, send):
+    encabezados = {clave.decode("latin-1").lower(): valor.decode("latin-1") for clave, valor in scope["headers"]}
+    try:
+        datos = _datos(encabezados, await _leer_cuerpo(receive))
+        pregunta, fecha_desde, fecha_hasta, k = datos_pregunta(datos)
+    except (ValueError, UnicodeDecodeError) as e:
+        await _responder_json(send, 400, {"error": f"Petición inválida: {str(e)}"})
+        return
+    if not pregunta:
+        await _responder_json(send, 400, {"error": "Falta la pregunta"})
+        return
+
+    cookie_actual = _cookie_sesion(encabezados)
+    cookie, session_id = sesion_de_pedido(cookie_actual, str(datos.get("agente_id") or ""))
+    logging.info(f"Procesando pregunta de servicios por API asíncrona (sesión {session_id}): {pregunta}")
+    resultado = await process_question_async(pregunta, fecha_desde, fecha_hasta, k, session_id=session_id)
+
+    set_cookie = None
+    if cookie_actual != cookie:
+        set_cookie = f"{COOKIE_SESION}={cookie}; HttpOnly; Path=/; SameSite=Lax"
+    await _responder_json(send, 200, {"resultado": resultado}, set_cookie)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            mensaje = await receive()
+            if mensaje["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif mensaje["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] == "http" and scope["path"] == RUTA_ASINCRONA and scope["method"] == "POST":
+        await _pregunta_asincrona(scope, receive, send)
+        return
+    await _app_wsgi(scope, receive, send)
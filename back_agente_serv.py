@@ -141,11 +141,17 @@ tools = ToolNode([retrieve])
 def generate(state: MessagesState):
     """Genera la respuesta final usando los documentos recuperados."""
     log_message(f"###########WEB-generate---------#####################")
-    recent_tool_messages = [msg for msg in reversed(state["messages"]) if msg.type == "tool"]
+    # Solo los ToolMessages del turno actual (los anteriores pertenecen al historial de la sesión)
+    recent_tool_messages = []
+    for msg in reversed(state["messages"]):
+        if msg.type != "tool":
+            break
+        recent_tool_messages.append(msg)
     docs_content = "\n\n".join(doc.content for doc in recent_tool_messages[::-1])
 
     # Validar si los documentos contienen términos clave de la pregunta
-    user_question = state["messages"][0].content.lower()
+    human_messages = [msg for msg in state["messages"] if msg.type == "human"]
+    user_question = human_messages[-1].content.lower()
 
     terms = user_question.split()
 
@@ -564,29 +570,34 @@ graph_builder.add_node(generate)
 graph_builder.set_entry_point("query_or_respond")
 graph_builder.add_edge("query_or_respond", "tools")
 graph_builder.add_edge("tools", "generate")
-graph = graph_builder.compile()
+
+# Compilamos el grafo una sola vez por proceso; cada petición usa su propio thread_id
+from registro_grafos import obtener_grafo, nuevo_thread_id, liberar_thread
+from checkpoint_sesiones import crear_checkpointer, configuracion_sesiones, thread_id_de_sesion, recortar_historial
+max_mensajes_sesion = configuracion_sesiones(config)["max_mensajes"]
+graph = obtener_grafo("servicios_simap_back", graph_builder, checkpointer=crear_checkpointer(config))
 
 # Función para procesar preguntas
-def process_question(question_input: str, fecha_desde: str, fecha_hasta: str, k: int):
+def process_question(question_input: str, fecha_desde: str, fecha_hasta: str, k: int, session_id: str = None):
     log_message (f"##############-------PROCESSS_QUESTION----------#####################")
-# 💾 Gestionar el Historial de Conversación (Memory)
-    from langgraph.checkpoint.memory import MemorySaver
-
-# Configuración del checkpointer de memoria
-    memory = MemorySaver()
-    graph = graph_builder.compile(checkpointer=memory)
-
-   
+    # 💾 El grafo ya está compilado; aislamos la petición con un thread_id propio
+    # Con sesión se continúa la conversación del agente; sin sesión, thread efímero
+    thread_id = thread_id_de_sesion(session_id) if session_id else nuevo_thread_id()
+    config_thread = {"configurable": {"thread_id": thread_id}}
    
     try:
+        mensajes_a_eliminar = recortar_historial(graph, config_thread, max_mensajes_sesion) if session_id else []
         for step in graph.stream(
-            {"messages": [{"role": "user", "content": question_input}]},
+            {"messages": mensajes_a_eliminar + [{"role": "user", "content": question_input}]},
             stream_mode="values",
-            config={"configurable": {"thread_id": "user_question"}},
+            config=config_thread,
         ):
             response = step["messages"][-1].content
             log_message(f"##############-------FIN ROCESSS_QUESTION----------#####################")
         return response
     except Exception as e:
        
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return f"Error: {str(e)}"
+    finally:
+        if not session_id:
+            liberar_thread(graph, thread_id)
@@ -0,0 +1,161 @@
+"""
+Benchmark de carga: camino síncrono (un hilo por pregunta) contra asíncrono (event loop).
+
+Usa la misma topología que el agente (query_or_respond -> tools -> generate)
+con nodos simulados cuya latencia imita la espera de las llamadas al LLM y de
+la recuperación, así que no necesita API keys ni la base vectorial: mide
+cuántas preguntas por segundo se sostienen con `concurrencia` preguntas en
+vuelo.
+
+- Síncrono: graph.stream en un pool de `hilos` hilos (como un worker gthread).
+- Asíncrono: graph.astream con todas las preguntas en vuelo en un solo event loop.
+
+Uso:
+    python bench_concurrencia.py [cantidad_preguntas] [concurrencia] [hilos] [latencia_llm_s]
+"""
+
+import asyncio
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import StructuredTool
+from langgraph.graph import MessagesState, StateGraph
+from langgraph.prebuilt import ToolNode
+
+from registro_grafos import obtener_grafo, nuevo_thread_id, liberar_thread
+
+LATENCIA_LLM = 0.5
+LATENCIA_RECUPERACION = 0.05
+
+
+def _retrieve(query: str):
+    """Recuperación simulada."""
+    time.sleep(LATENCIA_RECUPERACION)
+    return f"FRAGMENTO simulado para: {query}"
+
+
+async def _aretrieve(query: str):
+    """Recuperación simulada."""
+    await asyncio.sleep(LATENCIA_RECUPERACION)
+    return f"FRAGMENTO simulado para: {query}"
+
+
+retrieve = StructuredTool.from_function(func=_retrieve, coroutine=_aretrieve, name="retrieve")
+
+
+def _llamada_herramienta(state):
+    pregunta = state["messages"][-1].content
+    return {"messages": [AIMessage(content="", tool_calls=[
+        {"name": "retrieve", "args": {"query": pregunta}, "id": "llamada-1"}
+    ])]}
+
+
+def query_or_respond(state: MessagesState):
+    time.sleep(LATENCIA_LLM)
+    return _llamada_herramienta(state)
+
+
+async def aquery_or_respond(state: MessagesState):
+    await asyncio.sleep(LATENCIA_LLM)
+    return _llamada_herramienta(state)
+
+
+def generate(state: MessagesState):
+    time.sleep(LATENCIA_LLM)
+    return {"messages": [AIMessage(content="Respuesta simulada")]}
+
+
+async def agenerate(state: MessagesState):
+    await asyncio.sleep(LATENCIA_LLM)
+    return {"messages": [AIMessage(content="Respuesta simulada")]}
+
+
+def construir_graph_builder():
+    graph_builder = StateGraph(MessagesState)
+    graph_builder.add_node("query_or_respond", RunnableLambda(query_or_respond, afunc=aquery_or_respond))
+    graph_builder.add_node(ToolNode([retrieve]))
+    graph_builder.add_node("generate", RunnableLambda(generate, afunc=agenerate))
+    graph_builder.set_entry_point("query_or_respond")
+    graph_builder.add_edge("query_or_respond", "tools")
+    graph_builder.add_edge("tools", "generate")
+    return graph_builder
+
+
+def _entrada():
+    return {"messages": [{"role": "user", "content": "¿Cómo tramitar pañales?"}]}
+
+
+def _resumen(latencias, segundos):
+    latencias = sorted(latencias)
+    return {
+        "preguntas_por_segundo": len(latencias) / segundos,
+        "p50_ms": statistics.median(latencias) * 1000,
+        "p95_ms": latencias[int(len(latencias) * 0.95) - 1] * 1000,
+    }
+
+
+def bench_sincrono(graph, cantidad, hilos):
+    def pregunta():
+        inicio = time.perf_counter()
+        thread_id = nuevo_thread_id()
+        try:
+            for _ in graph.stream(_entrada(), stream_mode="values", config={"configurable": {"thread_id": thread_id}}):
+                pass
+        finally:
+            liberar_thread(graph, thread_id)
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        latencias = list(pool.map(lambda _: pregunta(), range(cantidad)))
+    resumen = _resumen(latencias, time.perf_counter() - inicio)
+    resumen["hilos"] = hilos
+    return resumen
+
+
+async def bench_asincrono(graph, cantidad, concurrencia):
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def pregunta():
+        async with semaforo:
+            inicio = time.perf_counter()
+            thread_id = nuevo_thread_id()
+            try:
+                async for _ in graph.astream(_entrada(), stream_mode="values",
+                                             config={"configurable": {"thread_id": thread_id}}):
+                    pass
+            finally:
+                liberar_thread(graph, thread_id)
+            return time.perf_counter() - inicio
+
+    hilos_antes = threading.active_count()
+    inicio = time.perf_counter()
+    latencias = await asyncio.gather(*(pregunta() for _ in range(cantidad)))
+    resumen = _resumen(latencias, time.perf_counter() - inicio)
+    resumen["hilos"] = threading.active_count() - hilos_antes
+    return resumen
+
+
+if __name__ == "__main__":
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    concurrencia = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    hilos = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    LATENCIA_LLM = float(sys.argv[4]) if len(sys.argv) > 4 else LATENCIA_LLM
+
+    graph = obtener_grafo("bench_concurrencia", construir_graph_builder())
+
+    sincrono = bench_sincrono(graph, cantidad, min(hilos, concurrencia))
+    asincrono = asyncio.run(bench_asincrono(graph, cantidad, concurrencia))
+
+    print(f"Preguntas: {cantidad}, en vuelo: {concurrencia}, latencia simulada del LLM: {LATENCIA_LLM} s x 2")
+    for nombre, resumen in (("Síncrono ", sincrono), ("Asíncrono", asincrono)):
+        print(
+            f"{nombre}: {resumen['preguntas_por_segundo']:.1f} preguntas/s, "
+            f"p50 {resumen['p50_ms']:.0f} ms, p95 {resumen['p95_ms']:.0f} ms, hilos {resumen['hilos']}"
+        )
+    print(f"Mejora de throughput: {asincrono['preguntas_por_segundo'] / sincrono['preguntas_por_segundo']:.1f}x")
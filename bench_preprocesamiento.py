@@ -0,0 +1,73 @@
+"""
+Benchmark del preprocesamiento de la ingesta: en serie contra el pool de procesos.
+
+Genera registros sintéticos con la forma de los del export (campos con
+entidades HTML y saltos de línea) y los pasa por `PreprocesadorParalelo`
+con distintas cantidades de procesos y tamaños de unidad, en lotes como los
+de la carga. No necesita API keys ni la base vectorial: mide solo la
+normalización y el chunking.
+
+Resultado medido (5000 registros en lotes de 500, modo palabras, 1 CPU):
+en serie 3.32 s; 2 procesos 4.62 s con unidades de 16 registros y 4.40 s
+con una unidad por proceso; 4 procesos 5.10 s y 5.39 s (0.62-0.75x). Con un
+solo núcleo el pool solo agrega serialización y cambios de contexto, por eso
+el preprocesador corre en serie por defecto. El modo 'tokens' (tiktoken, el
+más caro por registro y el único candidato razonable a ganar con procesos)
+no se pudo medir en esa máquina porque descarga el encoding por red: antes
+de subir procesos_preprocesamiento conviene correr este benchmark en la
+máquina de la ingesta con el modo que use la carga.
+
+Uso:
+    python bench_preprocesamiento.py [cantidad_registros] [modo]
+"""
+
+import os
+import random
+import sys
+import time
+
+from preprocesamiento import PreprocesadorParalelo
+
+PLANTILLA = "[SERVICIO: {servicio}] [TIPO: {tipo}] [SUBTIPO: {subtipo}] [ID_SUB: {id_sub}]   {campo}:{texto}"
+PALABRAS = ("trámite", "pañales", "prestación", "afiliado", "&aacute;rea", "requisito",
+            "documentaci&oacute;n", "reintegro", "autorización", "médico", "&nbsp;", "plazo")
+TAMANO_LOTE = 500
+
+
+def registros_sinteticos(cantidad, semilla=0):
+    azar = random.Random(semilla)
+
+    def texto(palabras):
+        return " ".join(azar.choice(PALABRAS) + ("\n" if azar.random() < 0.05 else "") for _ in range(palabras))
+
+    return [{
+        "SERVICIO": f"Servicio {i % 50}", "TIPO": "Prestación", "SUBTIPO": "Subtipo &amp; otros",
+        "ID_SUB": str(i), "COPETE": texto(40), "CONSISTE": texto(250), "REQUISITOS": texto(150),
+        "PAUTAS": texto(120), "QUIEN_PUEDE": texto(30), "COMO_LO_HACEN": texto(80),
+    } for i in range(cantidad)]
+
+
+def medir(registros, procesos, tamano_unidad, modo):
+    preprocesador = PreprocesadorParalelo(procesos=procesos, tamano_unidad=tamano_unidad).iniciar()
+    try:
+        inicio = time.perf_counter()
+        for i in range(0, len(registros), TAMANO_LOTE):
+            preprocesador.preprocesar(registros[i:i + TAMANO_LOTE], plantilla=PLANTILLA,
+                                      tamano_chunk=200, solapamiento=20, modo=modo)
+        return time.perf_counter() - inicio
+    finally:
+        preprocesador.cerrar()
+
+
+if __name__ == "__main__":
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    modo = sys.argv[2] if len(sys.argv) > 2 else "palabras"
+    registros = registros_sinteticos(cantidad)
+    print(f"{cantidad} registros, modo {modo}, lotes de {TAMANO_LOTE}, {os.cpu_count()} CPU")
+    serie = medir(registros, 1, 0, modo)
+    print(f"  en serie:                        {serie:6.2f} s")
+    for procesos in sorted({2, 4, os.cpu_count() or 1} - {1}):
+        for tamano_unidad in (16, 0):
+            segundos = medir(registros, procesos, tamano_unidad, modo)
+            unidad = "una por proceso" if tamano_unidad == 0 else f"{tamano_unidad} registros"
+            print(f"  {procesos} procesos, unidad {unidad:16} {segundos:6.2f} s ({serie / segundos:.2f}x)")
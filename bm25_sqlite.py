@@ -0,0 +1,388 @@
+"""
+Acceso de solo lectura al índice BM25 (SQLite FTS5).
+
+Cada hilo trabajador abre la base una única vez, en modo solo lectura
+(URI `mode=ro`), con pragmas ajustados para consultas (mmap, caché de
+páginas, query_only). Las sentencias SQL son constantes, así que el caché
+de sentencias preparadas del módulo sqlite3 las reutiliza entre consultas.
+
+Los resultados se ordenan con la función bm25() de FTS5 y devuelven su
+puntaje, de modo que la fusión RRF trabaja sobre un ranking real.
+
+Memoria por worker: el caché de páginas es de cada conexión y hay una por
+hilo que consulta. Las consultas corren en el pool de recuperacion_concurrente,
+de [SERVIDOR] threads x 2 hilos (32 con la configuración por defecto), así que
+con 4 MiB por conexión son hasta 128 MiB por worker (con 64 MiB eran 2 GiB). El mmap no se suma por
+conexión: todas mapean el mismo archivo y comparten las páginas del caché
+del sistema operativo, así que las lecturas calientes se sirven desde ahí y
+el caché de páginas de SQLite puede ser chico.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+MMAP_SIZE_POR_DEFECTO = 256 * 1024 * 1024   # 256 MiB
+CACHE_SIZE_KIB_POR_DEFECTO = 4 * 1024       # 4 MiB de caché de páginas por conexión
+SENTENCIAS_EN_CACHE = 128
+
+
+class PoolBM25:
+    """Pool thread-safe de conexiones de solo lectura, una por hilo trabajador."""
+
+    def __init__(self, ruta_db, mmap_size=MMAP_SIZE_POR_DEFECTO, cache_size_kib=CACHE_SIZE_KIB_POR_DEFECTO,
+                 sentencias_en_cache=SENTENCIAS_EN_CACHE):
+        self.ruta_db = ruta_db
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.sentencias_en_cache = sentencias_en_cache
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conexiones = []
+        self._pid = os.getpid()
+        # Esquema detectado y versión del archivo con la que se detectó (ver esquema_estructurado)
+        self.estructurado = None
+        self.version_esquema = None
+        self._metricas = {
+            "conexiones_abiertas": 0,
+            "consultas": 0,
+            "reutilizaciones": 0,
+            "errores": 0,
+            "segundos_en_consultas": 0.0,
+        }
+
+    def _abrir(self):
+        uri = Path(self.ruta_db).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=self.sentencias_en_cache)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        with self._lock:
+            self._conexiones.append(conn)
+            self._metricas["conexiones_abiertas"] += 1
+        return conn
+
+    def _verificar_fork(self):
+        # Las conexiones SQLite no deben cruzar un fork: el hijo abre las suyas
+        if os.getpid() != self._pid:
+            with self._lock:
+                self._pid = os.getpid()
+                self._conexiones = []
+                self._local = threading.local()
+                self.estructurado = None
+
+    def conexion(self):
+        """Devuelve la conexión del hilo actual, abriéndola la primera vez."""
+        self._verificar_fork()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._abrir()
+            self._local.conn = conn
+        else:
+            with self._lock:
+                self._metricas["reutilizaciones"] += 1
+        return conn
+
+    def consultar(self, sql, parametros=()):
+        """Ejecuta una consulta de lectura y devuelve todas las filas."""
+        inicio = time.perf_counter()
+        try:
+            filas = self.conexion().execute(sql, parametros).fetchall()
+        except Exception:
+            with self._lock:
+                self._metricas["errores"] += 1
+            raise
+        with self._lock:
+            self._metricas["consultas"] += 1
+            self._metricas["segundos_en_consultas"] += time.perf_counter() - inicio
+        return filas
+
+    def metricas(self):
+        """Devuelve una copia de las métricas del pool."""
+        with self._lock:
+            metricas = dict(self._metricas)
+            metricas["conexiones_activas"] = len(self._conexiones)
+        consultas = metricas["consultas"]
+        metricas["ms_promedio_por_consulta"] = (
+            metricas["segundos_en_consultas"] * 1000 / consultas if consultas else 0.0
+        )
+        return metricas
+
+    def cerrar(self):
+        """Cierra todas las conexiones abiertas por el pool."""
+        with self._lock:
+            conexiones, self._conexiones = self._conexiones, []
+            self._local = threading.local()
+            self.estructurado = None
+        for conn in conexiones:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+
+
+_pools = {}
+_lock_pools = threading.Lock()
+
+
+def obtener_pool(ruta_db, **opciones):
+    """Devuelve el pool compartido del proceso para `ruta_db`."""
+    with _lock_pools:
+        pool = _pools.get(ruta_db)
+        if pool is None:
+            pool = PoolBM25(ruta_db, **opciones)
+            _pools[ruta_db] = pool
+        return pool
+
+
+# --------------------- Consultas FTS5 rankeadas ---------------------
+MODOS_CONSULTA = ("AND", "OR", "NEAR", "PREFIJO")
+DISTANCIA_NEAR = 10
+
+_RE_NO_PALABRA = re.compile(r'[^\w\s]')
+
+SQL_BM25 = (
+    "SELECT chunk_content, bm25(chunks) AS rango FROM chunks "
+    "WHERE chunks MATCH ? ORDER BY rango LIMIT ?"
+)
+SQL_BM25_SNIPPET = (
+    "SELECT chunk_content, bm25(chunks) AS rango, snippet(chunks, 0, '<b>', '</b>', '…', ?) "
+    "FROM chunks WHERE chunks MATCH ? ORDER BY rango LIMIT ?"
+)
+SQL_BM25_HIGHLIGHT = (
+    "SELECT chunk_content, bm25(chunks) AS rango, highlight(chunks, 0, '<b>', '</b>') "
+    "FROM chunks WHERE chunks MATCH ? ORDER BY rango LIMIT ?"
+)
+
+
+def construir_consulta_fts(query, modo="OR", distancia_near=DISTANCIA_NEAR):
+    """
+    Convierte la pregunta del usuario en una expresión MATCH de FTS5.
+
+    Cada término va entre comillas para que palabras como AND/OR/NOT de la
+    pregunta no se interpreten como operadores.
+
+    Args:
+        query (str): Pregunta del usuario
+        modo (str): AND (todos los términos), OR (cualquiera, rankeado por bm25),
+                    NEAR (términos cercanos) o PREFIJO (OR con coincidencia por prefijo)
+        distancia_near (int): Distancia máxima en tokens para el modo NEAR
+
+    Returns:
+        str: Expresión MATCH, vacía si la pregunta no tiene términos
+    """
+    modo = modo.upper()
+    if modo not in MODOS_CONSULTA:
+        raise ValueError(f"Modo de consulta BM25 inválido: {modo}. Opciones: {', '.join(MODOS_CONSULTA)}")
+    terminos = _RE_NO_PALABRA.sub(' ', query).split()
+    if not terminos:
+        return ""
+    citados = [f'"{termino}"' for termino in terminos]
+    if modo == "AND":
+        return " AND ".join(citados)
+    if modo == "NEAR":
+        return f"NEAR({' '.join(citados)}, {int(distancia_near)})"
+    if modo == "PREFIJO":
+        return " OR ".join(f"{citado}*" for citado in citados)
+    return " OR ".join(citados)
+
+
+# --------------------- Esquema estructurado (external content) ---------------------
+# El texto y la metadata viven en la tabla `fragmentos`; la tabla FTS5 `chunks`
+# solo indexa el texto del chunk, su contexto y el subtipo, y guarda id_sub/campo
+# sin indexar. La metadata ya no se repite dentro del texto indexado, y los
+# filtros por servicio/tipo usan índices comunes de `fragmentos`.
+COLUMNAS_FTS = ("chunk_texto", "contexto", "subtipo")
+PESOS_POR_DEFECTO = (1.0, 0.5, 2.0)
+
+ESQUEMA_BM25 = """
+CREATE TABLE IF NOT EXISTS fragmentos (
+    id INTEGER PRIMARY KEY,
+    chunk_texto TEXT NOT NULL,
+    contexto TEXT,
+    servicio TEXT,
+    tipo TEXT,
+    subtipo TEXT,
+    id_sub TEXT,
+    campo TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_fragmentos_servicio_tipo ON fragmentos(servicio, tipo);
+CREATE INDEX IF NOT EXISTS idx_fragmentos_id_sub ON fragmentos(id_sub);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+    chunk_texto, contexto, subtipo, id_sub UNINDEXED, campo UNINDEXED,
+    content='fragmentos', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS fragmentos_ai AFTER INSERT ON fragmentos BEGIN
+    INSERT INTO chunks(rowid, chunk_texto, contexto, subtipo, id_sub, campo)
+    VALUES (new.id, new.chunk_texto, new.contexto, new.subtipo, new.id_sub, new.campo);
+END;
+CREATE TRIGGER IF NOT EXISTS fragmentos_ad AFTER DELETE ON fragmentos BEGIN
+    INSERT INTO chunks(chunks, rowid, chunk_texto, contexto, subtipo, id_sub, campo)
+    VALUES ('delete', old.id, old.chunk_texto, old.contexto, old.subtipo, old.id_sub, old.campo);
+END;
+CREATE TRIGGER IF NOT EXISTS fragmentos_au AFTER UPDATE ON fragmentos BEGIN
+    INSERT INTO chunks(chunks, rowid, chunk_texto, contexto, subtipo, id_sub, campo)
+    VALUES ('delete', old.id, old.chunk_texto, old.contexto, old.subtipo, old.id_sub, old.campo);
+    INSERT INTO chunks(rowid, chunk_texto, contexto, subtipo, id_sub, campo)
+    VALUES (new.id, new.chunk_texto, new.contexto, new.subtipo, new.id_sub, new.campo);
+END;
+"""
+
+_FILTROS_PERMITIDOS = ("servicio", "tipo", "subtipo", "id_sub", "campo")
+
+
+def crear_esquema_bm25(conn):
+    """
+    Crea el esquema estructurado del índice BM25.
+
+    Si la base tiene el esquema anterior (`chunks` FTS5 de una sola columna,
+    sin tabla `fragmentos`), se descarta para reconstruirlo.
+    """
+    tablas = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "chunks" in tablas and "fragmentos" not in tablas:
+        conn.execute("DROP TABLE chunks")
+    conn.executescript(ESQUEMA_BM25)
+
+
+def formatear_fragmento(chunk_texto, contexto=None, servicio="", tipo="", subtipo="", id_sub=""):
+    """Texto completo del fragmento tal como se guarda en Chroma y se entrega al LLM."""
+    fragmento = (
+        f"<fragmento>[SERVICIO: {servicio}] [TIPO: {tipo}] [SUBTIPO: {subtipo}] [ID_SUB: {id_sub}] {chunk_texto}</fragmento>"
+    )
+    if contexto is None:
+        return fragmento
+    return f"<contexto>{contexto}</contexto> {fragmento}"
+
+
+def insertar_fragmento(cursor, chunk_texto, contexto=None, servicio="", tipo="", subtipo="", id_sub="", campo=None):
+    """Inserta un fragmento; el trigger lo agrega al índice FTS5."""
+    cursor.execute(
+        "INSERT INTO fragmentos (chunk_texto, contexto, servicio, tipo, subtipo, id_sub, campo) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (chunk_texto, contexto, servicio, tipo, subtipo, str(id_sub), campo)
+    )
+    return cursor.lastrowid
+
+
+def eliminar_fragmentos(cursor, id_sub):
+    """Borra los fragmentos de un ID_SUB; el trigger los quita del índice FTS5."""
+    cursor.execute("DELETE FROM fragmentos WHERE id_sub = ?", (str(id_sub),))
+    return cursor.rowcount
+
+
+def optimizar_indice(conn):
+    """Fusiona los segmentos del índice FTS5 (índice más chico y consultas más rápidas)."""
+    conn.execute("INSERT INTO chunks(chunks) VALUES ('optimize')")
+
+
+def _version_archivo(ruta_db):
+    """Fecha de modificación del índice y de su WAL: cambia cuando el loader lo reconstruye o migra."""
+    version = []
+    for ruta in (ruta_db, f"{ruta_db}-wal"):
+        try:
+            version.append(os.stat(ruta).st_mtime_ns)
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+def esquema_estructurado(pool):
+    """
+    Indica si el índice del pool usa el esquema estructurado.
+
+    Se detecta de nuevo cuando el pool se reinicia (fork, cerrar) o cuando
+    cambia el archivo del índice, así un servidor en marcha sigue al loader.
+    """
+    version = _version_archivo(pool.ruta_db)
+    if pool.estructurado is None or pool.version_esquema != version:
+        filas = pool.consultar("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fragmentos'")
+        pool.estructurado, pool.version_esquema = bool(filas), version
+    return pool.estructurado
+
+
+def _sql_estructurado(resaltado, filtros):
+    columnas = "f.chunk_texto, f.contexto, f.servicio, f.tipo, f.subtipo, f.id_sub, bm25(chunks, ?, ?, ?) AS rango"
+    if resaltado == "snippet":
+        columnas += ", snippet(chunks, 0, '<b>', '</b>', '…', ?)"
+    elif resaltado == "highlight":
+        columnas += ", highlight(chunks, 0, '<b>', '</b>')"
+    condiciones = "".join(f" AND f.{campo} = ?" for campo in filtros)
+    return (
+        f"SELECT {columnas} FROM chunks JOIN fragmentos f ON f.id = chunks.rowid "
+        f"WHERE chunks MATCH ?{condiciones} ORDER BY rango LIMIT ?"
+    )
+
+
+def buscar_bm25(pool, query, limite, modo="OR", resaltado=None, tokens_snippet=24, filtros=None, pesos=PESOS_POR_DEFECTO):
+    """
+    Búsqueda BM25 ordenada por bm25() de FTS5.
+
+    Args:
+        pool (PoolBM25): Pool de conexiones al índice
+        query (str): Pregunta del usuario
+        limite (int): Máximo de filas a devolver
+        modo (str): Modo de consulta (ver construir_consulta_fts)
+        resaltado (str): None, 'snippet' o 'highlight' para devolver el texto marcado
+        tokens_snippet (int): Largo en tokens del snippet
+        filtros (dict): Filtros exactos por servicio, tipo, subtipo, id_sub o campo
+                        (solo esquema estructurado)
+        pesos (tuple): Pesos de bm25() para chunk_texto, contexto y subtipo
+                       (solo esquema estructurado)
+
+    Returns:
+        list: Diccionarios con content, score (mayor es mejor), source,
+              metadata (esquema estructurado) y opcionalmente snippet
+    """
+    consulta = construir_consulta_fts(query, modo)
+    if not consulta:
+        return []
+
+    if not esquema_estructurado(pool):
+        if filtros:
+            raise ValueError("Los filtros requieren el esquema BM25 estructurado; recargue el índice.")
+        if resaltado == "snippet":
+            filas = pool.consultar(SQL_BM25_SNIPPET, (tokens_snippet, consulta, limite))
+        elif resaltado == "highlight":
+            filas = pool.consultar(SQL_BM25_HIGHLIGHT, (consulta, limite))
+        else:
+            filas = pool.consultar(SQL_BM25, (consulta, limite))
+
+        resultados = []
+        for fila in filas:
+            # bm25() devuelve valores negativos: más negativo = más relevante
+            resultado = {"content": fila[0], "score": -fila[1], "source": "BM25"}
+            if resaltado:
+                resultado["snippet"] = fila[2]
+            resultados.append(resultado)
+        return resultados
+
+    filtros = {campo: str(valor) for campo, valor in (filtros or {}).items() if valor is not None}
+    invalidos = set(filtros) - set(_FILTROS_PERMITIDOS)
+    if invalidos:
+        raise ValueError(f"Filtros BM25 inválidos: {', '.join(sorted(invalidos))}")
+    parametros = list(pesos)
+    if resaltado == "snippet":
+        parametros.append(tokens_snippet)
+    parametros.append(consulta)
+    parametros.extend(filtros.values())
+    parametros.append(limite)
+    filas = pool.consultar(_sql_estructurado(resaltado, filtros), tuple(parametros))
+
+    resultados = []
+    for fila in filas:
+        chunk_texto, contexto, servicio, tipo, subtipo, id_sub, rango = fila[:7]
+        resultado = {
+            "content": formatear_fragmento(chunk_texto, contexto, servicio, tipo, subtipo, id_sub),
+            "score": -rango,
+            "source": "BM25",
+            "metadata": {"servicio": servicio, "tipo": tipo, "subtipo": subtipo, "id_sub": id_sub},
+        }
+        if resaltado:
+            resultado["snippet"] = fila[7]
+        resultados.append(resultado)
+    return resultados
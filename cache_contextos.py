@@ -0,0 +1,91 @@
+"""
+Caché persistente de los contextos generados en la ingesta con contextual retrieval.
+
+La clave es direccionada por contenido: hash del documento completo, hash del
+chunk y versión del prompt (hash de la plantilla y del modelo). Volver a cargar
+un JSON sin cambios no hace ninguna llamada al LLM; una recarga nocturna solo
+paga por los servicios editados, y cambiar el prompt o el modelo invalida
+solo lo que corresponde.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+def hash_texto(texto):
+    return hashlib.sha256((texto or "").encode("utf-8")).hexdigest()
+
+
+def version_prompt(plantilla, modelo=""):
+    """Versión del prompt: cambia si cambia la plantilla o el modelo."""
+    return hash_texto(f"{modelo}\x00{plantilla}")[:16]
+
+
+class CacheContextos:
+    """Contextos generados por (hash del documento, hash del chunk, versión del prompt) en SQLite."""
+
+    def __init__(self, ruta_sqlite="cache_contextos.db", version=""):
+        self.ruta_sqlite = ruta_sqlite
+        self.version = version
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._metricas = {"aciertos": 0, "fallos": 0}
+
+    def _conexion(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.ruta_sqlite, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS contextos ("
+                "hash_documento TEXT NOT NULL, hash_chunk TEXT NOT NULL, version_prompt TEXT NOT NULL, "
+                "contexto TEXT NOT NULL, creado REAL NOT NULL, "
+                "PRIMARY KEY (hash_documento, hash_chunk, version_prompt))"
+            )
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def buscar(self, documento, chunk):
+        """Devuelve el contexto cacheado o None."""
+        with self._lock:
+            try:
+                fila = self._conexion().execute(
+                    "SELECT contexto FROM contextos WHERE hash_documento = ? AND hash_chunk = ? AND version_prompt = ?",
+                    (hash_texto(documento), hash_texto(chunk), self.version)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"Caché de contextos no disponible: {str(e)}")
+                fila = None
+            self._metricas["aciertos" if fila else "fallos"] += 1
+        return fila[0] if fila else None
+
+    def guardar(self, documento, chunk, contexto):
+        with self._lock:
+            try:
+                conn = self._conexion()
+                conn.execute(
+                    "INSERT OR REPLACE INTO contextos "
+                    "(hash_documento, hash_chunk, version_prompt, contexto, creado) VALUES (?, ?, ?, ?, ?)",
+                    (hash_texto(documento), hash_texto(chunk), self.version, contexto, time.time())
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"No se pudo guardar el contexto en caché: {str(e)}")
+
+    def metricas(self):
+        with self._lock:
+            return dict(self._metricas)
+
+
+def crear_cache_contextos(config, plantilla, modelo=""):
+    """Crea el caché según [CONTEXTUALIZACION] de config.ini (None si cache_contextos_path está vacío)."""
+    seccion = config['CONTEXTUALIZACION'] if config.has_section('CONTEXTUALIZACION') else config['DEFAULT']
+    ruta = seccion.get('cache_contextos_path', fallback='cache_contextos.db').strip()
+    if not ruta:
+        return None
+    return CacheContextos(ruta, version=version_prompt(plantilla, modelo))
@@ -0,0 +1,212 @@
+"""
+Caché de embeddings de consultas delante de OpenAIEmbeddings.
+
+Dos niveles:
+- LRU en memoria del proceso (acierto sin I/O).
+- SQLite persistente en disco, compartido entre reinicios y workers.
+
+La clave es el hash del texto normalizado de la consulta más el modelo de
+embeddings, así "Pañales" y "  pañales " reutilizan el mismo vector y un
+cambio de modelo nunca devuelve vectores viejos. Lo que se embebe es el texto
+original: la normalización solo arma la clave, los vectores son los mismos que
+sin caché. Las preguntas repetidas ("pañales", "sepelio", "insulina") no
+vuelven a viajar a la API.
+
+El nivel en disco está acotado por antigüedad (`ttl_disco_segundos`) y por
+cantidad de filas (`max_disco`). La I/O de SQLite no se hace con el lock del
+nivel en memoria tomado, y en `aembed_query` corre en un hilo para no
+bloquear el event loop.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+_RE_ESPACIOS = re.compile(r'\s+')
+
+# Versión de la clave: las entradas anteriores guardaban el embedding del texto normalizado
+VERSION_CLAVE = "2"
+
+# Cada cuántas escrituras se purga el nivel en disco
+ESCRITURAS_ENTRE_PURGAS = 200
+
+
+def normalizar_consulta(texto):
+    """Normaliza la consulta para la clave del caché (Unicode NFC, minúsculas, espacios simples)."""
+    texto = unicodedata.normalize("NFC", texto or "")
+    return _RE_ESPACIOS.sub(" ", texto).strip().casefold()
+
+
+class EmbeddingsConCache(Embeddings):
+    """Envuelve un modelo de embeddings y cachea `embed_query` en memoria y en SQLite."""
+
+    def __init__(self, base, ruta_sqlite="cache_embeddings.db", max_memoria=2048, modelo=None,
+                 ttl_disco_segundos=30 * 86400, max_disco=100000):
+        self.base = base
+        self.modelo = modelo or getattr(base, "model", type(base).__name__)
+        self.ruta_sqlite = ruta_sqlite
+        self.max_memoria = max_memoria
+        self.ttl_disco_segundos = ttl_disco_segundos
+        self.max_disco = max_disco
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        # La conexión SQLite se comparte entre hilos: su uso se serializa aparte
+        self._lock_disco = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._escrituras = 0
+        self._metricas = {"hits_memoria": 0, "hits_disco": 0, "misses": 0}
+
+    # --------------------- Nivel en disco ---------------------
+    def _conexion(self):
+        if not self.ruta_sqlite:
+            return None
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.ruta_sqlite, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings_consulta ("
+                "clave TEXT PRIMARY KEY, modelo TEXT NOT NULL, vector BLOB NOT NULL, creado REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_consulta_creado ON embeddings_consulta (creado)")
+            conn.commit()
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _vigencia(self):
+        return time.time() - self.ttl_disco_segundos if self.ttl_disco_segundos > 0 else 0.0
+
+    def _leer_disco(self, clave):
+        try:
+            with self._lock_disco:
+                conn = self._conexion()
+                if conn is None:
+                    return None
+                fila = conn.execute(
+                    "SELECT vector FROM embeddings_consulta WHERE clave = ? AND creado >= ?",
+                    (clave, self._vigencia())
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Caché de embeddings en disco no disponible: {str(e)}")
+            return None
+        if fila is None:
+            return None
+        vector = array("f")
+        vector.frombytes(fila[0])
+        return vector.tolist()
+
+    def _escribir_disco(self, clave, vector):
+        try:
+            with self._lock_disco:
+                conn = self._conexion()
+                if conn is None:
+                    return
+                conn.execute(
+                    "INSERT OR REPLACE INTO embeddings_consulta (clave, modelo, vector, creado) VALUES (?, ?, ?, ?)",
+                    (clave, self.modelo, array("f", vector).tobytes(), time.time())
+                )
+                self._escrituras += 1
+                if self._escrituras % ESCRITURAS_ENTRE_PURGAS == 1:
+                    self._purgar_disco(conn)
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"No se pudo guardar el embedding en disco: {str(e)}")
+
+    def _purgar_disco(self, conn):
+        """Borra las filas vencidas y, si sobran, las más viejas por encima de `max_disco`."""
+        vencidas = conn.execute("DELETE FROM embeddings_consulta WHERE creado < ?", (self._vigencia(),)).rowcount
+        sobrantes = 0
+        if self.max_disco > 0:
+            sobrantes = conn.execute(
+                "DELETE FROM embeddings_consulta WHERE clave IN ("
+                "SELECT clave FROM embeddings_consulta ORDER BY creado DESC LIMIT -1 OFFSET ?)",
+                (self.max_disco,)
+            ).rowcount
+        if vencidas or sobrantes:
+            logging.info(f"Caché de embeddings en disco: {vencidas} vencidas y {sobrantes} sobrantes eliminadas")
+
+    # --------------------- Nivel en memoria ---------------------
+    def _clave(self, texto_normalizado):
+        return hashlib.sha256(
+            f"{VERSION_CLAVE}\x00{self.modelo}\x00{texto_normalizado}".encode("utf-8")
+        ).hexdigest()
+
+    def _guardar_memoria(self, clave, vector):
+        self._memoria[clave] = vector
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def _buscar_memoria(self, clave):
+        with self._lock:
+            vector = self._memoria.get(clave)
+            if vector is not None:
+                self._memoria.move_to_end(clave)
+                self._metricas["hits_memoria"] += 1
+            return vector
+
+    def _buscar_disco(self, clave):
+        vector = self._leer_disco(clave)
+        with self._lock:
+            if vector is not None:
+                self._guardar_memoria(clave, vector)
+                self._metricas["hits_disco"] += 1
+            else:
+                self._metricas["misses"] += 1
+        return vector
+
+    def _buscar(self, clave):
+        vector = self._buscar_memoria(clave)
+        if vector is None:
+            vector = self._buscar_disco(clave)
+        return vector
+
+    def _guardar(self, clave, vector):
+        with self._lock:
+            self._guardar_memoria(clave, vector)
+        self._escribir_disco(clave, vector)
+
+    # --------------------- Interfaz Embeddings ---------------------
+    def embed_query(self, text):
+        clave = self._clave(normalizar_consulta(text))
+        vector = self._buscar(clave)
+        if vector is None:
+            vector = self.base.embed_query(text)
+            self._guardar(clave, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        clave = self._clave(normalizar_consulta(text))
+        vector = self._buscar_memoria(clave)
+        if vector is None:
+            vector = await asyncio.to_thread(self._buscar_disco, clave)
+        if vector is None:
+            vector = await self.base.aembed_query(text)
+            await asyncio.to_thread(self._guardar, clave, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        # Los documentos se embeben en la ingesta; no se cachean
+        return self.base.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.base.aembed_documents(texts)
+
+    def metricas(self):
+        """Contadores de aciertos y fallos del caché."""
+        with self._lock:
+            metricas = dict(self._metricas)
+            metricas["en_memoria"] = len(self._memoria)
+        total = metricas["hits_memoria"] + metricas["hits_disco"] + metricas["misses"]
+        metricas["tasa_aciertos"] = (metricas["hits_memoria"] + metricas["hits_disco"]) / total if total else 0.0
+        return metricas
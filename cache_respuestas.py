@@ -0,0 +1,209 @@
+"""
+Caché semántico de respuestas para las preguntas frecuentes de las agencias.
+
+Antes de recorrer el grafo (query_or_respond -> retrieve -> generate, con dos
+llamadas al LLM) se busca una pregunta ya respondida cuyo embedding tenga
+similitud coseno mayor o igual al umbral configurado.
+
+Es opcional (habilitado = false por defecto): una respuesta equivocada sobre
+una prestación cuesta más que la latencia ahorrada. Con los embeddings de
+OpenAI (ada-002) las similitudes entre preguntas del dominio se concentran
+entre 0.75 y 1.0, y a 0.95 coinciden preguntas que difieren en una palabra
+("titular" / "afiliado", pañales / prótesis). Por eso:
+
+- La clave incluye el ámbito (el agente que responde) y el conjunto de
+  términos de la pregunta (sin acentos, mayúsculas ni stopwords): solo se
+  reutiliza la respuesta de una pregunta con los mismos términos, y el
+  embedding cubre las variaciones de orden, puntuación y palabras vacías.
+- El umbral por defecto es 0.97.
+
+- Cada entrada queda asociada a la versión del corpus (fecha de modificación
+  del fragment store y del índice BM25); si el corpus se recarga, el caché se vacía.
+- Las entradas vencen por TTL y el tamaño está acotado con desalojo LRU.
+
+Configuración en config.ini, sección [CACHE_RESPUESTAS]:
+    habilitado = false
+    umbral_similitud = 0.97
+    ttl_segundos = 86400
+    max_entradas = 1000
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from rerank_cascada import terminos
+
+# Respuestas que no deben reutilizarse
+PREFIJOS_NO_CACHEABLES = ("Error:", "Lo siento, no tengo información suficiente")
+
+
+def version_corpus(*rutas):
+    """
+    Versión del corpus: la fecha de modificación más reciente de los archivos indicados.
+
+    Para directorios (fragment store de Chroma) se consideran los archivos
+    del primer y segundo nivel.
+    """
+    version = 0.0
+    for ruta in rutas:
+        if not ruta or not os.path.exists(ruta):
+            continue
+        version = max(version, os.path.getmtime(ruta))
+        if os.path.isdir(ruta):
+            for entrada in os.scandir(ruta):
+                version = max(version, entrada.stat().st_mtime)
+                if entrada.is_dir():
+                    for sub in os.scandir(entrada.path):
+                        version = max(version, sub.stat().st_mtime)
+    return version
+
+
+class CacheSemanticaRespuestas:
+    """Caché de respuestas indexado por similitud de embeddings de la pregunta."""
+
+    def __init__(self, embeddings, umbral_similitud=0.97, ttl_segundos=86400, max_entradas=1000,
+                 rutas_corpus=(), segundos_entre_verificaciones=30, ambito=""):
+        self.embeddings = embeddings
+        self.ambito = ambito
+        self.umbral_similitud = umbral_similitud
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.rutas_corpus = tuple(rutas_corpus)
+        self.segundos_entre_verificaciones = segundos_entre_verificaciones
+        self._entradas = OrderedDict()
+        self._matriz = None
+        self._claves_matriz = []
+        self._lock = threading.Lock()
+        self._version = version_corpus(*self.rutas_corpus)
+        self._ultima_verificacion = time.monotonic()
+        self._siguiente_clave = 0
+        self._metricas = {"aciertos": 0, "fallos": 0, "invalidaciones": 0}
+
+    def _verificar_version(self):
+        ahora = time.monotonic()
+        if ahora - self._ultima_verificacion < self.segundos_entre_verificaciones:
+            return
+        self._ultima_verificacion = ahora
+        version = version_corpus(*self.rutas_corpus)
+        if version != self._version:
+            logging.info("Corpus recargado: se invalida el caché semántico de respuestas.")
+            self._version = version
+            self._vaciar()
+
+    def _vaciar(self):
+        self._entradas.clear()
+        self._matriz = None
+        self._claves_matriz = []
+        self._metricas["invalidaciones"] += 1
+
+    def _reconstruir_matriz(self):
+        if self._matriz is None:
+            self._claves_matriz = list(self._entradas)
+            self._matriz = (
+                np.vstack([self._entradas[clave]["vector"] for clave in self._claves_matriz])
+                if self._claves_matriz else None
+            )
+
+    def _clave(self, pregunta):
+        """Parte exacta de la clave: ámbito y términos de la pregunta."""
+        return self.ambito, frozenset(terminos(pregunta))
+
+    @staticmethod
+    def _normalizar(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma else vector
+
+    def buscar(self, pregunta):
+        """Devuelve la respuesta cacheada más similar o None."""
+        return self._buscar_vector(pregunta, self.embeddings.embed_query(pregunta))
+
+    def _buscar_vector(self, pregunta, vector):
+        vector = self._normalizar(vector)
+        clave_exacta = self._clave(pregunta)
+        ahora = time.time()
+        with self._lock:
+            self._verificar_version()
+            self._reconstruir_matriz()
+            if self._matriz is None:
+                self._metricas["fallos"] += 1
+                return None
+            similitudes = self._matriz @ vector
+            for indice in np.argsort(-similitudes):
+                if similitudes[indice] < self.umbral_similitud:
+                    break
+                clave = self._claves_matriz[indice]
+                entrada = self._entradas.get(clave)
+                if entrada is None or ahora - entrada["creado"] > self.ttl_segundos:
+                    continue
+                if entrada["clave"] != clave_exacta:
+                    continue
+                self._entradas.move_to_end(clave)
+                self._metricas["aciertos"] += 1
+                logging.info(
+                    f"Caché semántico: '{pregunta}' ~ '{entrada['pregunta']}' (similitud {similitudes[indice]:.3f})"
+                )
+                return entrada["respuesta"]
+            self._metricas["fallos"] += 1
+            return None
+
+    def guardar(self, pregunta, respuesta):
+        """Guarda la respuesta si es cacheable."""
+        if not respuesta or respuesta.startswith(PREFIJOS_NO_CACHEABLES):
+            return
+        self._guardar_vector(pregunta, respuesta, self.embeddings.embed_query(pregunta))
+
+    def _guardar_vector(self, pregunta, respuesta, vector):
+        vector = self._normalizar(vector)
+        ahora = time.time()
+        with self._lock:
+            # Desalojo por TTL y luego por tamaño (LRU)
+            vencidas = [clave for clave, entrada in self._entradas.items() if ahora - entrada["creado"] > self.ttl_segundos]
+            for clave in vencidas:
+                del self._entradas[clave]
+            while len(self._entradas) >= self.max_entradas:
+                self._entradas.popitem(last=False)
+            self._siguiente_clave += 1
+            self._entradas[self._siguiente_clave] = {
+                "clave": self._clave(pregunta),
+                "pregunta": pregunta,
+                "respuesta": respuesta,
+                "vector": vector,
+                "creado": ahora,
+            }
+            self._matriz = None
+
+    def invalidar(self):
+        """Vacía el caché (por ejemplo, después de recargar el fragment store)."""
+        with self._lock:
+            self._version = version_corpus(*self.rutas_corpus)
+            self._vaciar()
+
+    def metricas(self):
+        with self._lock:
+            metricas = dict(self._metricas)
+            metricas["entradas"] = len(self._entradas)
+        return metricas
+
+
+def crear_cache_respuestas(config, embeddings, rutas_corpus, ambito):
+    """
+    Crea el caché según la sección [CACHE_RESPUESTAS] de config.ini (None si no
+    está habilitado). `ambito` identifica al agente y forma parte de la clave.
+    """
+    seccion = config['CACHE_RESPUESTAS'] if config.has_section('CACHE_RESPUESTAS') else config['DEFAULT']
+    if not seccion.getboolean('habilitado', fallback=False):
+        return None
+    return CacheSemanticaRespuestas(
+        embeddings,
+        ambito=ambito,
+        umbral_similitud=seccion.getfloat('umbral_similitud', fallback=0.97),
+        ttl_segundos=seccion.getint('ttl_segundos', fallback=86400),
+        max_entradas=seccion.getint('max_entradas', fallback=1000),
+        rutas_corpus=rutas_corpus,
+    )
@@ -1,11 +1,11 @@
 # Importación de las librerías necesarias
 import datetime
-import json
 import configparser
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
-from langchain.schema import Document
-import html
+from indexador_incremental import crear_indexador
+from lector_json import leer_registros
+from preprocesamiento import crear_preprocesador, normalizar_texto
 import re
 
 # Cargar la configuración desde config.ini
@@ -26,22 +26,6 @@ except KeyError as e:
     raise ValueError(f"Falta la clave de configuración: {e}")
 
 
-def normalizar_texto(texto):
-    if texto is None:
-        return ""
-    
-    # 1. Decodificar entidades HTML
-    texto_decodificado = html.unescape(texto)
-    
-    # 2. Reemplazar saltos de línea y espacios redundantes
-    texto_decodificado = texto_decodificado.replace("\r", " ").replace("\n", " ")
-    
-    # 3. Reemplazar múltiples espacios por uno solo
-    texto_limpio = re.sub(r'\s+', ' ', texto_decodificado)
-    
-    # 4. Eliminar espacios al inicio y al final
-    return texto_limpio.strip()
-
 def conservar_urls_emails(texto):
     """
     Normaliza el texto pero conserva las URLs y emails.
@@ -61,60 +45,62 @@ def conservar_urls_emails(texto):
             texto_normalizado = texto_normalizado.replace(url_email.replace(" ", ""), url_email)
     
     return texto_normalizado.strip()
-# Función para normalizar texto
 
-# Función para dividir texto en chunks
-def dividir_en_chunks(texto, tamano_chunk, solapamiento):
-    palabras = texto.split()
-    if tamano_chunk <= solapamiento:
-        raise ValueError("El tamaño del chunk debe ser mayor que el solapamiento.")
+# Texto de cada campo antes de dividirlo en chunks
+PLANTILLA_CHUNK = "[SERVICIO: {servicio}] [TIPO: {tipo}] [SUBTIPO: {subtipo}] [ID_SUB: {id_sub}]   {campo}:{texto}"
 
-    for i in range(0, len(palabras), tamano_chunk - solapamiento):
-        chunk = ' '.join(palabras[i:i + tamano_chunk])
-        yield chunk
+# Fragmentos de los registros de un lote de ID_SUB (solo los nuevos o modificados)
+def generar_fragmentos(grupos, preprocesador, tamano_chunk, solapamiento):
+    # Normalización y chunking en paralelo, en el orden de los registros
+    preprocesados = iter(preprocesador.preprocesar(
+        (item for items in grupos.values() for item in items),
+        plantilla=PLANTILLA_CHUNK, tamano_chunk=tamano_chunk, solapamiento=solapamiento, modo="palabras"
+    ))
+    fragmentos_por_id = {}
+    for id_sub_grupo, items in grupos.items():
+        fragmentos = fragmentos_por_id.setdefault(id_sub_grupo, [])
+        for registro in (next(preprocesados) for _ in items):
+            for campo, _, chunks in registro["campos"]:
+                for chunk in chunks:
+                    fragmentos.append({
+                        "texto": chunk,
+                        "metadata": {
+                            "servicio": registro["servicio"],
+                            "tipo": registro["tipo"],
+                            "subtipo": registro["subtipo"],
+                            "id_sub": registro["id_sub"],
+                            "campo": campo
+                        }
+                    })
+    return fragmentos_por_id
 
 # Función principal para cargar JSON en la base de datos vectorial
 def cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial, tamano_chunk, solapamiento):
-    with open(ruta_archivo_json, 'r', encoding='utf-8') as archivo:
-        data = json.load(archivo)
+    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, max_retries=0)  # los reintentos los hace embeddings_lote
+    vector_db = Chroma(
+        collection_name=nombre_bdvectorial,
+        embedding_function=embeddings,
+        persist_directory=directorio_bdvectorial
+    )
 
-    documentos = []
-    registros = data.get("RECORDS", [])
-    for item in registros:
-        servicio = normalizar_texto(item.get("SERVICIO", ""))
-        tipo = normalizar_texto(item.get("TIPO", ""))
-        subtipo = normalizar_texto(item.get("SUBTIPO", ""))
-        id_sub = item.get("ID_SUB", "")
+    # Los procesos de preprocesamiento arrancan antes que los hilos de la ingesta
+    preprocesador = crear_preprocesador(config).iniciar()
 
-        for campo in ["COPETE", "CONSISTE", "REQUISITOS", "PAUTAS", "QUIEN_PUEDE", "QUIENES_PUEDEN", "COMO_LO_HACEN"]:
-            texto = item.get(campo)
-            texto_normalizado = normalizar_texto(texto)
-            if texto_normalizado:
-                texto_con_metadata = (
-                    f"[SERVICIO: {servicio}] [TIPO: {tipo}] [SUBTIPO: {subtipo}] [ID_SUB: {id_sub}]   {campo}:"
-                    f"{texto_normalizado}"
-                )
-                for chunk in dividir_en_chunks(texto_con_metadata, tamano_chunk, solapamiento):
-                    documento = Document(
-                        page_content=chunk,
-                        metadata={
-                            "servicio": servicio,
-                            "tipo": tipo,
-                            "subtipo": subtipo,
-                            "id_sub": id_sub,
-                            "campo": campo
-                        }
-                    )
-                    documentos.append(documento)
-
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-    vector_db = Chroma.from_documents(
-        documents=documentos,
-        embedding=embeddings,
-        persist_directory=directorio_bdvectorial,
-        collection_name=nombre_bdvectorial
-    )
-    print(f"Se han cargado {len(documentos)} documentos en la base de datos vectorial.")
+    # Lectura en flujo del export: cada lote con cambios se chunkea, se embebe y se confirma
+    try:
+        indexador = crear_indexador(config, vector_db, directorio_bdvectorial, nombre_bdvectorial)
+        try:
+            resumen = indexador.indexar_en_flujo(
+                leer_registros(ruta_archivo_json),
+                lambda grupos: generar_fragmentos(grupos, preprocesador, tamano_chunk, solapamiento),
+                version=f"palabras/{tamano_chunk}/{solapamiento}"
+            )
+        finally:
+            indexador.cerrar()
+    finally:
+        preprocesador.cerrar()
+    print(f"Indexación incremental de la base de datos vectorial: {resumen}")
 
 # Llamada de ejemplo a la función
-cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial, tamano_chunk, overlap_chunk)
+if __name__ == "__main__":
+    cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial, tamano_chunk, overlap_chunk)
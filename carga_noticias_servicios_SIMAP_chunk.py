@@ -1,13 +1,11 @@
 # Importación de las librerías necesarias
 import datetime
-import json
 import configparser
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
-from langchain.schema import Document
-import html
-import re
-import tiktoken
+from indexador_incremental import crear_indexador
+from lector_json import leer_registros
+from preprocesamiento import crear_preprocesador
 import os  # Agregado para manejar rutas de forma segura
 
 # Cargar la configuración desde config.ini
@@ -24,73 +22,67 @@ try:
     nombre_bdvectorial = config['SERVICIOS_SIMAP']['nombre_bdvectorial']
     tamano_chunk = int(config['SERVICIOS_SIMAP']['tamano_chunk'])
     overlap_chunk = int(config['SERVICIOS_SIMAP']['overlap_chunk'])
+    # 'lineal' (codifica cada campo una vez) o 'referencia' (algoritmo original, para comparar)
+    modo_chunking = config['SERVICIOS_SIMAP'].get('modo_chunking', 'lineal')
 except KeyError as e:
     raise ValueError(f"Falta la clave de configuración: {e}")
 
-# Función para contar tokens usando tiktoken
-def contar_tokens(texto):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(texto))
+# Chunking por tokens (cl100k_base): lineal o el algoritmo de referencia, para comparar
+MODO_PREPROCESAMIENTO = 'tokens_referencia' if modo_chunking == 'referencia' else 'tokens'
+PLANTILLA_CHUNK = "{campo}: {texto}"
 
-# Normalización de texto
-def normalizar_texto(texto):
-    if texto is None:
-        return ""
-    texto_decodificado = html.unescape(texto)
-    texto_decodificado = texto_decodificado.replace("\r", " ").replace("\n", " ")
-    texto_limpio = re.sub(r'\s+', ' ', texto_decodificado)
-    return texto_limpio.strip()
-
-# Función para dividir texto en chunks basados en tokens
-def dividir_en_chunks(texto, tamano_chunk, solapamiento):
-    palabras = texto.split()
-    chunk_actual = []
-
-    for palabra in palabras:
-        chunk_actual.append(palabra)
-        chunk_texto = ' '.join(chunk_actual)
-        if contar_tokens(chunk_texto) > tamano_chunk:
-            yield ' '.join(chunk_actual[:-1])
-            chunk_actual = chunk_actual[-solapamiento:]
-
-    if chunk_actual:
-        yield ' '.join(chunk_actual)
+# Fragmentos de los registros de un lote de ID_SUB (solo los nuevos o modificados)
+def generar_fragmentos(grupos, preprocesador, tamano_chunk, solapamiento):
+    # Normalización y chunking en paralelo, en el orden de los registros
+    preprocesados = iter(preprocesador.preprocesar(
+        (item for items in grupos.values() for item in items),
+        plantilla=PLANTILLA_CHUNK, tamano_chunk=tamano_chunk, solapamiento=solapamiento, modo=MODO_PREPROCESAMIENTO
+    ))
+    fragmentos_por_id = {}
+    for id_sub, items in grupos.items():
+        fragmentos = fragmentos_por_id.setdefault(id_sub, [])
+        for registro in (next(preprocesados) for _ in items):
+            metadata = {
+                "servicio": registro["servicio"],
+                "tipo": registro["tipo"],
+                "subtipo": registro["subtipo"],
+                "id_sub": registro["id_sub"]
+            }
+            for _, _, chunks in registro["campos"]:
+                for chunk in chunks:
+                    fragmentos.append({"texto": chunk, "metadata": metadata})
+    return fragmentos_por_id
 
 # Función principal para cargar JSON en la base de datos vectorial
 def cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial, tamano_chunk, solapamiento):
     if not os.path.exists(ruta_archivo_json):  # Validación agregada para verificar si el archivo existe
         raise FileNotFoundError(f"El archivo {ruta_archivo_json} no existe.")
 
-    with open(ruta_archivo_json, 'r', encoding='utf-8') as archivo:
-        data = json.load(archivo)
-
-    documentos = []
-    registros = data.get("RECORDS", [])
-    for item in registros:
-        metadata = {
-            "servicio": normalizar_texto(item.get("SERVICIO", "")),
-            "tipo": normalizar_texto(item.get("TIPO", "")),
-            "subtipo": normalizar_texto(item.get("SUBTIPO", "")),
-            "id_sub": item.get("ID_SUB", "")
-        }
+    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, max_retries=0)  # los reintentos los hace embeddings_lote
+    vector_db = Chroma(
+        collection_name=nombre_bdvectorial,
+        embedding_function=embeddings,
+        persist_directory=directorio_bdvectorial
+    )
 
-        for campo in ["COPETE", "CONSISTE", "REQUISITOS", "PAUTAS", "QUIEN_PUEDE", "QUIENES_PUEDEN", "COMO_LO_HACEN"]:
-            texto = item.get(campo)
-            texto_normalizado = normalizar_texto(texto)
-            if texto_normalizado:
-                texto_con_metadata = f"{campo}: {texto_normalizado}"
-                for chunk in dividir_en_chunks(texto_con_metadata, tamano_chunk, solapamiento):
-                    documento = Document(page_content=chunk, metadata=metadata)
-                    documentos.append(documento)
+    # Los procesos de preprocesamiento arrancan antes que los hilos de la ingesta
+    preprocesador = crear_preprocesador(config).iniciar()
 
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-    vector_db = Chroma.from_documents(
-        documents=documentos,
-        embedding=embeddings,
-        persist_directory=directorio_bdvectorial,
-        collection_name=nombre_bdvectorial
-    )
-    print(f"Se han cargado {len(documentos)} documentos en la base de datos vectorial.")
+    # Lectura en flujo del export: cada lote con cambios se chunkea, se embebe y se confirma
+    try:
+        indexador = crear_indexador(config, vector_db, directorio_bdvectorial, nombre_bdvectorial)
+        try:
+            resumen = indexador.indexar_en_flujo(
+                leer_registros(ruta_archivo_json),
+                lambda grupos: generar_fragmentos(grupos, preprocesador, tamano_chunk, solapamiento),
+                version=f"tokens/{tamano_chunk}/{solapamiento}"
+            )
+        finally:
+            indexador.cerrar()
+    finally:
+        preprocesador.cerrar()
+    print(f"Indexación incremental de la base de datos vectorial ({modo_chunking}): {resumen}")
 
 # Llamada de ejemplo a la función
-cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial, tamano_chunk, overlap_chunk)
+if __name__ == "__main__":
+    cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial, tamano_chunk, overlap_chunk)
@@ -1,12 +1,11 @@
 # Importación de las librerías necesarias
 import datetime
-import json
 import configparser
 from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
-from langchain.schema import Document
-import html
-import re
+from indexador_incremental import crear_indexador
+from lector_json import leer_registros
+from preprocesamiento import CAMPOS_TEXTO, crear_preprocesador
 
 # Cargar la configuración desde config.ini
 config = configparser.ConfigParser()
@@ -23,70 +22,57 @@ try:
 except KeyError as e:
     raise ValueError(f"Falta la clave de configuración: {e}")
 
-# Función para normalizar texto
-def normalizar_texto(texto):
-    if texto is None:
-        return ""
-    
-    # 1. Decodificar entidades HTML
-    texto_decodificado = html.unescape(texto)
-    
-    # 2. Reemplazar saltos de línea y espacios redundantes
-    texto_decodificado = texto_decodificado.replace("\r", " ").replace("\n", " ")
-    
-    # 3. Reemplazar múltiples espacios por uno solo
-    texto_limpio = re.sub(r'\s+', ' ', texto_decodificado)
-    
-    # 4. Eliminar espacios al inicio y al final
-    return texto_limpio.strip()
+# Un documento por registro, para un lote de ID_SUB (solo los nuevos o modificados)
+def generar_fragmentos(grupos, preprocesador):
+    # Normalización en paralelo, en el orden de los registros
+    preprocesados = iter(preprocesador.preprocesar(item for items in grupos.values() for item in items))
+    fragmentos_por_id = {}
+    for id_sub_grupo, items in grupos.items():
+        for registro in (next(preprocesados) for _ in items):
+            textos = {campo: texto for campo, texto, _ in registro["campos"]}
 
-# Función principal para cargar JSON en la base de datos vectorial
-def cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial):
-    with open(ruta_archivo_json, 'r', encoding='utf-8') as archivo:
-        data = json.load(archivo)
+            # Concatenar los campos de interés en un solo texto
+            texto_chunk = "\n".join(f"{campo}: {textos.get(campo, '')}" for campo in CAMPOS_TEXTO)
 
-    documentos = []
-    registros = data.get("RECORDS", [])
-    
-    # Procesar cada registro como un chunk individual
-    for item in registros:
-        servicio = normalizar_texto(item.get("SERVICIO", ""))
-        tipo = normalizar_texto(item.get("TIPO", ""))
-        subtipo = normalizar_texto(item.get("SUBTIPO", ""))
-        id_sub = item.get("ID_SUB", "")
+            # Documento con metadata
+            fragmentos_por_id.setdefault(id_sub_grupo, []).append({
+                "texto": texto_chunk,
+                "metadata": {
+                    "servicio": registro["servicio"],
+                    "tipo": registro["tipo"],
+                    "subtipo": registro["subtipo"],
+                    "id_sub": registro["id_sub"]
+                }
+            })
+    return fragmentos_por_id
 
-        # Concatenar los campos de interés en un solo texto
-        texto_chunk = "\n".join([
-            f"COPETE: {normalizar_texto(item.get('COPETE', ''))}",
-            f"CONSISTE: {normalizar_texto(item.get('CONSISTE', ''))}",
-            f"REQUISITOS: {normalizar_texto(item.get('REQUISITOS', ''))}",
-            f"PAUTAS: {normalizar_texto(item.get('PAUTAS', ''))}",
-            f"QUIEN_PUEDE: {normalizar_texto(item.get('QUIEN_PUEDE', ''))}",
-            f"QUIENES_PUEDEN: {normalizar_texto(item.get('QUIENES_PUEDEN', ''))}",
-            f"COMO_LO_HACEN: {normalizar_texto(item.get('COMO_LO_HACEN', ''))}"
-        ])
+# Función principal para cargar JSON en la base de datos vectorial
+def cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial):
+    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, max_retries=0)  # los reintentos los hace embeddings_lote
+    vector_db = Chroma(
+        collection_name=nombre_bdvectorial,
+        embedding_function=embeddings,
+        persist_directory=directorio_bdvectorial
+    )
 
-        # Crear el documento con metadata
-        documento = Document(
-            page_content=texto_chunk,
-            metadata={
-                "servicio": servicio,
-                "tipo": tipo,
-                "subtipo": subtipo,
-                "id_sub": id_sub
-            }
-        )
-        documentos.append(documento)
+    # Los procesos de preprocesamiento arrancan antes que los hilos de la ingesta
+    preprocesador = crear_preprocesador(config).iniciar()
 
-    # Cargar los documentos en la base de datos vectorial
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-    vector_db = Chroma.from_documents(
-        documents=documentos,
-        embedding=embeddings,
-        persist_directory=directorio_bdvectorial,
-        collection_name=nombre_bdvectorial
-    )
-    print(f"Se han cargado {len(documentos)} documentos en la base de datos vectorial.")
+    # Lectura en flujo del export; solo se aplican los cambios en la base de datos vectorial
+    try:
+        indexador = crear_indexador(config, vector_db, directorio_bdvectorial, nombre_bdvectorial)
+        try:
+            resumen = indexador.indexar_en_flujo(
+                leer_registros(ruta_archivo_json),
+                lambda grupos: generar_fragmentos(grupos, preprocesador),
+                version="registro"
+            )
+        finally:
+            indexador.cerrar()
+    finally:
+        preprocesador.cerrar()
+    print(f"Indexación incremental de la base de datos vectorial: {resumen}")
 
 # Llamada de ejemplo a la función
-cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial)
+if __name__ == "__main__":
+    cargar_json_a_chroma(ruta_archivo_json, openai_api_key, directorio_bdvectorial, nombre_bdvectorial)
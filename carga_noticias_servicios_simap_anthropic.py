@@ -1,14 +1,18 @@
-import json
 import configparser
 import sqlite3
 import os
-import html
-import re
+import time
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain.schema.runnable import RunnableLambda
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from langchain_chroma import Chroma
+from bm25_sqlite import crear_esquema_bm25, formatear_fragmento
+from contextualizacion import crear_contextualizador
+from cache_contextos import crear_cache_contextos, version_prompt
+from indexador_incremental import crear_indexador
+from lector_json import leer_registros
+from preprocesamiento import crear_preprocesador, dividir_en_chunks_por_palabras, normalizar_texto
 
 # Cargar configuración desde config.ini
 config = configparser.ConfigParser()
@@ -27,7 +31,7 @@ try:
 except KeyError as e:
     raise ValueError(f"Error en la configuración: Falta la clave {e}")
 
-llm = ChatOpenAI(api_key=openai_api_key, model_name=model_name)
+llm = ChatOpenAI(api_key=openai_api_key, model_name=model_name, max_retries=0)  # los reintentos los hace contextualizacion
 
 prompt_template = PromptTemplate(
     input_variables=["whole_document", "fragment"],
@@ -44,17 +48,35 @@ prompt_template = PromptTemplate(
     """
 )
 llm_chain = prompt_template | llm
+# Contextos ya generados (mismo documento, chunk y versión del prompt) se leen del caché
+cache_contextos = crear_cache_contextos(config, prompt_template.template, model_name)
+# Llamadas al LLM en paralelo, con límite de tasa y reintentos
+contextualizador = crear_contextualizador(config, llm_chain, cache=cache_contextos)
 
-def normalizar_texto(texto):
-    if not texto:
-        return ""
-    texto = html.unescape(texto).replace("\r", " ").replace("\n", " ")
-    return re.sub(r'\s+', ' ', texto).strip()
-
-def dividir_en_chunks(texto, tamano_chunk, solapamiento):
-    palabras = texto.split()
-    paso = tamano_chunk - solapamiento
-    return [' '.join(palabras[i:i + tamano_chunk]) for i in range(0, len(palabras), paso)]
+def documentos_de_registros(registros):
+    """Corte de control: agrupa los registros consecutivos (ya preprocesados) en documentos completos."""
+    documentos_simap = []
+    clave_actual = ""
+    
+    for registro in registros:
+        servicio, tipo, subtipo = registro["servicio"], registro["tipo"], registro["subtipo"]
+        id_sub = normalizar_texto(str(registro["id_sub"]))
+        
+        clave_nueva = f"{servicio}|{tipo}|{subtipo}|{id_sub}"
+        
+        if clave_nueva != clave_actual:
+            documentos_simap.append({
+                "servicio": servicio, "tipo": tipo, "subtipo": subtipo, "id_sub": id_sub, "contenido": ""
+            })
+        
+        contenido_tipo = f" SERVICIO: {servicio} TIPO: {tipo} SUBTIPO: {subtipo} ID_SUB: {id_sub}"
+        
+        for campo, texto, _ in registro["campos"]:
+            contenido_tipo += f" {campo}: {texto}"
+        
+        documentos_simap[-1]["contenido"] += contenido_tipo
+        clave_actual = clave_nueva
+    return documentos_simap
 
 def procesar_json_y_cargar_bd():
     print("Iniciando procesamiento de JSON y carga en base de datos...")
@@ -62,71 +84,89 @@ def procesar_json_y_cargar_bd():
     if not os.path.exists(ruta_archivo_json):
         raise FileNotFoundError(f"No se encontró el archivo JSON en la ruta: {ruta_archivo_json}")
     
-    with open(ruta_archivo_json, 'r', encoding='utf-8') as archivo:
-        data = json.load(archivo)
-
-    registros = data.get("RECORDS", [])
-    documentos = []
-    
+    # Indexación incremental: solo se contextualizan los ID_SUB nuevos o modificados
     conn_bm25 = sqlite3.connect(base_datos_bm25)
-    c = conn_bm25.cursor()
-    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(chunk_content)")
-    
-    clave_actual = ""
-    contenido_tipo = ""
-    servicio_anterior, tipo_anterior, subtipo_anterior, id_sub_anterior = "", "", "", ""
+    # Esquema estructurado: metadata en columnas propias, fuera del texto indexado
+    crear_esquema_bm25(conn_bm25)
+    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, max_retries=0)  # los reintentos los hace embeddings_lote
+    vector_db = Chroma(
+        collection_name=nombre_bdvectorial,
+        embedding_function=embeddings,
+        persist_directory=directorio_bdvectorial
+    )
     
-    for item in registros:
-        servicio = normalizar_texto(item.get("SERVICIO", ""))
-        tipo = normalizar_texto(item.get("TIPO", ""))
-        subtipo = normalizar_texto(item.get("SUBTIPO", ""))
-        id_sub = normalizar_texto(str(item.get("ID_SUB", "")))
+    def generar_fragmentos(grupos):
+        """Contextualiza y arma los fragmentos de un lote de ID_SUB (se confirma al terminar el lote)."""
+        # 1) Documentos completos del lote, normalizados en paralelo y en el orden original
+        documentos_lote = documentos_de_registros(
+            preprocesador.preprocesar(item for items in grupos.values() for item in items)
+        )
         
-        clave_nueva = f"{servicio}|{tipo}|{subtipo}|{id_sub}"
+        # 2) Contextualización concurrente agrupada por documento (reutiliza el prefijo cacheado)
+        chunks_por_documento = []
+        for documento in documentos_lote:
+            print(f"Corte de control - Whole Document: {documento['contenido']}\n\n")
+            chunks_por_documento.append(dividir_en_chunks_por_palabras(documento["contenido"], tamano_chunk, overlap_chunk))
         
-        if clave_nueva != clave_actual and clave_actual:
-            print(f"Corte de control - Whole Document: {contenido_tipo}\n\n")
-            chunks = dividir_en_chunks(contenido_tipo, tamano_chunk, overlap_chunk)
-            for chunk in chunks:
-                contexto_actual = llm_chain.invoke({
-                    "whole_document": contenido_tipo,
-                    "fragment": chunk
-                }).content
-                
-                fragmento_completo = (
-                    f"<contexto>{contexto_actual}</contexto> "
-                    f"<fragmento>[SERVICIO: {servicio_anterior}] [TIPO: {tipo_anterior}] [SUBTIPO: {subtipo_anterior}] [ID_SUB: {id_sub_anterior}] {chunk}</fragmento>"
-                )
+        total_chunks = sum(len(chunks) for chunks in chunks_por_documento)
+        print(f"Generando contexto para {total_chunks} chunks de {len(documentos_lote)} documentos...")
+        inicio = time.perf_counter()
+        contextos_por_documento, uso_por_documento = contextualizador.contextualizar_por_documento(
+            (documento["contenido"], chunks) for documento, chunks in zip(documentos_lote, chunks_por_documento)
+        )
+        for documento, uso in zip(documentos_lote, uso_por_documento):
+            print(
+                f"Tokens de prompt {documento['subtipo']} (ID_SUB {documento['id_sub']}): "
+                f"{uso['tokens_prompt']} ({uso['tokens_cacheados']} cacheados) en {uso['chunks']} chunks, "
+                f"{uso['desde_cache']} desde el caché de contextos"
+            )
+        print(f"Contextos generados en {time.perf_counter() - inicio:.1f} s ({contextualizador.metricas()})")
+        
+        # 3) Fragmentos para ChromaDB y BM25 por ID_SUB, en el orden original
+        fragmentos_por_id = {}
+        for documento, chunks, contextos in zip(documentos_lote, chunks_por_documento, contextos_por_documento):
+            servicio, tipo, subtipo, id_sub = documento["servicio"], documento["tipo"], documento["subtipo"], documento["id_sub"]
+            for chunk, contexto_actual in zip(chunks, contextos):
+                fragmento_completo = formatear_fragmento(chunk, contexto_actual, servicio, tipo, subtipo, id_sub)
                 
                 print(f"Registro BDVectorial: {fragmento_completo}\n\n")
-                documentos.append(fragmento_completo)
-                c.execute("INSERT INTO chunks VALUES (?)", (fragmento_completo,))
-            
-            contenido_tipo = ""
-        
-        servicio_anterior, tipo_anterior, subtipo_anterior, id_sub_anterior = servicio, tipo, subtipo, id_sub
-        contenido_tipo += f" SERVICIO: {servicio} TIPO: {tipo} SUBTIPO: {subtipo} ID_SUB: {id_sub}"
-        
-        campos = ["COPETE", "CONSISTE", "REQUISITOS", "PAUTAS", "QUIEN_PUEDE", "QUIENES_PUEDEN", "COMO_LO_HACEN"]
-        for campo in campos:
-            texto = normalizar_texto(item.get(campo, ""))
-            if texto:
-                contenido_tipo += f" {campo}: {texto}"
-        
-        clave_actual = clave_nueva
-    
-    conn_bm25.commit()
-    conn_bm25.close()
+                fragmentos_por_id.setdefault(id_sub, []).append({
+                    "texto": fragmento_completo,
+                    "metadata": {
+                        "servicio": servicio,
+                        "tipo": tipo,
+                        "subtipo": subtipo,
+                        "id_sub": id_sub
+                    },
+                    "bm25": {
+                        "chunk_texto": chunk, "contexto": contexto_actual, "servicio": servicio,
+                        "tipo": tipo, "subtipo": subtipo, "id_sub": id_sub
+                    }
+                })
+        return fragmentos_por_id
     
-    print("Generando embeddings y cargando en ChromaDB...")
-    embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-    vector_db = Chroma.from_texts(
-        texts=documentos,
-        embedding=embeddings,
-        persist_directory=directorio_bdvectorial,
-        collection_name=nombre_bdvectorial
-    )
+    # El export se lee en flujo; cada lote con cambios se contextualiza, se embebe y se confirma
+    # en ChromaDB, BM25 y el manifiesto. Si la carga se corta, la próxima corrida retoma desde
+    # el último lote confirmado
+    print("Aplicando los cambios en ChromaDB y BM25 por lotes...")
+    # Los procesos de preprocesamiento arrancan antes que los hilos de la ingesta
+    preprocesador = crear_preprocesador(config).iniciar()
+    try:
+        indexador = crear_indexador(config, vector_db, directorio_bdvectorial, nombre_bdvectorial, conn_bm25=conn_bm25)
+        try:
+            resumen = indexador.indexar_en_flujo(
+                leer_registros(ruta_archivo_json),
+                generar_fragmentos,
+                version=f"contextual/{tamano_chunk}/{overlap_chunk}/{version_prompt(prompt_template.template, model_name)}",
+                clave=lambda item: normalizar_texto(str(item.get("ID_SUB", "")))
+            )
+        finally:
+            indexador.cerrar()
+    finally:
+        preprocesador.cerrar()
+        conn_bm25.close()
     
-    print(f"Se han cargado {len(documentos)} documentos en ChromaDB y en BM25.")
+    print(f"Indexación incremental en ChromaDB y en BM25: {resumen}")
 
-procesar_json_y_cargar_bd()
+if __name__ == "__main__":
+    procesar_json_y_cargar_bd()
\ No newline at end of file
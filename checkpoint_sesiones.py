@@ -0,0 +1,248 @@
+"""
+Checkpointers acotados para conversaciones por sesión.
+
+Cada sesión (cookie emitida por el servidor, separada por ID de agente) tiene su propio
+thread en LangGraph. Para que la memoria no crezca sin límite:
+
+- Se limita la cantidad de mensajes que conserva cada thread (recortar_historial).
+- Se desalojan threads completos por LRU (max_hilos) y por inactividad (ttl_segundos).
+- Opcionalmente se persiste en SQLite (backend = sqlite) con el mismo desalojo.
+
+Configuración en config.ini, sección [SESIONES]:
+    backend = memoria | sqlite
+    max_hilos = 2000
+    ttl_segundos = 3600
+    max_mensajes = 12
+    sqlite_path = sesiones_checkpoints.db
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.messages import RemoveMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+
+def configuracion_sesiones(config):
+    """Lee la sección [SESIONES] de config.ini con valores por defecto."""
+    seccion = config['SESIONES'] if config.has_section('SESIONES') else config['DEFAULT']
+    return {
+        "backend": seccion.get('backend', fallback='memoria').strip().lower(),
+        "max_hilos": seccion.getint('max_hilos', fallback=2000),
+        "ttl_segundos": seccion.getint('ttl_segundos', fallback=3600),
+        "max_mensajes": seccion.getint('max_mensajes', fallback=12),
+        "sqlite_path": seccion.get('sqlite_path', fallback='sesiones_checkpoints.db'),
+    }
+
+
+def _thread_id(config):
+    return config.get("configurable", {}).get("thread_id")
+
+
+def borrar_thread_en_memoria(checkpointer, thread_id):
+    """
+    Elimina los checkpoints, las escrituras pendientes y los valores serializados
+    de los canales (`blobs`) de un thread de un MemorySaver.
+    """
+    storage = getattr(checkpointer, "storage", None)
+    if storage is not None:
+        storage.pop(thread_id, None)
+    # writes y blobs se indexan por tuplas que empiezan con el thread_id
+    for atributo in ("writes", "blobs"):
+        tabla = getattr(checkpointer, atributo, None)
+        if tabla is not None:
+            for clave in [clave for clave in list(tabla) if clave[0] == thread_id]:
+                tabla.pop(clave, None)
+
+
+class _DesalojoLRU:
+    """Registro de último acceso por thread con desalojo por LRU y TTL."""
+
+    def __init__(self, max_hilos, ttl_segundos, al_desalojar):
+        self.max_hilos = max_hilos
+        self.ttl_segundos = ttl_segundos
+        self._al_desalojar = al_desalojar
+        self._accesos = OrderedDict()
+        self._lock = threading.Lock()
+        self.desalojados = 0
+
+    def tocar(self, thread_id):
+        if thread_id is None:
+            return
+        ahora = time.monotonic()
+        with self._lock:
+            self._accesos[thread_id] = ahora
+            self._accesos.move_to_end(thread_id)
+            vencidos = self._vencidos(ahora)
+        for vencido in vencidos:
+            self._al_desalojar(vencido)
+
+    def olvidar(self, thread_id):
+        with self._lock:
+            self._accesos.pop(thread_id, None)
+
+    def _vencidos(self, ahora):
+        vencidos = []
+        # Los más viejos están al principio del OrderedDict
+        while self._accesos:
+            thread_id, ultimo_acceso = next(iter(self._accesos.items()))
+            expirado = self.ttl_segundos > 0 and ahora - ultimo_acceso > self.ttl_segundos
+            excedido = self.max_hilos > 0 and len(self._accesos) > self.max_hilos
+            if not (expirado or excedido):
+                break
+            self._accesos.popitem(last=False)
+            vencidos.append(thread_id)
+        self.desalojados += len(vencidos)
+        return vencidos
+
+    def __len__(self):
+        return len(self._accesos)
+
+
+class MemorySaverAcotado(MemorySaver):
+    """MemorySaver que desaloja threads inactivos (TTL) o menos usados (LRU)."""
+
+    def __init__(self, max_hilos=2000, ttl_segundos=3600):
+        super().__init__()
+        self._desalojo = _DesalojoLRU(max_hilos, ttl_segundos, self._borrar_thread)
+
+    def _borrar_thread(self, thread_id):
+        borrar_thread_en_memoria(self, thread_id)
+
+    def delete_thread(self, thread_id):
+        self._desalojo.olvidar(thread_id)
+        self._borrar_thread(thread_id)
+
+    def get_tuple(self, config):
+        self._desalojo.tocar(_thread_id(config))
+        return super().get_tuple(config)
+
+    def put(self, config, *args, **kwargs):
+        self._desalojo.tocar(_thread_id(config))
+        return super().put(config, *args, **kwargs)
+
+    def metricas(self):
+        return {"backend": "memoria", "hilos": len(self._desalojo), "desalojados": self._desalojo.desalojados}
+
+
+def _conectar(sqlite_path):
+    conn = sqlite3.connect(sqlite_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def crear_sqlite_saver_acotado(sqlite_path, max_hilos=2000, ttl_segundos=3600):
+    """
+    Crea un SqliteSaver con desalojo LRU/TTL de threads.
+
+    Requiere el paquete opcional `langgraph-checkpoint-sqlite`.
+    """
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class SqliteSaverAcotado(SqliteSaver):
+        def __init__(self, conn):
+            super().__init__(conn)
+            self._desalojo = _DesalojoLRU(max_hilos, ttl_segundos, self._borrar_thread)
+
+        def _borrar_thread(self, thread_id):
+            with self.lock:
+                self.conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                self.conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                self.conn.commit()
+
+        def delete_thread(self, thread_id):
+            self._desalojo.olvidar(thread_id)
+            self._borrar_thread(thread_id)
+
+        def get_tuple(self, config):
+            self._desalojo.tocar(_thread_id(config))
+            return super().get_tuple(config)
+
+        def put(self, config, *args, **kwargs):
+            self._desalojo.tocar(_thread_id(config))
+            return super().put(config, *args, **kwargs)
+
+        def metricas(self):
+            return {"backend": "sqlite", "hilos": len(self._desalojo), "desalojados": self._desalojo.desalojados}
+
+        # SqliteSaver no implementa la interfaz asíncrona (graph.astream); se delega
+        # en los métodos síncronos desde un hilo para no bloquear el event loop
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, **kwargs):
+            for checkpoint in await asyncio.to_thread(lambda: list(self.list(config, **kwargs))):
+                yield checkpoint
+
+        async def aput(self, config, *args, **kwargs):
+            return await asyncio.to_thread(self.put, config, *args, **kwargs)
+
+        async def aput_writes(self, config, *args, **kwargs):
+            return await asyncio.to_thread(self.put_writes, config, *args, **kwargs)
+
+        def reabrir(self):
+            """Abre una conexión propia (en un worker forkeado la del proceso padre no se comparte)."""
+            self.conn = _conectar(sqlite_path)
+            self.lock = threading.Lock()
+
+        def cerrar(self):
+            with self.lock:
+                self.conn.close()
+
+    saver = SqliteSaverAcotado(_conectar(sqlite_path))
+    saver.setup()
+    # Los threads persistidos por ejecuciones anteriores entran al LRU como
+    # recién usados, así quedan sujetos al mismo tope y TTL que los nuevos.
+    with saver.lock:
+        persistidos = [fila[0] for fila in saver.conn.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+    for thread_id in persistidos:
+        saver._desalojo.tocar(thread_id)
+    return saver
+
+
+def crear_checkpointer(config):
+    """Crea el checkpointer de sesiones según la sección [SESIONES] de config.ini."""
+    opciones = configuracion_sesiones(config)
+    if opciones["backend"] == "sqlite":
+        try:
+            return crear_sqlite_saver_acotado(
+                opciones["sqlite_path"], opciones["max_hilos"], opciones["ttl_segundos"]
+            )
+        except ImportError:
+            logging.warning("langgraph-checkpoint-sqlite no instalado; se usa el backend en memoria.")
+    return MemorySaverAcotado(opciones["max_hilos"], opciones["ttl_segundos"])
+
+
+def thread_id_de_sesion(session_id):
+    """Construye el thread_id de LangGraph para una sesión de agente."""
+    return f"sesion-{session_id}"
+
+
+def _mensajes_a_recortar(estado, max_mensajes):
+    mensajes = estado.values.get("messages", []) if estado and estado.values else []
+    if len(mensajes) < max_mensajes:
+        return []
+    limite = max_mensajes - 1
+    inicio = len(mensajes)
+    for i, mensaje in enumerate(mensajes):
+        if mensaje.type == "human" and len(mensajes) - i <= limite:
+            inicio = i
+            break
+    return [RemoveMessage(id=mensaje.id) for mensaje in mensajes[:inicio]]
+
+
+def recortar_historial(graph, config, max_mensajes):
+    """
+    Devuelve los RemoveMessage necesarios para que el thread no supere `max_mensajes`.
+
+    El corte se hace siempre al inicio de un turno humano, para no dejar
+    ToolMessages huérfanos de su llamada a herramienta. Se reserva lugar para
+    la pregunta nueva.
+    """
+    if max_mensajes <= 0:
+        return []
+    return _mensajes_a_recortar(graph.get_state(config), max_mensajes)
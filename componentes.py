@@ -0,0 +1,208 @@
+"""
+Contenedor de componentes pesados con inicialización diferida.
+
+Importar grafo_AGENTE_SERV_flask creaba en el acto OpenAIEmbeddings, abría
+Chroma, armaba ChatOpenAI y compilaba el grafo, así que el proceso tardaba en
+poder atender y cualquier error de configuración rompía el import. Acá cada
+componente se registra con una fábrica y se construye una sola vez por
+proceso:
+
+- la primera vez que se usa (`obtener`), o
+- antes, en un hilo de calentamiento en segundo plano (`calentar`), apenas
+  arranca el proceso.
+
+Construir un componente no alcanza para que la primera pregunta sea rápida:
+la colección de Chroma se carga al primer query y el caché de páginas de
+SQLite arranca vacío. Por eso, después de construir los componentes, el
+calentamiento corre las rutinas registradas con `registrar_calentamiento`
+(consultas sintéticas por `retrieve` y el reranker, ver
+`consultas_calentamiento`).
+
+`estado()` informa qué componentes y rutinas están listos, cuánto tardó cada
+uno y los errores, para el endpoint de readiness. Si el proceso nunca pidió
+el calentamiento (calentar_al_inicio = false), los componentes se construyen
+con la primera petición que los usa y el proceso se informa listo apenas
+arranca: si no, un balanceador que espera /readyz nunca le mandaría esa
+primera petición. `medir_import` registra
+cuánto tarda el import de cada módulo.
+
+Configuración en config.ini, sección [CALENTAMIENTO]:
+    habilitado = true
+    consultas =
+        ¿Cómo tramito la cobertura de pañales?
+        ¿Qué requisitos tiene la solicitud de prótesis?
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_SIN_VALOR = object()
+
+CONSULTAS_CALENTAMIENTO_POR_DEFECTO = """
+¿Cómo tramito la cobertura de pañales?
+¿Qué requisitos tiene la solicitud de prótesis?
+"""
+
+
+class ContenedorComponentes:
+    """Registro de fábricas con construcción diferida, thread-safe y una sola vez por componente."""
+
+    def __init__(self):
+        self._fabricas = {}
+        self._locks = {}
+        self._valores = {}
+        self._errores = {}
+        self._segundos = {}
+        self._lock = threading.Lock()
+        self._calentamiento = None
+        self._calentamiento_pedido = False
+        self._rutinas = {}
+        self._rutinas_pendientes = set()
+        self._rutinas_estado = {}
+        # Con preload de gunicorn el maestro solo construye; las rutinas abren
+        # conexiones y corren en cada worker (ver gunicorn.conf.py)
+        self.rutinas_habilitadas = os.environ.get("CALENTAMIENTO_EN_WORKERS") != "1"
+        self.segundos_import = {}
+
+    def registrar(self, nombre, fabrica):
+        """Registra la fábrica (función sin argumentos) del componente `nombre`."""
+        with self._lock:
+            self._fabricas[nombre] = fabrica
+            self._locks.setdefault(nombre, threading.Lock())
+
+    def registrar_calentamiento(self, nombre, rutina):
+        """Registra una rutina (función sin argumentos) que se corre al calentar, después de construir los componentes."""
+        with self._lock:
+            self._rutinas[nombre] = rutina
+
+    def obtener(self, nombre):
+        """Devuelve el componente, construyéndolo la primera vez."""
+        valor = self._valores.get(nombre, _SIN_VALOR)
+        if valor is not _SIN_VALOR:
+            return valor
+        if nombre not in self._fabricas:
+            raise KeyError(f"Componente no registrado: {nombre}")
+        with self._locks[nombre]:
+            if nombre not in self._valores:
+                inicio = time.perf_counter()
+                try:
+                    valor = self._fabricas[nombre]()
+                except Exception as e:
+                    self._errores[nombre] = str(e)
+                    raise
+                self._segundos[nombre] = round(time.perf_counter() - inicio, 3)
+                self._errores.pop(nombre, None)
+                self._valores[nombre] = valor
+                logging.info(f"Componente '{nombre}' inicializado en {self._segundos[nombre]} s")
+        return self._valores[nombre]
+
+    def calentar(self, nombres=None, en_segundo_plano=True):
+        """
+        Construye los componentes (todos los registrados por defecto) y corre las
+        rutinas de calentamiento, si están habilitadas.
+
+        Con `en_segundo_plano=True` lo hace en un hilo daemon y devuelve el hilo;
+        las peticiones que lleguen antes construyen o esperan el componente que usen.
+        """
+        nombres = list(nombres or self._fabricas)
+        rutinas = dict(self._rutinas) if self.rutinas_habilitadas else {}
+        self._calentamiento_pedido = True
+
+        def _calentar():
+            for nombre in nombres:
+                try:
+                    self.obtener(nombre)
+                except Exception as e:
+                    logging.error(f"No se pudo inicializar el componente '{nombre}': {str(e)}")
+            for nombre, rutina in rutinas.items():
+                inicio = time.perf_counter()
+                error = None
+                try:
+                    rutina()
+                except Exception as e:
+                    # El calentamiento es best effort: un error no deja la réplica sin servir
+                    error = str(e)
+                    logging.error(f"Falló la rutina de calentamiento '{nombre}': {error}")
+                self._rutinas_estado[nombre] = {"segundos": round(time.perf_counter() - inicio, 3), "error": error}
+                self._rutinas_pendientes.discard(nombre)
+                logging.info(f"Rutina de calentamiento '{nombre}' en {self._rutinas_estado[nombre]['segundos']} s")
+
+        if not en_segundo_plano:
+            self._rutinas_pendientes.update(rutinas)
+            _calentar()
+            return None
+        with self._lock:
+            if self._calentamiento is None or not self._calentamiento.is_alive():
+                # Pendientes desde ya: /readyz no informa listo antes de que arranque el hilo
+                self._rutinas_pendientes.update(rutinas)
+                self._calentamiento = threading.Thread(target=_calentar, name="componentes-calentamiento", daemon=True)
+                self._calentamiento.start()
+            return self._calentamiento
+
+    def esperar_calentamiento(self, timeout=None):
+        """Espera a que termine el calentamiento en segundo plano, si hay uno en curso."""
+        calentamiento = self._calentamiento
+        if calentamiento is not None:
+            calentamiento.join(timeout)
+
+    def listo(self, nombres=None):
+        """
+        True si todos los componentes (o los indicados) ya están construidos y no
+        queda ninguna rutina de calentamiento en curso. Sin calentamiento pedido,
+        True: los componentes se construyen con la primera petición.
+        """
+        if not self._calentamiento_pedido:
+            return True
+        if self._rutinas_pendientes:
+            return False
+        return all(nombre in self._valores for nombre in (nombres or self._fabricas))
+
+    def estado(self):
+        """Estado de cada componente y rutina de calentamiento y tiempos de import, para el endpoint de readiness."""
+        return {
+            "listo": self.listo(),
+            "componentes": {
+                nombre: {
+                    "listo": nombre in self._valores,
+                    "segundos": self._segundos.get(nombre),
+                    "error": self._errores.get(nombre),
+                }
+                for nombre in list(self._fabricas)
+            },
+            "calentamiento": {
+                nombre: {
+                    "listo": nombre in self._rutinas_estado,
+                    "segundos": self._rutinas_estado.get(nombre, {}).get("segundos"),
+                    "error": self._rutinas_estado.get(nombre, {}).get("error"),
+                }
+                for nombre in list(self._rutinas)
+            },
+            "segundos_import": dict(self.segundos_import),
+        }
+
+
+# Contenedor compartido por el proceso
+contenedor = ContenedorComponentes()
+
+
+def consultas_calentamiento(config):
+    """Consultas sintéticas de la sección [CALENTAMIENTO] (una por línea); vacía si está deshabilitado."""
+    seccion = config['CALENTAMIENTO'] if config.has_section('CALENTAMIENTO') else config['DEFAULT']
+    if not seccion.getboolean('habilitado', fallback=True):
+        return []
+    consultas = seccion.get('consultas', fallback=CONSULTAS_CALENTAMIENTO_POR_DEFECTO)
+    return [consulta.strip() for consulta in consultas.splitlines() if consulta.strip()]
+
+
+@contextmanager
+def medir_import(nombre):
+    """Registra cuánto tarda el bloque (típicamente un import) en `contenedor.segundos_import`."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        contenedor.segundos_import[nombre] = round(time.perf_counter() - inicio, 3)
+        logging.info(f"Import de '{nombre}' en {contenedor.segundos_import[nombre]} s")
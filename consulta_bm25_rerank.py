@@ -1,12 +1,14 @@
-import sqlite3
 import os
-import re
 import configparser
-import numpy as np
 import cohere
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
-from sentence_transformers import CrossEncoder  # <-- Importación del CrossEncoder
+from recuperacion_concurrente import ejecutar_en_paralelo
+from cache_embeddings import EmbeddingsConCache
+from servicio_reranker import crear_servicio_reranker
+from rerank_cascada import crear_rerank_cascada
+from componentes import contenedor
+from bm25_sqlite import obtener_pool, buscar_bm25, MMAP_SIZE_POR_DEFECTO, CACHE_SIZE_KIB_POR_DEFECTO
 
 # Cargar configuración
 config = configparser.ConfigParser()
@@ -28,31 +30,49 @@ max_results_chroma = config['SERVICIOS_SIMAP_ANTRO'].getint('max_results_chroma'
 rerank_enabled = config['SERVICIOS_SIMAP_ANTRO'].getboolean('rerank_enabled', False)
 rerank_top_n = config['SERVICIOS_SIMAP_ANTRO'].getint('rerank_top_n', 150)
 rerank_top_k = config['SERVICIOS_SIMAP_ANTRO'].getint('rerank_top_k', 20)
-
-# Inicializar el modelo de CrossEncoder de Hugging Face
-reranker = CrossEncoder("BAAI/bge-reranker-large")
-
-def clean_query(query):
-    """Limpia la consulta para FTS5 eliminando caracteres especiales"""
-    return re.sub(r'[^\w\s]', '', query)
+timeout_bm25 = config['SERVICIOS_SIMAP_ANTRO'].getfloat('timeout_bm25', 2.0)
+timeout_chroma = config['SERVICIOS_SIMAP_ANTRO'].getfloat('timeout_chroma', 8.0)
+
+# Modo de consulta FTS5 (AND, OR, NEAR, PREFIJO) y resaltado opcional (snippet, highlight)
+bm25_modo_consulta = config['SERVICIOS_SIMAP_ANTRO'].get('bm25_modo_consulta', 'OR')
+bm25_resaltado = config['SERVICIOS_SIMAP_ANTRO'].get('bm25_resaltado', '').strip() or None
+# Pesos de bm25() por columna del esquema estructurado: chunk_texto, contexto, subtipo
+bm25_pesos = tuple(float(peso) for peso in config['SERVICIOS_SIMAP_ANTRO'].get('bm25_pesos', '1.0,0.5,2.0').split(','))
+# Pool de conexiones de solo lectura al índice BM25
+pool_bm25 = obtener_pool(
+    bm25_db_path,
+    mmap_size=config['SERVICIOS_SIMAP_ANTRO'].getint('bm25_mmap_size', MMAP_SIZE_POR_DEFECTO),
+    cache_size_kib=config['SERVICIOS_SIMAP_ANTRO'].getint('bm25_cache_size_kib', CACHE_SIZE_KIB_POR_DEFECTO),
+)
+
+# Embeddings con caché de consultas: las preguntas repetidas no vuelven a la API
+embeddings = EmbeddingsConCache(
+    OpenAIEmbeddings(api_key=openai_api_key),
+    ruta_sqlite=config['DEFAULT'].get('cache_embeddings_path', 'cache_embeddings.db'),
+    max_memoria=config['DEFAULT'].getint('cache_embeddings_max_memoria', 2048),
+    ttl_disco_segundos=config['DEFAULT'].getint('cache_embeddings_ttl_segundos', 30 * 86400),
+    max_disco=config['DEFAULT'].getint('cache_embeddings_max_disco', 100000)
+)
+
+# CrossEncoder de Hugging Face: se carga al primer uso o en el calentamiento del
+# contenedor, así /readyz no informa la réplica lista antes de cargar el modelo
+reranker = crear_servicio_reranker(config)
+if rerank_enabled and config['SERVICIOS_SIMAP_ANTRO'].getboolean('reranker_calentar_al_inicio', True):
+    contenedor.registrar_calentamiento("reranker", reranker.calentar)
+# Reranking en cascada (opcional): prefiltro barato y el CrossEncoder solo sobre la lista corta
+cascada = crear_rerank_cascada(config, reranker.reordenar)
 
 def retrieve_bm25(query):
-    """Búsqueda BM25 con SQLite FTS5"""
+    """Búsqueda BM25 con SQLite FTS5."""
     print("\n🔍 Consultando BM25...")
     results = []
     try:
-        conn = sqlite3.connect(bm25_db_path)
-        cursor = conn.cursor()
-        safe_query = clean_query(query)
-        
-        cursor.execute(
-            "SELECT chunk_content FROM chunks WHERE chunk_content MATCH ? LIMIT ?",
-            (safe_query, max_results_bm25)
+        # Ranking real con bm25() de FTS5: RRF recibe los resultados en orden de relevancia
+        results = buscar_bm25(
+            pool_bm25, query, max_results_bm25, modo=bm25_modo_consulta, resaltado=bm25_resaltado,
+            pesos=bm25_pesos
         )
         
-        results = [{"content": row[0], "source": "BM25"} for row in cursor.fetchall()]
-        conn.close()
-        
     except Exception as e:
         print(f"❌ Error BM25: {str(e)}")
     print(f"BM25---------------------------")
@@ -67,7 +87,6 @@ def retrieve_chromadb(query):
         if not openai_api_key.startswith('sk-'):
             raise ValueError("API Key OpenAI inválida")
         
-        embeddings = OpenAIEmbeddings(api_key=openai_api_key)
         chroma = Chroma(
             collection_name=collection_name_fragmento,
             persist_directory=fragment_store_directory,
@@ -142,16 +161,14 @@ def cohere_rerank(query, documents):
     """Reorganización contextual con modelo pre-entrenado de Hugging Face usando CrossEncoder"""
     print("\n🎯 Reranking con HuggingFace CrossEncoder...")
     try:
-        # Crear pares (consulta, contenido del documento) para evaluar la relevancia
-        pairs = [(query, doc['content']) for doc in documents]
-        # Obtener puntuaciones de relevancia
-        scores = reranker.predict(pairs)
-        # Combinar puntuaciones con los documentos
-        scored_docs = list(zip(scores, documents))
-        # Ordenar los documentos por puntuación (de mayor a menor)
-        scored_docs = sorted(scored_docs, key=lambda x: x[0], reverse=True)
-        # Seleccionar los top K documentos reordenados
-        reranked_documents = [doc for _, doc in scored_docs[:rerank_top_k]]
+        # Puntúa los pares (consulta, contenido) en lotes, reutilizando los puntajes cacheados,
+        # y devuelve los top K documentos de mayor a menor
+        if cascada is not None:
+            reranked_documents = cascada.reordenar(query, documents, rerank_top_k)
+            print(f"📊 Métricas de la cascada: {cascada.metricas()}")
+        else:
+            reranked_documents = reranker.reordenar(query, documents, rerank_top_k)
+        print(f"📊 Métricas del reranker: {reranker.metricas()}")
         return reranked_documents
     except Exception as e:
         print(f"❌ Error en el reranking: {str(e)}")
@@ -160,9 +177,15 @@ def cohere_rerank(query, documents):
 def retrieve(query):
     print(f"\n🚀 Iniciando búsqueda para: '{query}'")
     print(f"\n🚀 Valores max_results_chroma: {max_results_chroma}  max_results_bm25: {max_results_bm25} para '{query}'")
-    # Búsquedas paralelas
-    bm25_res = retrieve_bm25(query)
-    chroma_res = retrieve_chromadb(query)
+    # Búsquedas paralelas: la latencia es max(bm25, chroma) en lugar de la suma
+    resultados, degradados = ejecutar_en_paralelo(
+        {"bm25": lambda: retrieve_bm25(query), "chroma": lambda: retrieve_chromadb(query)},
+        {"bm25": timeout_bm25, "chroma": timeout_chroma},
+    )
+    if degradados:
+        print(f"\n⚠️ Recuperación degradada, sin resultados de: {', '.join(degradados)}")
+    bm25_res = resultados["bm25"]
+    chroma_res = resultados["chroma"]
 
     # Fusión híbrrerank_enableida mejorada
     fused = rank_fusion(bm25_res, chroma_res)
@@ -13,7 +13,7 @@ def mostrar_contenido_bm25():
         c = conn.cursor()
         
         # Obtener todas las filas de la tabla chunks
-        c.execute("SELECT rowid, chunk_content FROM chunks WHERE chunk_content MATCH 'Afiliacion hijos estudiantes del titular hasta 25 años inclusive' ")  # Muestra hasta 50 registros
+        c.execute("SELECT rowid, chunk_texto FROM chunks WHERE chunks MATCH 'Afiliacion hijos estudiantes del titular hasta 25 años inclusive' ")  # Esquema estructurado (bm25_sqlite.py)
         rows = c.fetchall()
         
         conn.close()
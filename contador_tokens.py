@@ -0,0 +1,195 @@
+"""
+Conteo de tokens compartido por el agente, los scripts de conteo y los loaders.
+
+Los codificadores de tiktoken se resuelven una sola vez por familia de modelo
+y quedan memorizados para todo el proceso. El conteo usa `encode_ordinary`
+(sin el chequeo de tokens especiales, que para contar no hace falta) y hay una
+API por lotes que codifica muchos textos en paralelo con `encode_ordinary_batch`.
+
+También incluye el chunker por tokens de la ingesta, que codifica cada campo una
+sola vez en lugar de recodificar la ventana en cada palabra.
+"""
+
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+# Familias de codificación: mismo mapeo que usaban las funciones contar_tokens originales
+FAMILIA_GPT4 = "gpt-4"
+FAMILIA_GPT35 = "gpt-3.5-turbo"
+FAMILIA_POR_DEFECTO = "cl100k_base"
+
+
+def familia_modelo(modelo):
+    """Devuelve la familia de codificación para un nombre de modelo."""
+    modelo = modelo or ""
+    if modelo.startswith("gpt-4"):
+        return FAMILIA_GPT4
+    if modelo.startswith("gpt-3.5"):
+        return FAMILIA_GPT35
+    return FAMILIA_POR_DEFECTO
+
+
+@lru_cache(maxsize=None)
+def _codificador_de_familia(familia):
+    if familia == FAMILIA_POR_DEFECTO:
+        return tiktoken.get_encoding(FAMILIA_POR_DEFECTO)
+    return tiktoken.encoding_for_model(familia)
+
+
+def obtener_codificador(modelo="gpt-3.5-turbo"):
+    """Codificador de tiktoken memorizado para el modelo indicado."""
+    return _codificador_de_familia(familia_modelo(modelo))
+
+
+def contar_tokens(texto, modelo="gpt-3.5-turbo"):
+    """
+    Cuenta el número de tokens en un texto para un modelo específico.
+
+    Args:
+        texto (str): El texto para contar tokens
+        modelo (str): El nombre del modelo (por defecto: gpt-3.5-turbo)
+
+    Returns:
+        int: Número de tokens
+    """
+    if not texto:
+        return 0
+    try:
+        return len(obtener_codificador(modelo).encode_ordinary(texto))
+    except Exception as e:
+        logging.error(f"Error al contar tokens: {str(e)}")
+        return 0
+
+
+def contar_tokens_lote(textos, modelo="gpt-3.5-turbo", hilos=8):
+    """
+    Cuenta los tokens de muchos textos en una sola llamada.
+
+    Args:
+        textos (list): Textos a contar
+        modelo (str): El nombre del modelo
+        hilos (int): Hilos que usa tiktoken para codificar el lote
+
+    Returns:
+        list: Cantidad de tokens de cada texto, en el mismo orden
+    """
+    textos = [texto or "" for texto in textos]
+    if not textos:
+        return []
+    try:
+        codificados = obtener_codificador(modelo).encode_ordinary_batch(textos, num_threads=hilos)
+        return [len(tokens) for tokens in codificados]
+    except Exception as e:
+        logging.error(f"Error al contar tokens por lote: {str(e)}")
+        return [0] * len(textos)
+
+
+def _validar_solapamiento(solapamiento):
+    # Con 0, `lista[-0:]` de la versión de referencia repetiría la ventana entera
+    if solapamiento <= 0:
+        raise ValueError("El solapamiento debe ser mayor que 0.")
+
+
+def _ventana_solapada(inicio, fin, solapamiento):
+    """Inicio de la ventana que deja `lista[inicio:fin][-solapamiento:]`."""
+    return max(inicio, fin - solapamiento)
+
+
+def _tokens_por_palabra(codificador, palabras):
+    """
+    Tokens de cada palabra dentro de `' '.join(palabras)`, codificando el texto una sola vez.
+
+    Con espacios simples (el texto ya viene normalizado) los pre-tokens de tiktoken
+    nunca cruzan el límite entre palabras, así que cada token cae en un único tramo
+    " palabra" y los conteos son aditivos. Cada token se asigna a su palabra por el
+    desplazamiento en bytes donde empieza.
+    """
+    tokens = codificador.encode_ordinary(' '.join(palabras))
+    fines = []
+    posicion = 0
+    for indice, palabra in enumerate(palabras):
+        posicion += len(palabra.encode('utf-8')) + (1 if indice else 0)
+        fines.append(posicion)
+
+    conteos = [0] * len(palabras)
+    palabra_actual = 0
+    posicion = 0
+    for token_bytes in codificador.decode_tokens_bytes(tokens):
+        while palabra_actual < len(palabras) - 1 and posicion >= fines[palabra_actual]:
+            palabra_actual += 1
+        conteos[palabra_actual] += 1
+        posicion += len(token_bytes)
+    return conteos
+
+
+def dividir_en_chunks_por_tokens(texto, tamano_chunk, solapamiento, modelo="cl100k_base"):
+    """
+    Divide el texto en chunks de hasta `tamano_chunk` tokens respetando los límites de palabra.
+
+    Codifica el texto una vez y recorre ventanas de palabras con sumas de prefijos,
+    en tiempo lineal. Los cortes son idénticos a `dividir_en_chunks_por_tokens_referencia`:
+    al superar el tamaño se emite la ventana sin la última palabra y la siguiente
+    arranca con las últimas `solapamiento` palabras. Una palabra que sola ya supera
+    el tamaño no genera un chunk vacío.
+
+    Args:
+        texto (str): Texto normalizado (palabras separadas por un espacio)
+        tamano_chunk (int): Máximo de tokens por chunk
+        solapamiento (int): Palabras que se repiten entre chunks consecutivos (mayor que 0)
+        modelo (str): Modelo o codificación de tiktoken
+
+    Yields:
+        str: Cada chunk de texto
+
+    Raises:
+        ValueError: si `solapamiento` no es mayor que 0
+    """
+    _validar_solapamiento(solapamiento)
+    palabras = texto.split()
+    if not palabras:
+        return
+    codificador = obtener_codificador(modelo)
+    conteos = _tokens_por_palabra(codificador, palabras)
+    prefijos = [0]
+    for conteo in conteos:
+        prefijos.append(prefijos[-1] + conteo)
+
+    # La primera palabra de cada ventana va sin espacio delante: se codifica aparte
+    sueltas = {0: conteos[0]}
+
+    def tokens_ventana(inicio, fin):
+        if inicio not in sueltas:
+            sueltas[inicio] = len(codificador.encode_ordinary(palabras[inicio]))
+        return sueltas[inicio] + prefijos[fin + 1] - prefijos[inicio + 1]
+
+    inicio = 0
+    for fin in range(len(palabras)):
+        if tokens_ventana(inicio, fin) > tamano_chunk:
+            if fin > inicio:
+                yield ' '.join(palabras[inicio:fin])
+            inicio = _ventana_solapada(inicio, fin + 1, solapamiento)
+
+    yield ' '.join(palabras[inicio:])
+
+
+def dividir_en_chunks_por_tokens_referencia(texto, tamano_chunk, solapamiento, modelo="cl100k_base"):
+    """
+    Versión de referencia (cuadrática): vuelve a codificar la ventana en cada palabra.
+
+    Sirve para verificar que `dividir_en_chunks_por_tokens` produce los mismos cortes.
+    """
+    _validar_solapamiento(solapamiento)
+    codificador = obtener_codificador(modelo)
+    chunk_actual = []
+
+    for palabra in texto.split():
+        chunk_actual.append(palabra)
+        if len(codificador.encode_ordinary(' '.join(chunk_actual))) > tamano_chunk:
+            if len(chunk_actual) > 1:
+                yield ' '.join(chunk_actual[:-1])
+            chunk_actual = chunk_actual[-solapamiento:]
+
+    if chunk_actual:
+        yield ' '.join(chunk_actual)
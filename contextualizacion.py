@@ -0,0 +1,175 @@
+"""
+Generación concurrente de contextos para la ingesta con contextual retrieval.
+
+Cada chunk necesita una llamada al LLM que lo sitúe dentro de su documento.
+En lugar de hacerlas en serie se reparten en un pool acotado de hilos:
+
+- Un limitador de tasa (solicitudes por minuto) espacia los envíos para no
+  chocar con el rate limit del proveedor.
+- Los errores transitorios (rate limit, timeouts, conexión, 5xx) se reintentan
+  con backoff exponencial y jitter; el resto se propaga sin reintentar (ver
+  reintentos.py). El cliente del LLM va con `max_retries=0`.
+- Los resultados se devuelven en el mismo orden que los trabajos, así el índice
+  queda igual que con la carga secuencial.
+- Los chunks se agrupan por documento: el prompt empieza con el documento
+  completo, así que se envía primero un chunk solo para calentar el caché de
+  prefijos del proveedor y después el resto del documento en paralelo. Se
+  registran los tokens de prompt cacheados y no cacheados de cada documento.
+- Con un `CacheContextos` (cache_contextos.py) los chunks ya contextualizados
+  con el mismo documento y la misma versión del prompt no vuelven al LLM.
+
+Configuración en config.ini, sección [CONTEXTUALIZACION]:
+    max_concurrencia = 8
+    solicitudes_por_minuto = 500
+    reintentos = 5
+    espera_base = 1.0
+    cache_contextos_path = cache_contextos.db
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from reintentos import es_error_transitorio
+
+
+class LimitadorTasa:
+    """Espacia las solicitudes para no superar `solicitudes_por_minuto` (0 = sin límite)."""
+
+    def __init__(self, solicitudes_por_minuto=0):
+        self.intervalo = 60.0 / solicitudes_por_minuto if solicitudes_por_minuto else 0.0
+        self._proximo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        if not self.intervalo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._proximo)
+            self._proximo = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+class Contextualizador:
+    """Invoca la cadena de contextualización en paralelo, con límite de tasa y reintentos."""
+
+    def __init__(self, cadena, max_concurrencia=8, solicitudes_por_minuto=500, reintentos=5, espera_base=1.0,
+                 cache=None):
+        self.cadena = cadena
+        self.cache = cache
+        self.max_concurrencia = max(1, max_concurrencia)
+        self.limitador = LimitadorTasa(solicitudes_por_minuto)
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self._lock = threading.Lock()
+        # Acota las llamadas en vuelo aunque haya hilos de documentos y de chunks
+        self._en_vuelo = threading.BoundedSemaphore(self.max_concurrencia)
+        self._metricas = {"llamadas": 0, "reintentos": 0, "tokens_prompt": 0, "tokens_cacheados": 0}
+
+    def _invocar(self, entrada):
+        for intento in range(self.reintentos + 1):
+            self.limitador.esperar()
+            try:
+                with self._en_vuelo:
+                    respuesta = self.cadena.invoke(entrada)
+                tokens_prompt, tokens_cacheados = uso_de_tokens(respuesta)
+                with self._lock:
+                    self._metricas["llamadas"] += 1
+                    self._metricas["tokens_prompt"] += tokens_prompt
+                    self._metricas["tokens_cacheados"] += tokens_cacheados
+                return respuesta
+            except Exception as e:
+                if intento == self.reintentos or not es_error_transitorio(e):
+                    raise
+                espera = self.espera_base * (2 ** intento) * (1 + random.random())
+                with self._lock:
+                    self._metricas["reintentos"] += 1
+                logging.warning(f"Contextualización fallida ({str(e)}), reintento {intento + 1} en {espera:.1f} s")
+                time.sleep(espera)
+
+    def _contextualizar_documento(self, pool_chunks, documento, chunks):
+        contextos = [self.cache.buscar(documento, chunk) if self.cache else None for chunk in chunks]
+        faltantes = [indice for indice, contexto in enumerate(contextos) if contexto is None]
+        uso = {"chunks": len(chunks), "desde_cache": len(chunks) - len(faltantes), "tokens_prompt": 0, "tokens_cacheados": 0}
+        if not faltantes:
+            return contextos, uso
+
+        entradas = [{"whole_document": documento, "fragment": chunks[indice]} for indice in faltantes]
+        # El primer chunk va solo: deja el prefijo (el documento completo) en el caché del proveedor
+        respuestas = [self._invocar(entradas[0])]
+        respuestas += list(pool_chunks.map(self._invocar, entradas[1:]))
+        for indice, respuesta in zip(faltantes, respuestas):
+            tokens_prompt, tokens_cacheados = uso_de_tokens(respuesta)
+            uso["tokens_prompt"] += tokens_prompt
+            uso["tokens_cacheados"] += tokens_cacheados
+            contextos[indice] = respuesta.content
+            if self.cache:
+                self.cache.guardar(documento, chunks[indice], respuesta.content)
+        return contextos, uso
+
+    def contextualizar_por_documento(self, documentos):
+        """
+        Genera los contextos agrupando los chunks por documento.
+
+        Args:
+            documentos (list): Pares (documento completo, lista de chunks), en el orden de carga
+
+        Returns:
+            tuple: (contextos, uso) — una lista de contextos por documento y, por documento,
+                   un dict con chunks, desde_cache, tokens_prompt y tokens_cacheados
+        """
+        documentos = [(documento, list(chunks)) for documento, chunks in documentos]
+        resultados = [([], {"chunks": 0, "desde_cache": 0, "tokens_prompt": 0, "tokens_cacheados": 0})] * len(documentos)
+        pendientes = [indice for indice, (_, chunks) in enumerate(documentos) if chunks]
+        if pendientes:
+            hilos = min(self.max_concurrencia, len(pendientes))
+            with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="contexto-doc") as pool_documentos, \
+                    ThreadPoolExecutor(max_workers=self.max_concurrencia, thread_name_prefix="contexto") as pool_chunks:
+                futuros = {
+                    indice: pool_documentos.submit(self._contextualizar_documento, pool_chunks, *documentos[indice])
+                    for indice in pendientes
+                }
+                for indice, futuro in futuros.items():
+                    resultados[indice] = futuro.result()
+        return [contextos for contextos, _ in resultados], [uso for _, uso in resultados]
+
+    def metricas(self):
+        with self._lock:
+            metricas = dict(self._metricas)
+        total = metricas["tokens_prompt"]
+        metricas["proporcion_cacheada"] = metricas["tokens_cacheados"] / total if total else 0.0
+        if self.cache:
+            metricas["cache_contextos"] = self.cache.metricas()
+        return metricas
+
+
+def uso_de_tokens(respuesta):
+    """
+    Tokens de prompt totales y cacheados de una respuesta del LLM.
+
+    Usa `usage_metadata` de LangChain y, si no está, el `token_usage` crudo de OpenAI.
+    """
+    uso = getattr(respuesta, "usage_metadata", None) or {}
+    if uso:
+        detalle = uso.get("input_token_details") or {}
+        return uso.get("input_tokens", 0) or 0, detalle.get("cache_read", 0) or 0
+    token_usage = (getattr(respuesta, "response_metadata", None) or {}).get("token_usage") or {}
+    detalle = token_usage.get("prompt_tokens_details") or {}
+    return token_usage.get("prompt_tokens", 0) or 0, detalle.get("cached_tokens", 0) or 0
+
+
+def crear_contextualizador(config, cadena, cache=None):
+    """Crea el contextualizador según la sección [CONTEXTUALIZACION] de config.ini."""
+    seccion = config['CONTEXTUALIZACION'] if config.has_section('CONTEXTUALIZACION') else config['DEFAULT']
+    return Contextualizador(
+        cadena,
+        max_concurrencia=seccion.getint('max_concurrencia', fallback=8),
+        solicitudes_por_minuto=seccion.getint('solicitudes_por_minuto', fallback=500),
+        reintentos=seccion.getint('reintentos', fallback=5),
+        espera_base=seccion.getfloat('espera_base', fallback=1.0),
+        cache=cache,
+    )
@@ -0,0 +1,130 @@
+"""
+Etapa de embeddings por lotes para la ingesta.
+
+En lugar de dejar que `Chroma.from_documents` embeba y escriba con los lotes
+por defecto de la librería, sin concurrencia ni progreso:
+
+- Los textos se agrupan en lotes acotados por tokens (y por cantidad de textos),
+  contados con el codificador memorizado de contador_tokens.
+- Varios lotes se embeben en paralelo (`max_concurrencia` solicitudes a la vez).
+- Los lotes que fallan por errores transitorios (rate limit, timeouts, cortes
+  de red, 5xx) se reintentan con backoff exponencial, sin reiniciar la carga;
+  el resto se propaga enseguida (ver reintentos.py). El cliente de embeddings
+  va con `max_retries=0`.
+- Los vectores se escriben en Chroma con upserts masivos y se informa el
+  rendimiento en documentos por segundo.
+
+Configuración en config.ini, sección [INDEXACION]:
+    max_tokens_lote_embeddings = 100000
+    max_textos_lote_embeddings = 512
+    max_concurrencia_embeddings = 4
+    reintentos_embeddings = 5
+"""
+
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from contador_tokens import contar_tokens_lote
+from reintentos import es_error_transitorio
+
+# Máximo de filas por llamada a upsert de Chroma (el límite del cliente ronda las 5461)
+LOTE_ESCRITURA_CHROMA = 5000
+
+
+class CargadorEmbeddings:
+    """Embebe textos en lotes concurrentes y los escribe en Chroma en bloque."""
+
+    def __init__(self, embeddings, max_tokens_lote=100000, max_textos_lote=512, max_concurrencia=4,
+                 reintentos=5, espera_base=1.0):
+        self.embeddings = embeddings
+        self.max_tokens_lote = max_tokens_lote
+        self.max_textos_lote = max_textos_lote
+        self.max_concurrencia = max(1, max_concurrencia)
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+
+    def armar_lotes(self, textos):
+        """Rangos (inicio, fin) de lotes que no superan el presupuesto de tokens ni de textos."""
+        lotes = []
+        inicio, tokens_lote = 0, 0
+        for indice, tokens in enumerate(contar_tokens_lote(textos)):
+            if indice > inicio and (tokens_lote + tokens > self.max_tokens_lote
+                                    or indice - inicio >= self.max_textos_lote):
+                lotes.append((inicio, indice))
+                inicio, tokens_lote = indice, 0
+            tokens_lote += tokens
+        if inicio < len(textos):
+            lotes.append((inicio, len(textos)))
+        return lotes
+
+    def _embeber_lote(self, textos):
+        for intento in range(self.reintentos + 1):
+            try:
+                return self.embeddings.embed_documents(textos)
+            except Exception as e:
+                if intento == self.reintentos or not es_error_transitorio(e):
+                    raise
+                espera = self.espera_base * (2 ** intento) * (1 + random.random())
+                logging.warning(f"Lote de embeddings fallido ({str(e)}), reintento {intento + 1} en {espera:.1f} s")
+                time.sleep(espera)
+
+    def embeber(self, textos):
+        """Vectores de todos los textos, en el mismo orden."""
+        textos = list(textos)
+        lotes = self.armar_lotes(textos)
+        vectores = []
+        if not lotes:
+            return vectores
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrencia, len(lotes)),
+                                thread_name_prefix="embeddings") as pool:
+            resultados = pool.map(self._embeber_lote, (textos[desde:hasta] for desde, hasta in lotes))
+            for numero, vectores_lote in enumerate(resultados, 1):
+                vectores.extend(vectores_lote)
+                transcurrido = time.perf_counter() - inicio
+                logging.info(
+                    f"Embeddings: lote {numero}/{len(lotes)}, {len(vectores)}/{len(textos)} documentos "
+                    f"({len(vectores) / transcurrido:.1f} docs/s)"
+                )
+        return vectores
+
+    def cargar(self, vector_store, textos, metadatas, ids):
+        """
+        Embebe y escribe en la colección de Chroma con upserts masivos.
+
+        Returns:
+            dict: documentos, lotes, segundos y documentos por segundo
+        """
+        inicio = time.perf_counter()
+        textos = list(textos)
+        vectores = self.embeber(textos)
+        coleccion = vector_store._collection
+        for desde in range(0, len(textos), LOTE_ESCRITURA_CHROMA):
+            hasta = desde + LOTE_ESCRITURA_CHROMA
+            coleccion.upsert(
+                ids=ids[desde:hasta],
+                embeddings=vectores[desde:hasta],
+                documents=textos[desde:hasta],
+                # Chroma no acepta metadata vacía
+                metadatas=[metadata or None for metadata in metadatas[desde:hasta]],
+            )
+        segundos = time.perf_counter() - inicio
+        return {
+            "documentos": len(textos),
+            "segundos_embeddings": round(segundos, 2),
+            "docs_por_segundo": round(len(textos) / segundos, 1) if segundos else 0.0,
+        }
+
+
+def crear_cargador_embeddings(config, embeddings):
+    """Crea el cargador según la sección [INDEXACION] de config.ini."""
+    seccion = config['INDEXACION'] if config.has_section('INDEXACION') else config['DEFAULT']
+    return CargadorEmbeddings(
+        embeddings,
+        max_tokens_lote=seccion.getint('max_tokens_lote_embeddings', fallback=100000),
+        max_textos_lote=seccion.getint('max_textos_lote_embeddings', fallback=512),
+        max_concurrencia=seccion.getint('max_concurrencia_embeddings', fallback=4),
+        reintentos=seccion.getint('reintentos_embeddings', fallback=5),
+    )
@@ -1,11 +1,13 @@
 # 🛠 Configuración e Instalación de Dependencias
 
 # 🔑 Configuración de la API Key de OpenAI
+import asyncio
 import getpass
 import os
+import time
 import configparser
 import logging
-import tiktoken  # Agregamos tiktoken para contar tokens
+from contador_tokens import contar_tokens  # Codificadores de tiktoken memorizados por familia de modelo
 import datetime
 import json
 
@@ -60,21 +62,40 @@ if "USER_AGENT" not in os.environ:
     os.environ["USER_AGENT"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     log_message("USER_AGENT configurado en las variables de entorno.")
 
-# Cargar documentos y crear la conexión al vector store en Chroma
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+# Embeddings, vector store, LLM, grafo y caché se crean al primer uso o en el
+# calentamiento en segundo plano (ver componentes.py), no al importar el módulo
+from componentes import contenedor, consultas_calentamiento
+from langchain_core.tools import StructuredTool
+
+def crear_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    from cache_embeddings import EmbeddingsConCache
+
+    # Crear embeddings con caché de consultas (LRU en memoria + SQLite en disco)
+    embeddings = EmbeddingsConCache(
+        OpenAIEmbeddings(api_key=os.environ['OPENAI_API_KEY']),
+        ruta_sqlite=config['DEFAULT'].get('cache_embeddings_path', fallback='cache_embeddings.db'),
+        max_memoria=config['DEFAULT'].getint('cache_embeddings_max_memoria', fallback=2048),
+        ttl_disco_segundos=config['DEFAULT'].getint('cache_embeddings_ttl_segundos', fallback=30 * 86400),
+        max_disco=config['DEFAULT'].getint('cache_embeddings_max_disco', fallback=100000)
+    )
+    log_message("Embeddings creados con OpenAI (con caché de consultas).")
+    return embeddings
 
-# Crear embeddings
-embeddings = OpenAIEmbeddings(api_key=os.environ['OPENAI_API_KEY'])
-log_message("Embeddings creados con OpenAI.")
+def crear_vector_store():
+    from langchain_chroma import Chroma
 
-# Conectar al vector store existente en Chroma
-vector_store = Chroma(
-    collection_name=collection_name_fragmento,
-    persist_directory=fragment_store_directory,
-    embedding_function=embeddings
-)
-log_message("Vector store cargado correctamente desde Chroma.")
+    # Conectar al vector store existente en Chroma
+    vector_store = Chroma(
+        collection_name=collection_name_fragmento,
+        persist_directory=fragment_store_directory,
+        embedding_function=contenedor.obtener("embeddings_servicios")
+    )
+    log_message("Vector store cargado correctamente desde Chroma.")
+    return vector_store
+
+contenedor.registrar("embeddings_servicios", crear_embeddings)
+contenedor.registrar("vector_store_servicios", crear_vector_store)
 
 def count_words(text):
     """Cuenta el número de palabras en un texto."""
@@ -107,7 +128,28 @@ def retrieve(query: str):
     tokens_consulta = contar_tokens(query, model_name)
     log_message(f"Tokens de entrada en retrieve (consulta): {tokens_consulta}")
     
+    vector_store = contenedor.obtener("vector_store_servicios")
     retrieved_docs = vector_store.similarity_search_with_score(query, k=max_results)
+    return serializar_recuperados(retrieved_docs, tokens_consulta)
+
+async def aretrieve(query: str):
+    """Recuperar información relacionada con la consulta."""
+    log_message(f"########### RETRIEVE (ASYNC) --------#####################")
+    tokens_consulta = contar_tokens(query, model_name)
+    log_message(f"Tokens de entrada en retrieve (consulta): {tokens_consulta}")
+
+    # El embedding de la consulta viaja por HTTP asíncrono; la búsqueda local en Chroma va a un hilo
+    embeddings = contenedor.obtener("embeddings_servicios")
+    vector_store = contenedor.obtener("vector_store_servicios")
+    vector_consulta = await embeddings.aembed_query(query)
+    retrieved_docs = await asyncio.to_thread(
+        vector_store.similarity_search_by_vector_with_relevance_scores, vector_consulta, k=max_results
+    )
+    return serializar_recuperados(retrieved_docs, tokens_consulta)
+
+def serializar_recuperados(retrieved_docs, tokens_consulta):
+    """Arma el texto de los fragmentos recuperados que recibe el nodo generate."""
+    log_message(f"Caché de embeddings: {contenedor.obtener('embeddings_servicios').metricas()}")
 
     documentos_relevantes = [doc for doc, score in retrieved_docs]
     cantidad_fragmentos = len(documentos_relevantes)
@@ -135,47 +177,37 @@ def retrieve(query: str):
 # Inicializamos el contador de fragmentos
 retrieve.last_fragments_count = 0
 
+# Herramienta con variante síncrona (graph.stream) y asíncrona (graph.astream)
+retrieve_tool = StructuredTool.from_function(func=retrieve, coroutine=aretrieve, name="retrieve")
+
+# Calentamiento: consultas sintéticas por retrieve cargan la colección de Chroma
+# y las páginas SQLite del caché de embeddings antes de la primera pregunta real
+consultas_sinteticas = consultas_calentamiento(config)
+
+def calentar_recuperacion():
+    for consulta in consultas_sinteticas:
+        retrieve(consulta)
+
+if consultas_sinteticas:
+    contenedor.registrar_calentamiento("retrieve_servicios", calentar_recuperacion)
+
 # Crear el Gráfico de Conversación con LangGraph
 from langgraph.graph import MessagesState, StateGraph
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableLambda
 
 # Inicialización del gráfico de mensajes
 graph_builder = StateGraph(MessagesState)
 
 # Primero define tu modelo de lenguaje
-from langchain_openai import ChatOpenAI  # o el modelo que estés usando
+def crear_llm():
+    from langchain_openai import ChatOpenAI  # o el modelo que estés usando
 
-llm = ChatOpenAI(model=model_name, temperature=0) # Ajusta los parámetros según necesites
+    return ChatOpenAI(model=model_name, temperature=0) # Ajusta los parámetros según necesites
+
+contenedor.registrar("llm_servicios", crear_llm)
 
-# Función para contar tokens usando tiktoken
-def contar_tokens(texto, modelo="gpt-3.5-turbo"):
-    """
-    Cuenta el número de tokens en un texto para un modelo específico.
-    
-    Args:
-        texto (str): El texto para contar tokens
-        modelo (str): El nombre del modelo (por defecto: gpt-3.5-turbo)
-        
-    Returns:
-        int: Número de tokens
-    """
-    try:
-        # Mapeamos nombres de modelos a codificadores
-        if modelo.startswith("gpt-4"):
-            codificador = tiktoken.encoding_for_model("gpt-4")
-        elif modelo.startswith("gpt-3.5"):
-            codificador = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        else:
-            # Usamos cl100k_base para modelos más recientes
-            codificador = tiktoken.get_encoding("cl100k_base")
-            
-        # Contar tokens
-        tokens = len(codificador.encode(texto))
-        return tokens
-    except Exception as e:
-        log_message(f"Error al contar tokens: {str(e)}", level='ERROR')
-        return 0
 
 # Nodo 1: Generar consulta o responder directamente
 def query_or_respond(state: MessagesState):
@@ -187,9 +219,22 @@ def query_or_respond(state: MessagesState):
     tokens_entrada_qor = contar_tokens(prompt_text, model_name)
     log_message(f"Tokens de entrada en query_or_respond: {tokens_entrada_qor}")
     
-    llm_with_tools = llm.bind_tools([retrieve])
+    llm_with_tools = contenedor.obtener("llm_servicios").bind_tools([retrieve_tool])
     response = llm_with_tools.invoke(state["messages"])
-    
+    return registrar_query_or_respond(response, tokens_entrada_qor)
+
+async def aquery_or_respond(state: MessagesState):
+    """Genera una consulta para la herramienta de recuperación o responde directamente."""
+    log_message(f"########### QUERY OR RESPOND (ASYNC) ---------#####################")
+    prompt_text = "\n".join([msg.content for msg in state["messages"]])
+    tokens_entrada_qor = contar_tokens(prompt_text, model_name)
+    log_message(f"Tokens de entrada en query_or_respond: {tokens_entrada_qor}")
+
+    llm_with_tools = contenedor.obtener("llm_servicios").bind_tools([retrieve_tool])
+    response = await llm_with_tools.ainvoke(state["messages"])
+    return registrar_query_or_respond(response, tokens_entrada_qor)
+
+def registrar_query_or_respond(response, tokens_entrada_qor):
     # Contamos tokens de salida
     tokens_salida_qor = contar_tokens(response.content, model_name)
     log_message(f"Tokens de salida en query_or_respond: {tokens_salida_qor}")
@@ -198,22 +243,50 @@ def query_or_respond(state: MessagesState):
     return {"messages": [response]}
 
 # Nodo 2: Ejecutar la herramienta de recuperación
-tools = ToolNode([retrieve])
+tools = ToolNode([retrieve_tool])
 
 # Nodo 3: Generar la respuesta final
 def generate(state: MessagesState):
     """Genera la respuesta final usando los documentos recuperados."""
+    respuesta_directa, prompt, tokens_entrada = preparar_generate(state)
+    if respuesta_directa is not None:
+        return respuesta_directa
+    # Realizamos la inferencia
+    response = contenedor.obtener("llm_servicios").invoke(prompt)
+    return registrar_generate(response, tokens_entrada)
+
+async def agenerate(state: MessagesState):
+    """Genera la respuesta final usando los documentos recuperados."""
+    respuesta_directa, prompt, tokens_entrada = preparar_generate(state)
+    if respuesta_directa is not None:
+        return respuesta_directa
+    response = await contenedor.obtener("llm_servicios").ainvoke(prompt)
+    return registrar_generate(response, tokens_entrada)
+
+def preparar_generate(state: MessagesState):
+    """
+    Arma el prompt del nodo generate.
+
+    Returns:
+        tuple: (respuesta directa o None, prompt, tokens de entrada)
+    """
     log_message(f"###########WEB-generate---------#####################")
-    recent_tool_messages = [msg for msg in reversed(state["messages"]) if msg.type == "tool"]
+    # Solo los ToolMessages del turno actual (los anteriores pertenecen al historial de la sesión)
+    recent_tool_messages = []
+    for msg in reversed(state["messages"]):
+        if msg.type != "tool":
+            break
+        recent_tool_messages.append(msg)
     docs_content = "\n\n".join(doc.content for doc in recent_tool_messages[::-1])
 
     # Validar si los documentos contienen términos clave de la pregunta
-    user_question = state["messages"][0].content.lower()
+    human_messages = [msg for msg in state["messages"] if msg.type == "human"]
+    user_question = human_messages[-1].content.lower()
 
     terms = user_question.split()
 
     if not any(term in docs_content.lower() for term in terms):
-        return {"messages": [{"role": "assistant", "content": "Lo siento, no tengo información suficiente para responder esa pregunta."}]}
+        return {"messages": [{"role": "assistant", "content": "Lo siento, no tengo información suficiente para responder esa pregunta."}]}, None, 0
          
 
     
@@ -419,10 +492,9 @@ Estructura breve: Usa puntos clave, numeración o listas de una sola línea si e
     
     log_message(f"WEB-PROMPT  (RESU O NO) System_message_content ------>\n {system_message_content}--<")
     log_message(f"WEB-PROMPT PROMPT ------>\n {prompt}--<")
-    
-    # Realizamos la inferencia
-    response = llm.invoke(prompt)
-    
+    return None, prompt, tokens_entrada
+
+def registrar_generate(response, tokens_entrada):
     # Contamos tokens de la respuesta
     tokens_salida = contar_tokens(response.content, model_name)
     log_message(f"Tokens de entrada (respuesta) DE PREGUNTA:: {tokens_entrada}")
@@ -486,31 +558,94 @@ def log_token_summary(tokens_entrada, tokens_salida, modelo):
     log_message(separador)
 
 # Construcción del gráfico de conversación
-graph_builder.add_node(query_or_respond)
+# Cada nodo tiene su variante asíncrona: graph.stream usa la síncrona y graph.astream la asíncrona
+graph_builder.add_node("query_or_respond", RunnableLambda(query_or_respond, afunc=aquery_or_respond))
 graph_builder.add_node(tools)
-graph_builder.add_node(generate)
+graph_builder.add_node("generate", RunnableLambda(generate, afunc=agenerate))
 graph_builder.set_entry_point("query_or_respond")
 graph_builder.add_edge("query_or_respond", "tools")
 graph_builder.add_edge("tools", "generate")
-graph = graph_builder.compile()
+
+# Compilamos el grafo una sola vez por proceso; cada petición usa su propio thread_id
+from registro_grafos import obtener_grafo, nuevo_thread_id, liberar_thread
+from checkpoint_sesiones import crear_checkpointer, configuracion_sesiones, thread_id_de_sesion, recortar_historial
+max_mensajes_sesion = configuracion_sesiones(config)["max_mensajes"]
+contenedor.registrar(
+    "grafo_servicios",
+    lambda: obtener_grafo("servicios_simap", graph_builder, checkpointer=crear_checkpointer(config))
+)
+
+# Caché semántico de respuestas; se invalida solo cuando cambia el corpus
+from cache_respuestas import crear_cache_respuestas
+from langchain_core.messages import HumanMessage, AIMessage
+contenedor.registrar(
+    "cache_respuestas_servicios",
+    lambda: crear_cache_respuestas(config, contenedor.obtener("embeddings_servicios"), [fragment_store_directory], "servicios_simap")
+)
+
+def preparar_turno(question_input: str, session_id: str, config_thread: dict):
+    """
+    Recorta el historial de la sesión y busca la pregunta en el caché semántico.
+
+    Returns:
+        tuple: (mensajes a eliminar, si la pregunta abre conversación, respuesta cacheada o None)
+    """
+    graph = contenedor.obtener("grafo_servicios")
+    cache_respuestas = contenedor.obtener("cache_respuestas_servicios")
+    mensajes_a_eliminar = recortar_historial(graph, config_thread, max_mensajes_sesion) if session_id else []
+
+    # Caché semántico: solo para preguntas que abren conversación (sin historial previo)
+    sin_historial = not session_id or not graph.get_state(config_thread).values.get("messages")
+    respuesta_cacheada = None
+    if cache_respuestas is not None and sin_historial:
+        try:
+            respuesta_cacheada = cache_respuestas.buscar(question_input)
+        except Exception as e:
+            log_message(f"Caché semántico no disponible: {str(e)}", level="WARNING")
+        if respuesta_cacheada is not None:
+            log_message(f"Respuesta servida desde el caché semántico. {cache_respuestas.metricas()}")
+            if session_id:
+                # Se registra el turno en la sesión para que las repreguntas tengan contexto
+                graph.update_state(
+                    config_thread,
+                    {"messages": [HumanMessage(content=question_input), AIMessage(content=respuesta_cacheada)]},
+                    as_node="generate",
+                )
+    return mensajes_a_eliminar, sin_historial, respuesta_cacheada
+
+async def apreparar_turno(question_input: str, session_id: str, config_thread: dict):
+    """
+    Versión asíncrona de `preparar_turno`: la misma lógica en un hilo, porque el
+    checkpointer, el caché de embeddings y el caché semántico son síncronos.
+    """
+    return await asyncio.to_thread(preparar_turno, question_input, session_id, config_thread)
+
+def guardar_turno(question_input: str, response: str, sin_historial: bool):
+    """Guarda la respuesta en el caché semántico si la pregunta abrió la conversación."""
+    cache_respuestas = contenedor.obtener("cache_respuestas_servicios")
+    if cache_respuestas is not None and sin_historial:
+        try:
+            cache_respuestas.guardar(question_input, response)
+        except Exception as e:
+            log_message(f"No se pudo guardar en el caché semántico: {str(e)}", level="WARNING")
 
 # Función para procesar preguntas
-def process_question(question_input: str, fecha_desde: str, fecha_hasta: str, k: int):
+def process_question(question_input: str, fecha_desde: str, fecha_hasta: str, k: int, session_id: str = None):
     log_message(f"##############-------PROCESSS_QUESTION----------#####################")
     # Registramos tokens de la pregunta inicial
     tokens_pregunta = contar_tokens(question_input, model_name)
     log_message(f"Tokens de la pregunta inicial: {tokens_pregunta}")
     
-# 💾 Gestionar el Historial de Conversación (Memory)
-    from langgraph.checkpoint.memory import MemorySaver
-
-# Configuración del checkpointer de memoria
-    memory = MemorySaver()
-    graph = graph_builder.compile(checkpointer=memory)
-
-   
+    graph = contenedor.obtener("grafo_servicios")
+    # 💾 El grafo ya está compilado; aislamos la petición con un thread_id propio
+    # Con sesión se continúa la conversación del agente; sin sesión, thread efímero
+    thread_id = thread_id_de_sesion(session_id) if session_id else nuevo_thread_id()
+    config_thread = {"configurable": {"thread_id": thread_id}}
    
     try:
+        mensajes_a_eliminar, sin_historial, respuesta_cacheada = preparar_turno(question_input, session_id, config_thread)
+        if respuesta_cacheada is not None:
+            return respuesta_cacheada
         # Iniciamos contadores
         tokens_totales_entrada = tokens_pregunta
         tokens_totales_salida = 0
@@ -523,22 +658,24 @@ def process_question(question_input: str, fecha_desde: str, fecha_hasta: str, k:
         }
         
         for step in graph.stream(
-            {"messages": [{"role": "user", "content": question_input}]},
+            {"messages": mensajes_a_eliminar + [{"role": "user", "content": question_input}]},
             stream_mode="values",
-            config={"configurable": {"thread_id": "user_question"}},
+            config=config_thread,
         ):
             response = step["messages"][-1].content
+            # Se cuenta una sola vez por paso y se reutiliza el valor
+            tokens_paso = contar_tokens(response, model_name)
             
             # Este análisis es simplificado, pero podríamos mejorar la detección del nodo actual
             # basándonos en alguna característica específica de la respuesta
             if "query_or_respond" in step.get("logs", []):
-                tokens_por_nodo["query_or_respond"]["salida"] += contar_tokens(response, model_name)
+                tokens_por_nodo["query_or_respond"]["salida"] += tokens_paso
             elif "retrieve" in step.get("logs", []):
-                tokens_por_nodo["retrieve"]["salida"] += contar_tokens(response, model_name)
+                tokens_por_nodo["retrieve"]["salida"] += tokens_paso
             elif "generate" in step.get("logs", []):
-                tokens_por_nodo["generate"]["salida"] += contar_tokens(response, model_name)
+                tokens_por_nodo["generate"]["salida"] += tokens_paso
                 
-            tokens_totales_salida += contar_tokens(response, model_name)
+            tokens_totales_salida += tokens_paso
             
         # Al finalizar registramos el resumen de tokens
         log_message(f"Resumen de consumo de tokens - Inferencia completada:")
@@ -548,7 +685,108 @@ def process_question(question_input: str, fecha_desde: str, fecha_hasta: str, k:
         log_message(f"Total general de tokens: {tokens_totales_entrada + tokens_totales_salida}")
         
         log_message(f"##############-------FIN ROCESSS_QUESTION----------#####################")
+        guardar_turno(question_input, response, sin_historial)
         return response
     except Exception as e:
        
-        return f"Error: {str(e)}"
\ No newline at end of file
+        return f"Error: {str(e)}"
+    finally:
+        if not session_id:
+            liberar_thread(graph, thread_id)
+
+async def process_question_async(question_input: str, fecha_desde: str, fecha_hasta: str, k: int, session_id: str = None):
+    """
+    Versión asíncrona de process_question: graph.astream, ainvoke en el LLM y recuperación asíncrona.
+
+    Mientras una pregunta espera al LLM el event loop atiende otras, sin un hilo por petición.
+    """
+    log_message(f"##############-------PROCESSS_QUESTION_ASYNC----------#####################")
+    tokens_pregunta = contar_tokens(question_input, model_name)
+    log_message(f"Tokens de la pregunta inicial: {tokens_pregunta}")
+    graph = contenedor.obtener("grafo_servicios")
+
+    thread_id = thread_id_de_sesion(session_id) if session_id else nuevo_thread_id()
+    config_thread = {"configurable": {"thread_id": thread_id}}
+
+    try:
+        mensajes_a_eliminar, sin_historial, respuesta_cacheada = await apreparar_turno(
+            question_input, session_id, config_thread
+        )
+        if respuesta_cacheada is not None:
+            return respuesta_cacheada
+
+        response = ""
+        tokens_totales_salida = 0
+        async for step in graph.astream(
+            {"messages": mensajes_a_eliminar + [{"role": "user", "content": question_input}]},
+            stream_mode="values",
+            config=config_thread,
+        ):
+            response = step["messages"][-1].content
+            tokens_totales_salida += contar_tokens(response, model_name)
+
+        log_message(f"Fragmentos recuperados de la BD vectorial: {retrieve.last_fragments_count}")
+        log_message(f"Tokens totales de entrada: {tokens_pregunta}")
+        log_message(f"Tokens totales de salida: {tokens_totales_salida}")
+        log_message(f"##############-------FIN ROCESSS_QUESTION_ASYNC----------#####################")
+        await asyncio.to_thread(guardar_turno, question_input, response, sin_historial)
+        return response
+    except Exception as e:
+        return f"Error: {str(e)}"
+    finally:
+        if not session_id:
+            # Con el backend SQLite el borrado es I/O síncrona
+            await asyncio.to_thread(liberar_thread, graph, thread_id)
+
+def stream_question(question_input: str, fecha_desde: str, fecha_hasta: str, k: int, session_id: str = None):
+    """
+    Como process_question, pero entrega la respuesta de a fragmentos a medida que el LLM
+    genera los tokens del nodo generate (stream_mode="messages").
+
+    Yields:
+        str: Fragmentos de la respuesta, en orden
+    """
+    log_message(f"##############-------STREAM_QUESTION----------#####################")
+    tokens_pregunta = contar_tokens(question_input, model_name)
+    log_message(f"Tokens de la pregunta inicial: {tokens_pregunta}")
+    graph = contenedor.obtener("grafo_servicios")
+
+    thread_id = thread_id_de_sesion(session_id) if session_id else nuevo_thread_id()
+    config_thread = {"configurable": {"thread_id": thread_id}}
+    try:
+        mensajes_a_eliminar, sin_historial, respuesta_cacheada = preparar_turno(question_input, session_id, config_thread)
+        if respuesta_cacheada is not None:
+            yield respuesta_cacheada
+            return
+
+        partes = []
+        inicio = time.perf_counter()
+        for mensaje, metadata in graph.stream(
+            {"messages": mensajes_a_eliminar + [{"role": "user", "content": question_input}]},
+            stream_mode="messages",
+            config=config_thread,
+        ):
+            # Solo la respuesta final; los tokens de query_or_respond son la llamada a la herramienta
+            if metadata.get("langgraph_node") != "generate" or not isinstance(mensaje.content, str) or not mensaje.content:
+                continue
+            if not partes:
+                log_message(f"Tiempo hasta el primer token: {time.perf_counter() - inicio:.2f} s")
+            partes.append(mensaje.content)
+            yield mensaje.content
+
+        response = "".join(partes)
+        if not partes:
+            # Respuestas que no pasan por el LLM (por ejemplo, sin documentos relevantes)
+            mensajes = graph.get_state(config_thread).values.get("messages", [])
+            response = mensajes[-1].content if mensajes else ""
+            if response:
+                yield response
+
+        log_message(f"Fragmentos recuperados de la BD vectorial: {retrieve.last_fragments_count}")
+        log_message(f"Tokens totales de salida: {contar_tokens(response, model_name)}")
+        log_message(f"Respuesta completa en {time.perf_counter() - inicio:.2f} s")
+        log_message(f"##############-------FIN STREAM_QUESTION----------#####################")
+        guardar_turno(question_input, response, sin_historial)
+    finally:
+        if not session_id:
+            liberar_thread(graph, thread_id)
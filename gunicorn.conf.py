@@ -0,0 +1,107 @@
+"""
+Configuración de gunicorn para servir app.py en producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+- Workers `gthread`: cada pregunta espera dos llamadas al LLM (IO), así que
+  cada worker atiende `threads` preguntas a la vez en lugar de una.
+- `preload_app`: el grafo compilado, los embeddings y el vector store se
+  crean una vez en el proceso maestro y los workers los heredan por fork
+  (copy-on-write). Después del fork cada worker descarta los recursos que no
+  pueden cruzar procesos (pool de hilos de la recuperación, conexiones SQLite
+  del checkpointer; el pool BM25 y el caché de embeddings ya reabren las
+  suyas al detectar el cambio de pid).
+- El calentamiento de componentes (componentes.py) corre en un hilo del
+  maestro; `pre_fork` espera a que termine para que ningún worker nazca con
+  un componente a medio construir ni con locks tomados por ese hilo. Las
+  consultas sintéticas del calentamiento abren conexiones (OpenAI, SQLite),
+  así que con preload no corren en el maestro sino en cada worker, desde
+  `post_fork`; mientras tanto /readyz responde 503.
+- Apagado ordenado: con SIGTERM los workers terminan las preguntas en curso
+  durante `graceful_timeout` segundos antes de salir.
+
+Configuración en config.ini, sección [SERVIDOR] (GUNICORN_CMD_ARGS tiene prioridad):
+    bind = 0.0.0.0:5000
+    workers = 2
+    threads = 16
+    timeout = 180
+    graceful_timeout = 60
+    keepalive = 5
+    max_requests = 1000
+    max_requests_jitter = 100
+    preload = true
+    calentar_al_inicio = true   (app.py construye los componentes en segundo plano)
+"""
+
+import configparser
+import logging
+import os
+
+_config = configparser.ConfigParser()
+_config.read('config.ini')
+_servidor = _config['SERVIDOR'] if _config.has_section('SERVIDOR') else _config['DEFAULT']
+
+bind = _servidor.get('bind', fallback='0.0.0.0:5000')
+worker_class = 'gthread'
+workers = _servidor.getint('workers', fallback=2)
+threads = _servidor.getint('threads', fallback=16)
+# Una pregunta puede encadenar dos llamadas al LLM más la recuperación
+timeout = _servidor.getint('timeout', fallback=180)
+graceful_timeout = _servidor.getint('graceful_timeout', fallback=60)
+keepalive = _servidor.getint('keepalive', fallback=5)
+# Reciclar workers de a poco acota el crecimiento de memoria sin cortar el servicio
+max_requests = _servidor.getint('max_requests', fallback=1000)
+max_requests_jitter = _servidor.getint('max_requests_jitter', fallback=100)
+preload_app = _servidor.getboolean('preload', fallback=True)
+if preload_app:
+    # Leído por componentes.py al importar la app en el maestro
+    os.environ['CALENTAMIENTO_EN_WORKERS'] = '1'
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    # Con el checkpointer en memoria cada worker tiene sus propias sesiones
+    backend = (_config['SESIONES'] if _config.has_section('SESIONES') else _config['DEFAULT']).get(
+        'backend', fallback='memoria').strip().lower()
+    if workers > 1 and backend != 'sqlite':
+        server.log.warning(
+            "Sesiones en memoria con varios workers: una conversación puede caer en otro worker. "
+            "Usar backend = sqlite en [SESIONES]."
+        )
+    server.log.info(f"Servidor listo: {workers} workers x {threads} hilos")
+
+
+def pre_fork(server, worker):
+    # Un hilo no sobrevive al fork: se espera el calentamiento iniciado por app.py
+    from componentes import contenedor
+
+    contenedor.esperar_calentamiento()
+
+
+def post_fork(server, worker):
+    # Los hilos y las conexiones SQLite del maestro no sirven en el worker
+    from componentes import contenedor
+    from recuperacion_concurrente import reiniciar_pool
+    from registro_grafos import reabrir_checkpointers
+
+    reiniciar_pool()
+    reabrir_checkpointers()
+    if preload_app:
+        # Consultas sintéticas del calentamiento, ya con las conexiones propias del worker
+        contenedor.rutinas_habilitadas = True
+        if _servidor.getboolean('calentar_al_inicio', fallback=True):
+            contenedor.calentar(en_segundo_plano=True)
+    server.log.info(f"Worker {worker.pid} inicializado")
+
+
+def worker_exit(server, worker):
+    from recuperacion_concurrente import cerrar_pool
+    from registro_grafos import cerrar_checkpointers
+
+    try:
+        cerrar_pool()
+        cerrar_checkpointers()
+    except Exception as e:
+        logging.error(f"Error al cerrar el worker {worker.pid}: {str(e)}")
@@ -0,0 +1,440 @@
+"""
+Indexación incremental del catálogo de servicios SIMAP.
+
+Los loaders reconstruían todo con `Chroma.from_documents`/`from_texts` y nunca
+borraban vectores viejos: cada recarga duplicaba filas en Chroma y en el índice
+BM25. Este módulo:
+
+- Calcula una huella por ID_SUB a partir del hash de cada campo de sus
+  registros (más una versión del loader: tamaño de chunk, prompt, etc.).
+- Compara contra un manifiesto en SQLite y obtiene altas, modificaciones y bajas.
+- Aplica solo esos cambios: en Chroma con ids estables (`<id_sub>:<n>`) y en
+  BM25 borrando y reinsertando los fragmentos del ID_SUB.
+- Los embeddings de los fragmentos nuevos se generan con `CargadorEmbeddings`
+  (lotes por tokens, solicitudes en paralelo y upserts masivos).
+
+Los cambios se aplican en lotes de ID_SUB: cada lote se confirma en Chroma, en
+BM25 y en el manifiesto antes de pasar al siguiente, y cada corrida queda
+registrada en la tabla `trabajos`. Si la carga se corta, la próxima corrida
+retoma desde el último lote confirmado.
+
+Con `indexar_en_flujo` el export se lee en flujo (lector_json) y la lectura y el
+chunking de un lote se superponen con los embeddings del anterior.
+
+El tiempo de actualización es proporcional a lo que cambió. Si el manifiesto
+está vacío y la colección tiene filas cargadas antes del indexador (ids que no
+son `<id_sub>:<n>`), se borran esas filas de Chroma y se vacía BM25, porque no
+hay forma de saber a qué ID_SUB pertenecen. Si todas las filas tienen ids
+estables (por ejemplo, se perdió el manifiesto) no se borra nada: los upserts
+las reemplazan.
+
+Configuración en config.ini, sección [INDEXACION]:
+    manifiesto_path = manifiesto_indice.db   (relativo al directorio que contiene la base vectorial)
+    tamano_lote_indexacion = 50
+    lectura_streaming = true
+    max_lotes_pendientes = 4
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict, namedtuple
+
+from bm25_sqlite import eliminar_fragmentos, insertar_fragmento, optimizar_indice
+from embeddings_lote import crear_cargador_embeddings
+from lector_json import (
+    MAX_PENDIENTES_POR_DEFECTO, agrupar_consecutivos, en_lotes, en_segundo_plano, id_sub_de_registro
+)
+
+LOTE_BORRADO_CHROMA = 5000
+
+# Ids que asigna el indexador en Chroma
+_RE_ID_ESTABLE = re.compile(r'.+:\d+')
+
+PlanIndexacion = namedtuple("PlanIndexacion", ["altas", "modificaciones", "bajas", "sin_cambios", "huellas"])
+
+
+def agrupar_por_id_sub(registros, clave=id_sub_de_registro):
+    """Agrupa los RECORDS por ID_SUB (o por `clave(item)`) conservando el orden de aparición."""
+    grupos = OrderedDict()
+    for item in registros:
+        grupos.setdefault(clave(item), []).append(item)
+    return grupos
+
+
+def huella_registros(items, version=""):
+    """Huella de los registros de un ID_SUB: hash de los hashes de cada campo."""
+    partes = [version]
+    for item in items:
+        for campo in sorted(item):
+            valor = item[campo]
+            valor = valor if isinstance(valor, str) else json.dumps(valor, ensure_ascii=False, sort_keys=True)
+            partes.append(f"{campo}={hashlib.sha256(valor.encode('utf-8')).hexdigest()}")
+    return hashlib.sha256("\n".join(partes).encode("utf-8")).hexdigest()
+
+
+class IndexadorIncremental:
+    """Aplica a Chroma y a BM25 solo las altas, modificaciones y bajas de cada ID_SUB."""
+
+    def __init__(self, vector_store, espacio, ruta_manifiesto="manifiesto_indice.db", conn_bm25=None,
+                 cargador_embeddings=None, tamano_lote=50, lectura_streaming=True,
+                 max_lotes_pendientes=MAX_PENDIENTES_POR_DEFECTO):
+        self.vector_store = vector_store
+        self.espacio = espacio
+        self.conn_bm25 = conn_bm25
+        self.cargador_embeddings = cargador_embeddings
+        self.tamano_lote = tamano_lote
+        self.lectura_streaming = lectura_streaming
+        self.max_lotes_pendientes = max_lotes_pendientes
+        self.conn = sqlite3.connect(ruta_manifiesto)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifiesto ("
+            "espacio TEXT NOT NULL, id_sub TEXT NOT NULL, huella TEXT NOT NULL, "
+            "ids_chroma TEXT NOT NULL, actualizado REAL NOT NULL, PRIMARY KEY (espacio, id_sub))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS trabajos ("
+            "id INTEGER PRIMARY KEY, espacio TEXT NOT NULL, inicio REAL NOT NULL, fin REAL, "
+            "estado TEXT NOT NULL, id_subs_total INTEGER NOT NULL, id_subs_hechos INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+
+    def _manifiesto(self):
+        filas = self.conn.execute(
+            "SELECT id_sub, huella, ids_chroma FROM manifiesto WHERE espacio = ?", (self.espacio,)
+        ).fetchall()
+        return {id_sub: (huella, json.loads(ids)) for id_sub, huella, ids in filas}
+
+    def planificar(self, registros_por_id, version=""):
+        """
+        Compara los registros con el manifiesto.
+
+        Args:
+            registros_por_id (dict): ID_SUB -> lista de registros (ver `agrupar_por_id_sub`)
+            version (str): Versión del loader; si cambia, todo se reindexa
+
+        Returns:
+            PlanIndexacion: listas de ID_SUB para altas, modificaciones, bajas y sin cambios
+        """
+        manifiesto = self._manifiesto()
+        huellas = {id_sub: huella_registros(items, version) for id_sub, items in registros_por_id.items()}
+        altas = [id_sub for id_sub in huellas if id_sub not in manifiesto]
+        modificaciones = [id_sub for id_sub in huellas if id_sub in manifiesto and manifiesto[id_sub][0] != huellas[id_sub]]
+        sin_cambios = [id_sub for id_sub in huellas if id_sub in manifiesto and manifiesto[id_sub][0] == huellas[id_sub]]
+        bajas = [id_sub for id_sub in manifiesto if id_sub not in huellas]
+        return PlanIndexacion(altas, modificaciones, bajas, sin_cambios, huellas)
+
+    @staticmethod
+    def a_indexar(plan):
+        """ID_SUB que hay que (re)generar: altas y modificaciones, en el orden del JSON."""
+        return plan.altas + plan.modificaciones
+
+    def _ids_heredados(self):
+        """Ids de Chroma que no asignó el indexador (cargas anteriores al manifiesto)."""
+        coleccion = self.vector_store._collection
+        heredados, desde = [], 0
+        while True:
+            ids = coleccion.get(limit=LOTE_BORRADO_CHROMA, offset=desde, include=[])["ids"]
+            if not ids:
+                return heredados
+            heredados.extend(id_chroma for id_chroma in ids if not _RE_ID_ESTABLE.fullmatch(id_chroma))
+            desde += len(ids)
+
+    def _limpiar_carga_heredada(self):
+        """Con el manifiesto vacío, borra solo las filas de cargas anteriores al indexador."""
+        heredados = self._ids_heredados()
+        if not heredados:
+            logging.warning(
+                f"Manifiesto vacío para '{self.espacio}' pero la colección no tiene filas heredadas: "
+                "no se borra nada y los ID_SUB se reindexan con sus ids estables."
+            )
+            return
+        filas_bm25 = 0
+        if self.conn_bm25 is not None:
+            filas_bm25 = self.conn_bm25.execute("SELECT COUNT(*) FROM fragmentos").fetchone()[0]
+        logging.warning(
+            f"Primera indexación incremental de '{self.espacio}': se borran {len(heredados)} filas heredadas "
+            f"de Chroma y {filas_bm25} fragmentos de BM25."
+        )
+        coleccion = self.vector_store._collection
+        for desde in range(0, len(heredados), LOTE_BORRADO_CHROMA):
+            coleccion.delete(ids=heredados[desde:desde + LOTE_BORRADO_CHROMA])
+        if self.conn_bm25 is not None:
+            self.conn_bm25.execute("DELETE FROM fragmentos")
+
+    def _iniciar_trabajo(self, total):
+        """Registra la corrida; si la anterior quedó a medias, informa desde dónde se reanuda."""
+        previo = self.conn.execute(
+            "SELECT id, id_subs_hechos, id_subs_total FROM trabajos "
+            "WHERE espacio = ? AND estado IN ('en_curso', 'fallido') ORDER BY id DESC LIMIT 1", (self.espacio,)
+        ).fetchone()
+        if previo:
+            logging.info(
+                f"Reanudando la indexación de '{self.espacio}': el trabajo {previo[0]} quedó en "
+                f"{previo[1]}/{previo[2]} ID_SUB; los lotes confirmados no se repiten."
+            )
+            self.conn.execute("UPDATE trabajos SET estado = 'reanudado' WHERE id = ?", (previo[0],))
+        cursor = self.conn.execute(
+            "INSERT INTO trabajos (espacio, inicio, estado, id_subs_total, id_subs_hechos) VALUES (?, ?, 'en_curso', ?, 0)",
+            (self.espacio, time.time(), total)
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def _finalizar_trabajo(self, id_trabajo, estado):
+        self.conn.execute("UPDATE trabajos SET estado = ?, fin = ? WHERE id = ?", (estado, time.time(), id_trabajo))
+        self.conn.commit()
+
+    def _aplicar_lote(self, huellas, manifiesto, id_subs, bajas, fragmentos_por_id):
+        """Aplica un lote y lo confirma: primero Chroma y BM25, al final el manifiesto."""
+        cursor = self.conn_bm25.cursor() if self.conn_bm25 is not None else None
+
+        # Bajas: se borran todos sus fragmentos
+        ids_a_borrar = []
+        for id_sub in bajas:
+            ids_a_borrar.extend(manifiesto[id_sub][1])
+            if cursor is not None:
+                eliminar_fragmentos(cursor, id_sub)
+
+        # Altas y modificaciones: upsert con ids estables y borrado de los sobrantes
+        textos, metadatas, ids = [], [], []
+        filas_manifiesto = []
+        ahora = time.time()
+        for id_sub in id_subs:
+            fragmentos = fragmentos_por_id.get(id_sub, [])
+            ids_nuevos = [f"{id_sub}:{indice}" for indice in range(len(fragmentos))]
+            ids_viejos = manifiesto.get(id_sub, (None, []))[1]
+            ids_a_borrar.extend(set(ids_viejos) - set(ids_nuevos))
+            textos.extend(fragmento["texto"] for fragmento in fragmentos)
+            metadatas.extend(fragmento["metadata"] for fragmento in fragmentos)
+            ids.extend(ids_nuevos)
+            if cursor is not None:
+                eliminar_fragmentos(cursor, id_sub)
+                for fragmento in fragmentos:
+                    if fragmento.get("bm25"):
+                        insertar_fragmento(cursor, **fragmento["bm25"])
+            filas_manifiesto.append((self.espacio, id_sub, huellas[id_sub], json.dumps(ids_nuevos), ahora))
+
+        if ids_a_borrar:
+            self.vector_store.delete(ids=ids_a_borrar)
+        carga = {}
+        if textos and self.cargador_embeddings is not None:
+            carga = self.cargador_embeddings.cargar(self.vector_store, textos, metadatas, ids)
+        elif textos:
+            self.vector_store.add_texts(texts=textos, metadatas=metadatas, ids=ids)
+        if self.conn_bm25 is not None:
+            self.conn_bm25.commit()
+
+        # El manifiesto se confirma al final del lote: si algo falla, la próxima corrida retoma desde acá
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO manifiesto (espacio, id_sub, huella, ids_chroma, actualizado) VALUES (?, ?, ?, ?, ?)",
+            filas_manifiesto
+        )
+        self.conn.executemany(
+            "DELETE FROM manifiesto WHERE espacio = ? AND id_sub = ?", [(self.espacio, id_sub) for id_sub in bajas]
+        )
+        self.conn.commit()
+        return len(textos), len(ids_a_borrar), carga.get("segundos_embeddings", 0.0)
+
+    def aplicar_por_lotes(self, plan, generar_fragmentos, tamano_lote=None):
+        """
+        Aplica el plan en lotes de ID_SUB, confirmando cada lote.
+
+        Si la carga se corta, los lotes confirmados ya figuran en el manifiesto y
+        la próxima corrida los ve sin cambios: se reanuda desde el último lote.
+
+        Args:
+            plan (PlanIndexacion): Resultado de `planificar`
+            generar_fragmentos (callable): Recibe la lista de ID_SUB del lote y devuelve
+                ID_SUB -> lista de fragmentos. Cada fragmento es un dict con "texto" y
+                "metadata" para Chroma y, si se indexa en BM25, "bm25" con los
+                argumentos de `insertar_fragmento`.
+            tamano_lote (int): ID_SUB por lote (por defecto, el del indexador)
+
+        Returns:
+            dict: Cantidad de ID_SUB y de fragmentos por tipo de cambio
+        """
+        inicio = time.perf_counter()
+        tamano_lote = max(1, tamano_lote or self.tamano_lote)
+        manifiesto = self._manifiesto()
+        if not manifiesto:
+            self._limpiar_carga_heredada()
+        a_indexar = self.a_indexar(plan)
+        id_trabajo = self._iniciar_trabajo(len(a_indexar))
+        insertados, borrados, segundos_embeddings = 0, 0, 0.0
+        try:
+            # Las bajas van con el primer lote (aunque no haya altas ni modificaciones)
+            bajas = list(plan.bajas)
+            for desde in range(0, max(len(a_indexar), 1 if bajas else 0), tamano_lote):
+                id_subs = a_indexar[desde:desde + tamano_lote]
+                fragmentos_por_id = generar_fragmentos(id_subs) if id_subs else {}
+                lote = self._aplicar_lote(plan.huellas, manifiesto, id_subs, bajas, fragmentos_por_id)
+                insertados, borrados, segundos_embeddings = (
+                    insertados + lote[0], borrados + lote[1], segundos_embeddings + lote[2]
+                )
+                bajas = []
+                hechos = min(desde + tamano_lote, len(a_indexar))
+                self.conn.execute("UPDATE trabajos SET id_subs_hechos = ? WHERE id = ?", (hechos, id_trabajo))
+                self.conn.commit()
+                logging.info(f"Indexación de '{self.espacio}': {hechos}/{len(a_indexar)} ID_SUB confirmados")
+            if self.conn_bm25 is not None and (plan.bajas or insertados):
+                optimizar_indice(self.conn_bm25)
+                self.conn_bm25.commit()
+        except BaseException:
+            # Lo no confirmado del lote en curso se descarta; se rehace al reanudar
+            if self.conn_bm25 is not None:
+                self.conn_bm25.rollback()
+            self._finalizar_trabajo(id_trabajo, "fallido")
+            raise
+        self._finalizar_trabajo(id_trabajo, "completo")
+
+        segundos = time.perf_counter() - inicio
+        resumen = {
+            "altas": len(plan.altas),
+            "modificaciones": len(plan.modificaciones),
+            "bajas": len(plan.bajas),
+            "sin_cambios": len(plan.sin_cambios),
+            "fragmentos_insertados": insertados,
+            "fragmentos_borrados": borrados,
+            "segundos": round(segundos, 2),
+            "docs_por_segundo": round(insertados / segundos_embeddings, 1) if segundos_embeddings else 0.0,
+        }
+        logging.info(f"Indexación incremental de '{self.espacio}': {resumen}")
+        return resumen
+
+    def aplicar(self, plan, fragmentos_por_id, tamano_lote=None):
+        """Igual que `aplicar_por_lotes`, con los fragmentos ya generados (ID_SUB -> fragmentos)."""
+        return self.aplicar_por_lotes(
+            plan, lambda id_subs: {id_sub: fragmentos_por_id.get(id_sub, []) for id_sub in id_subs}, tamano_lote
+        )
+
+    def _lotes_en_flujo(self, grupos, manifiesto, generar_fragmentos, version, tamano_lote, vistos, contadores):
+        """Etapa productora: huella de cada grupo y fragmentos de los lotes con cambios."""
+        for lote in en_lotes(grupos, tamano_lote):
+            huellas, cambiados = {}, {}
+            for id_sub, items in lote:
+                vistos.add(id_sub)
+                huella = huella_registros(items, version)
+                if id_sub not in manifiesto:
+                    contadores["altas"] += 1
+                elif manifiesto[id_sub][0] != huella:
+                    contadores["modificaciones"] += 1
+                else:
+                    contadores["sin_cambios"] += 1
+                    continue
+                huellas[id_sub] = huella
+                cambiados[id_sub] = items
+            if cambiados:
+                yield huellas, list(cambiados), generar_fragmentos(cambiados)
+
+    def indexar_en_flujo(self, registros, generar_fragmentos, version="", clave=None, tamano_lote=None):
+        """
+        Indexa leyendo los registros en flujo: huella, chunking y escritura por lotes.
+
+        La lectura, la huella y `generar_fragmentos` corren en un hilo productor con
+        cola acotada; el hilo principal embebe y confirma cada lote. Los primeros
+        vectores se escriben antes de terminar de leer el export. Las bajas se
+        calculan al final, con los ID_SUB vistos.
+
+        Args:
+            registros (iterable): RECORDS del export (ver `lector_json.leer_registros`)
+            generar_fragmentos (callable): Recibe ID_SUB -> lista de registros de un lote
+                con cambios y devuelve ID_SUB -> lista de fragmentos (ver `aplicar_por_lotes`)
+            version (str): Versión del loader; si cambia, todo se reindexa
+            clave (callable): Clave de agrupación de cada registro (por defecto, su ID_SUB)
+            tamano_lote (int): ID_SUB por lote (por defecto, el del indexador)
+
+        Returns:
+            dict: Cantidad de ID_SUB y de fragmentos por tipo de cambio
+        """
+        inicio = time.perf_counter()
+        tamano_lote = max(1, tamano_lote or self.tamano_lote)
+        clave = clave or id_sub_de_registro
+        manifiesto = self._manifiesto()
+        if not manifiesto:
+            self._limpiar_carga_heredada()
+        if self.lectura_streaming:
+            grupos = agrupar_consecutivos(registros, clave)
+        else:
+            grupos = agrupar_por_id_sub(registros, clave).items()
+
+        id_trabajo = self._iniciar_trabajo(0)
+        contadores = {"altas": 0, "modificaciones": 0, "sin_cambios": 0}
+        vistos = set()
+        insertados, borrados, segundos_embeddings, hechos = 0, 0, 0.0, 0
+        try:
+            lotes = en_segundo_plano(
+                self._lotes_en_flujo(grupos, manifiesto, generar_fragmentos, version, tamano_lote, vistos, contadores),
+                max_pendientes=self.max_lotes_pendientes,
+            )
+            for huellas, id_subs, fragmentos_por_id in lotes:
+                lote = self._aplicar_lote(huellas, manifiesto, id_subs, [], fragmentos_por_id)
+                insertados, borrados, segundos_embeddings = (
+                    insertados + lote[0], borrados + lote[1], segundos_embeddings + lote[2]
+                )
+                hechos += len(id_subs)
+                self.conn.execute(
+                    "UPDATE trabajos SET id_subs_hechos = ?, id_subs_total = ? WHERE id = ?",
+                    (hechos, contadores["altas"] + contadores["modificaciones"], id_trabajo)
+                )
+                self.conn.commit()
+                logging.info(f"Indexación de '{self.espacio}': {hechos} ID_SUB confirmados")
+
+            # Bajas: solo con el export leído completo
+            bajas = [id_sub for id_sub in manifiesto if id_sub not in vistos]
+            if bajas:
+                borrados += self._aplicar_lote({}, manifiesto, [], bajas, {})[1]
+            if self.conn_bm25 is not None and (bajas or insertados):
+                optimizar_indice(self.conn_bm25)
+                self.conn_bm25.commit()
+        except BaseException:
+            if self.conn_bm25 is not None:
+                self.conn_bm25.rollback()
+            self._finalizar_trabajo(id_trabajo, "fallido")
+            raise
+        self._finalizar_trabajo(id_trabajo, "completo")
+
+        segundos = time.perf_counter() - inicio
+        resumen = {
+            **contadores,
+            "bajas": len(bajas),
+            "fragmentos_insertados": insertados,
+            "fragmentos_borrados": borrados,
+            "segundos": round(segundos, 2),
+            "docs_por_segundo": round(insertados / segundos_embeddings, 1) if segundos_embeddings else 0.0,
+        }
+        logging.info(f"Indexación incremental de '{self.espacio}': {resumen}")
+        return resumen
+
+    def cerrar(self):
+        self.conn.close()
+
+
+def crear_indexador(config, vector_store, directorio, coleccion, conn_bm25=None):
+    """
+    Crea el indexador según la sección [INDEXACION] de config.ini.
+
+    Un `manifiesto_path` relativo se resuelve junto a la base vectorial y no
+    contra el directorio actual: correr un loader desde otro lado no debe
+    encontrar un manifiesto vacío.
+    """
+    seccion = config['INDEXACION'] if config.has_section('INDEXACION') else config['DEFAULT']
+    directorio = os.path.abspath(directorio)
+    ruta_manifiesto = os.path.join(
+        os.path.dirname(directorio), seccion.get('manifiesto_path', fallback='manifiesto_indice.db')
+    )
+    return IndexadorIncremental(
+        vector_store,
+        espacio=f"{directorio}|{coleccion}",
+        ruta_manifiesto=ruta_manifiesto,
+        conn_bm25=conn_bm25,
+        cargador_embeddings=crear_cargador_embeddings(config, vector_store.embeddings),
+        tamano_lote=seccion.getint('tamano_lote_indexacion', fallback=50),
+        lectura_streaming=seccion.getboolean('lectura_streaming', fallback=True),
+        max_lotes_pendientes=seccion.getint('max_lotes_pendientes', fallback=MAX_PENDIENTES_POR_DEFECTO),
+    )
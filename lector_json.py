@@ -0,0 +1,133 @@
+"""
+Lectura en flujo de los exports JSON del SIMAP.
+
+`json.load` materializaba todo el export (y los loaders, además, la lista
+completa de documentos) antes de embeber. Acá los RECORDS se leen de a uno con
+un parser iterativo (ijson, dependencia opcional) y se encadenan generadores:
+
+    leer_registros -> agrupar_consecutivos -> (normalizar, chunkear) -> embeber/escribir
+
+`en_segundo_plano` corre una etapa en otro hilo con una cola acotada, así la
+lectura y el chunking del lote siguiente se superponen con los embeddings del
+actual y la memoria queda acotada a unos pocos lotes, sin importar el tamaño
+del export.
+
+Si ijson no está instalado se usa `json.load` (mismo resultado, sin el ahorro
+de memoria).
+"""
+
+import json
+import logging
+import queue
+import threading
+
+try:
+    import ijson
+except ImportError:  # Dependencia opcional
+    ijson = None
+
+MAX_PENDIENTES_POR_DEFECTO = 4
+
+
+def leer_registros(ruta_archivo_json, prefijo="RECORDS.item"):
+    """Genera los RECORDS del export uno por uno."""
+    with open(ruta_archivo_json, 'rb') as archivo:
+        if ijson is None:
+            logging.warning("ijson no está instalado: el JSON se lee completo en memoria.")
+            data = json.load(archivo)
+            for clave in prefijo.split(".")[:-1]:
+                data = data.get(clave, [])
+            yield from data
+            return
+        yield from ijson.items(archivo, prefijo, use_float=True)
+
+
+def id_sub_de_registro(item):
+    """ID_SUB del registro como texto (clave de agrupación por defecto)."""
+    return str(item.get("ID_SUB", "")).strip()
+
+
+def agrupar_consecutivos(registros, clave=id_sub_de_registro):
+    """
+    Agrupa registros consecutivos con la misma clave (el export viene ordenado por ID_SUB).
+
+    Yields:
+        tuple: (clave, lista de registros)
+
+    Raises:
+        ValueError: si una clave reaparece después de otra (export no ordenado)
+    """
+    vistas = set()
+    actual, items = None, []
+    for item in registros:
+        clave_item = clave(item)
+        if items and clave_item != actual:
+            yield actual, items
+            items = []
+        if not items:
+            if clave_item in vistas:
+                raise ValueError(
+                    f"El ID_SUB {clave_item} aparece en registros no consecutivos: "
+                    "ordenar el export o desactivar lectura_streaming en [INDEXACION]."
+                )
+            vistas.add(clave_item)
+            actual = clave_item
+        items.append(item)
+    if items:
+        yield actual, items
+
+
+def en_lotes(iterable, tamano):
+    """Agrupa los elementos del iterable en listas de hasta `tamano`."""
+    lote = []
+    for elemento in iterable:
+        lote.append(elemento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+_FIN = object()
+
+
+def en_segundo_plano(iterable, max_pendientes=MAX_PENDIENTES_POR_DEFECTO):
+    """
+    Consume el iterable en un hilo productor y entrega sus elementos por una cola acotada.
+
+    Los errores del productor se relanzan en el consumidor. Si el consumidor deja
+    de iterar, el productor se detiene en el siguiente elemento.
+    """
+    cola = queue.Queue(maxsize=max_pendientes)
+    detener = threading.Event()
+
+    def producir():
+        try:
+            for elemento in iterable:
+                if detener.is_set():
+                    return
+                cola.put((elemento, None))
+        except BaseException as e:
+            cola.put((_FIN, e))
+            return
+        cola.put((_FIN, None))
+
+    productor = threading.Thread(target=producir, name="ingesta-productor", daemon=True)
+    productor.start()
+    try:
+        while True:
+            elemento, error = cola.get()
+            if elemento is _FIN:
+                if error is not None:
+                    raise error
+                return
+            yield elemento
+    finally:
+        detener.set()
+        # Libera un lugar por si el productor quedó bloqueado en put()
+        while productor.is_alive():
+            try:
+                cola.get_nowait()
+            except queue.Empty:
+                productor.join(timeout=0.1)
@@ -0,0 +1,165 @@
+"""
+Preprocesamiento de la ingesta (normalización y chunking) en varios procesos.
+
+`normalizar_texto` (html.unescape + regex) y el chunking corrían en un solo
+hilo sobre cada campo de cada RECORD. Acá:
+
+- Las expresiones regulares se compilan una sola vez a nivel de módulo.
+- `preprocesar_registro` normaliza los campos de un registro y, si se le pasa
+  una plantilla, arma el texto de cada campo y lo divide en chunks.
+- `PreprocesadorParalelo` reparte los registros en un pool de procesos. Por
+  defecto cada lote se parte en una unidad por proceso, así la serialización
+  entre procesos se paga una vez por proceso y no por cada pocos registros.
+  El orden de salida es el mismo que el de entrada, así el índice queda igual
+  que con la carga en serie.
+
+Por defecto corre en serie: el trabajo por registro es corto (html.unescape,
+una regex y el split) y en máquinas con pocos núcleos el pool es más lento
+que el bucle simple (ver bench_preprocesamiento.py). El pool conviene solo si
+el benchmark muestra ganancia en la máquina de la ingesta.
+
+Las funciones de trabajo viven en este módulo (importable sin efectos
+secundarios) para que los procesos hijos puedan deserializarlas con cualquier
+método de arranque.
+
+Configuración en config.ini, sección [INDEXACION]:
+    procesos_preprocesamiento = 1      (1 = en serie, 0 = un proceso por núcleo)
+    tamano_unidad_preprocesamiento = 0 (0 = una unidad por proceso en cada lote)
+"""
+
+import html
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from contador_tokens import dividir_en_chunks_por_tokens, dividir_en_chunks_por_tokens_referencia
+
+CAMPOS_TEXTO = ("COPETE", "CONSISTE", "REQUISITOS", "PAUTAS", "QUIEN_PUEDE", "QUIENES_PUEDEN", "COMO_LO_HACEN")
+
+# Precompiladas una vez por proceso
+_RE_ESPACIOS = re.compile(r'\s+')
+
+
+def normalizar_texto(texto):
+    """Decodifica entidades HTML, reemplaza saltos de línea y espacios redundantes y recorta."""
+    if not texto:
+        return ""
+    return _RE_ESPACIOS.sub(' ', html.unescape(texto)).strip()
+
+
+def dividir_en_chunks_por_palabras(texto, tamano_chunk, solapamiento):
+    """Chunks de `tamano_chunk` palabras que avanzan de a `tamano_chunk - solapamiento`."""
+    if tamano_chunk <= solapamiento:
+        raise ValueError("El tamaño del chunk debe ser mayor que el solapamiento.")
+    palabras = texto.split()
+    return [' '.join(palabras[i:i + tamano_chunk]) for i in range(0, len(palabras), tamano_chunk - solapamiento)]
+
+
+def dividir(texto, tamano_chunk, solapamiento, modo="palabras"):
+    """Divide según el modo: 'palabras', 'tokens' o 'tokens_referencia'."""
+    if modo == "tokens":
+        return list(dividir_en_chunks_por_tokens(texto, tamano_chunk, solapamiento))
+    if modo == "tokens_referencia":
+        return list(dividir_en_chunks_por_tokens_referencia(texto, tamano_chunk, solapamiento))
+    return dividir_en_chunks_por_palabras(texto, tamano_chunk, solapamiento)
+
+
+def preprocesar_registro(item, plantilla=None, tamano_chunk=None, solapamiento=0, modo="palabras"):
+    """
+    Normaliza un RECORD y, opcionalmente, divide sus campos en chunks.
+
+    Args:
+        item (dict): Registro del export
+        plantilla (str): Formato del texto de cada campo antes de dividirlo; recibe
+            servicio, tipo, subtipo, id_sub, campo y texto. Sin plantilla no se chunkea.
+        tamano_chunk (int): Tamaño del chunk (palabras o tokens según el modo)
+        solapamiento (int): Solapamiento entre chunks consecutivos
+        modo (str): 'palabras', 'tokens' o 'tokens_referencia'
+
+    Returns:
+        dict: servicio, tipo, subtipo, id_sub (sin normalizar) y campos, una lista de
+              (campo, texto normalizado, chunks) con los campos no vacíos
+    """
+    registro = {
+        "servicio": normalizar_texto(item.get("SERVICIO", "")),
+        "tipo": normalizar_texto(item.get("TIPO", "")),
+        "subtipo": normalizar_texto(item.get("SUBTIPO", "")),
+        "id_sub": item.get("ID_SUB", ""),
+        "campos": [],
+    }
+    for campo in CAMPOS_TEXTO:
+        texto = normalizar_texto(item.get(campo))
+        if not texto:
+            continue
+        chunks = []
+        if plantilla:
+            texto_con_metadata = plantilla.format(campo=campo, texto=texto, **{
+                clave: registro[clave] for clave in ("servicio", "tipo", "subtipo", "id_sub")
+            })
+            chunks = dividir(texto_con_metadata, tamano_chunk, solapamiento, modo)
+        registro["campos"].append((campo, texto, chunks))
+    return registro
+
+
+def _preprocesar_unidad(items, **opciones):
+    return [preprocesar_registro(item, **opciones) for item in items]
+
+
+class PreprocesadorParalelo:
+    """Pool de procesos persistente para preprocesar registros en orden determinista."""
+
+    def __init__(self, procesos=1, tamano_unidad=0):
+        self.procesos = procesos or os.cpu_count() or 1
+        self.tamano_unidad = max(0, tamano_unidad)
+        self._pool = None
+
+    def iniciar(self):
+        """
+        Arranca los procesos del pool.
+
+        Conviene llamarlo desde el hilo principal antes de crear otros hilos
+        (los workers se crean con fork en Linux).
+        """
+        if self.procesos > 1 and self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.procesos)
+            # Fuerza la creación de todos los workers ahora
+            list(self._pool.map(abs, range(self.procesos)))
+        return self
+
+    def preprocesar(self, items, **opciones):
+        """
+        Preprocesa los registros (ver `preprocesar_registro` para las opciones).
+
+        Returns:
+            list: Un resultado por registro, en el mismo orden
+        """
+        items = list(items)
+        # Sin tamaño fijo, el lote se reparte en una unidad por proceso
+        tamano_unidad = self.tamano_unidad or -(-len(items) // self.procesos) or 1
+        unidades = [items[i:i + tamano_unidad] for i in range(0, len(items), tamano_unidad)]
+        # Con una sola unidad no vale la pena pagar la serialización entre procesos
+        if self.procesos <= 1 or len(unidades) <= 1:
+            return _preprocesar_unidad(items, **opciones)
+        self.iniciar()
+        resultados = []
+        for unidad in self._pool.map(partial(_preprocesar_unidad, **opciones), unidades):
+            resultados.extend(unidad)
+        return resultados
+
+    def cerrar(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def crear_preprocesador(config):
+    """Crea el preprocesador según la sección [INDEXACION] de config.ini."""
+    seccion = config['INDEXACION'] if config.has_section('INDEXACION') else config['DEFAULT']
+    preprocesador = PreprocesadorParalelo(
+        procesos=seccion.getint('procesos_preprocesamiento', fallback=1),
+        tamano_unidad=seccion.getint('tamano_unidad_preprocesamiento', fallback=0),
+    )
+    logging.info(f"Preprocesamiento de la ingesta con {preprocesador.procesos} procesos")
+    return preprocesador
@@ -0,0 +1,139 @@
+"""
+Ejecución concurrente de los tramos de la recuperación híbrida (BM25 y ChromaDB).
+
+Los tramos se lanzan a la vez en un pool de hilos compartido por el proceso,
+de modo que la latencia total es max(bm25, chroma) en lugar de la suma. Cada
+tramo tiene su propio timeout, que corre desde que el tramo empieza a
+ejecutarse: si un tramo se demora se devuelve un resultado degradado (lista
+vacía para ese tramo) con lo que haya respondido el resto.
+
+El pool lo comparten todas las peticiones del worker y ambos agentes, así que
+su tamaño mínimo es hilos del servidor x tramos por consulta. Si aun así un
+tramo espera en la cola más de `timeout_cola`, se descarta sin ejecutarse y
+se informa aparte (timeout de cola, no de recuperación).
+
+Configuración en config.ini, sección [RECUPERACION]:
+    hilos =              (vacío = [SERVIDOR] threads x TRAMOS_POR_CONSULTA)
+    timeout_cola = 2.0
+"""
+
+import configparser
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+# bm25 y chroma
+TRAMOS_POR_CONSULTA = 2
+
+_executor = None
+_lock_executor = threading.Lock()
+_timeout_cola = 2.0
+_metricas = {"timeouts_cola": 0, "timeouts_tramo": 0, "errores": 0}
+
+
+def _leer_configuracion():
+    """Tamaño del pool y timeout de cola desde config.ini."""
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    servidor = config['SERVIDOR'] if config.has_section('SERVIDOR') else config['DEFAULT']
+    seccion = config['RECUPERACION'] if config.has_section('RECUPERACION') else config['DEFAULT']
+    # Un tramo que vence su timeout sigue ocupando su hilo hasta terminar, por
+    # eso nunca menos de un hilo por tramo de cada petición en vuelo
+    minimo = servidor.getint('threads', fallback=16) * TRAMOS_POR_CONSULTA
+    hilos = seccion.get('hilos', fallback='').strip()
+    hilos = int(hilos) if hilos else minimo
+    if hilos < minimo:
+        logging.warning(f"[RECUPERACION] hilos = {hilos} es menor que threads x tramos; se usan {minimo}.")
+        hilos = minimo
+    return hilos, seccion.getfloat('timeout_cola', fallback=2.0)
+
+
+def _obtener_executor():
+    global _executor, _timeout_cola
+    with _lock_executor:
+        if _executor is None:
+            hilos, _timeout_cola = _leer_configuracion()
+            _executor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="recuperacion")
+        return _executor
+
+
+def reiniciar_pool():
+    """Descarta el pool actual (por ejemplo, en un worker recién forkeado)."""
+    global _executor
+    with _lock_executor:
+        _executor = None
+
+
+def cerrar_pool():
+    """Espera los tramos en curso y cierra el pool (apagado ordenado del worker)."""
+    global _executor
+    with _lock_executor:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def metricas():
+    """Tramos degradados desde el arranque, separando la espera en cola de la recuperación lenta."""
+    return dict(_metricas)
+
+
+def ejecutar_en_paralelo(tramos, timeouts, timeout_por_defecto=10.0):
+    """
+    Ejecuta los tramos de recuperación en paralelo con timeout por tramo.
+
+    El timeout de cada tramo cuenta desde que empieza a ejecutarse; la espera
+    en la cola del pool tiene su propio límite (`timeout_cola`).
+
+    Args:
+        tramos (dict): nombre -> función sin argumentos que devuelve una lista de resultados
+        timeouts (dict): nombre -> timeout en segundos para ese tramo
+        timeout_por_defecto (float): timeout para tramos sin entrada en `timeouts`
+
+    Returns:
+        tuple: (resultados, degradados) donde `resultados` es nombre -> lista y
+               `degradados` la lista de tramos que vencieron, fallaron o no
+               llegaron a ejecutarse
+    """
+    executor = _obtener_executor()
+    inicio = time.monotonic()
+    comienzos = {nombre: threading.Event() for nombre in tramos}
+    momentos = {}
+
+    def _ejecutar(nombre, funcion):
+        momentos[nombre] = time.monotonic()
+        comienzos[nombre].set()
+        return funcion()
+
+    futuros = {nombre: executor.submit(_ejecutar, nombre, funcion) for nombre, funcion in tramos.items()}
+
+    resultados = {}
+    degradados = []
+    for nombre, futuro in futuros.items():
+        resultados[nombre] = []
+        comenzo = comienzos[nombre].wait(max(0.0, inicio + _timeout_cola - time.monotonic()))
+        # Si justo empezó a ejecutarse, cancel() falla y se lo espera como a los demás
+        if not comenzo and futuro.cancel():
+            _metricas["timeouts_cola"] += 1
+            logging.warning(
+                f"Tramo de recuperación '{nombre}' esperó más de {_timeout_cola}s en la cola del pool; "
+                "no se ejecutó (resultado degradado)."
+            )
+            degradados.append(nombre)
+            continue
+        comienzos[nombre].wait()
+        limite = momentos[nombre] + timeouts.get(nombre, timeout_por_defecto)
+        try:
+            resultados[nombre] = futuro.result(timeout=max(0.0, limite - time.monotonic()))
+        except FuturesTimeoutError:
+            _metricas["timeouts_tramo"] += 1
+            logging.warning(f"Tramo de recuperación '{nombre}' superó su timeout; resultado degradado.")
+            degradados.append(nombre)
+        except Exception as e:
+            _metricas["errores"] += 1
+            logging.error(f"Tramo de recuperación '{nombre}' falló: {str(e)}")
+            degradados.append(nombre)
+
+    logging.info(f"Recuperación concurrente completada en {time.monotonic() - inicio:.3f}s (degradados: {degradados})")
+    return resultados, degradados
@@ -0,0 +1,92 @@
+"""
+Registro de grafos LangGraph compilados una sola vez por proceso.
+
+Cada módulo de agente registra su `graph_builder` al importarse y todas las
+peticiones reutilizan el mismo grafo compilado. El aislamiento entre
+preguntas se obtiene con un `thread_id` distinto por petición, no con una
+compilación nueva.
+"""
+
+import threading
+import uuid
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from checkpoint_sesiones import borrar_thread_en_memoria
+
+_grafos_compilados = {}
+_lock_registro = threading.Lock()
+
+
+def obtener_grafo(nombre, graph_builder, checkpointer=None):
+    """
+    Devuelve el grafo compilado registrado con `nombre`, compilándolo la primera vez.
+
+    Args:
+        nombre (str): Identificador del grafo dentro del proceso
+        graph_builder (StateGraph): Constructor del grafo a compilar
+        checkpointer: Checkpointer a usar (por defecto un MemorySaver compartido)
+
+    Returns:
+        CompiledStateGraph: Grafo compilado listo para `stream`/`invoke`
+    """
+    with _lock_registro:
+        grafo = _grafos_compilados.get(nombre)
+        if grafo is None:
+            if checkpointer is None:
+                checkpointer = MemorySaver()
+            grafo = graph_builder.compile(checkpointer=checkpointer)
+            _grafos_compilados[nombre] = grafo
+        return grafo
+
+
+def grafos_registrados():
+    """Devuelve los nombres de los grafos compilados en este proceso."""
+    with _lock_registro:
+        return list(_grafos_compilados)
+
+
+def reabrir_checkpointers():
+    """
+    Reabre las conexiones de los checkpointers persistentes de los grafos compilados.
+
+    Se llama en cada worker después del fork (servidor con la app precargada):
+    una conexión SQLite no debe usarse desde dos procesos.
+    """
+    with _lock_registro:
+        grafos = list(_grafos_compilados.values())
+    for grafo in grafos:
+        reabrir = getattr(getattr(grafo, "checkpointer", None), "reabrir", None)
+        if reabrir is not None:
+            reabrir()
+
+
+def cerrar_checkpointers():
+    """Cierra las conexiones de los checkpointers persistentes (apagado ordenado)."""
+    with _lock_registro:
+        grafos = list(_grafos_compilados.values())
+    for grafo in grafos:
+        cerrar = getattr(getattr(grafo, "checkpointer", None), "cerrar", None)
+        if cerrar is not None:
+            cerrar()
+
+
+def nuevo_thread_id(prefijo="pregunta"):
+    """Genera un `thread_id` único para aislar una petición en el checkpointer."""
+    return f"{prefijo}-{uuid.uuid4().hex}"
+
+
+def liberar_thread(grafo, thread_id):
+    """
+    Elimina los checkpoints de un thread para que la memoria no crezca con cada petición.
+
+    Usa `delete_thread` si la versión de langgraph lo provee; si no, limpia
+    directamente el almacenamiento del MemorySaver.
+    """
+    checkpointer = getattr(grafo, "checkpointer", None)
+    if checkpointer is None:
+        return
+    if hasattr(checkpointer, "delete_thread"):
+        checkpointer.delete_thread(thread_id)
+        return
+    borrar_thread_en_memoria(checkpointer, thread_id)
@@ -0,0 +1,28 @@
+"""
+Clasificación de errores de las APIs de modelos para los reintentos de la ingesta.
+
+Solo vale la pena reintentar lo transitorio: rate limit, timeouts, cortes de
+conexión y errores 5xx del proveedor. Un error de autenticación, una solicitud
+mal armada o un bug del prompt fallan igual en cada intento, así que se
+propagan enseguida en lugar de gastar minutos de backoff por chunk.
+
+Los clientes (ChatOpenAI, OpenAIEmbeddings) se crean con `max_retries=0`
+para que los reintentos no se multipliquen con los de este lado.
+"""
+
+try:
+    import openai
+
+    _TRANSITORIOS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                     openai.InternalServerError)
+except ImportError:
+    _TRANSITORIOS = ()
+
+
+def es_error_transitorio(error):
+    """True si el error es de rate limit, timeout, conexión o un 5xx del proveedor."""
+    if isinstance(error, _TRANSITORIOS):
+        return True
+    # Otros clientes HTTP (por ejemplo, el SDK de Anthropic) exponen el código de estado
+    codigo = getattr(error, "status_code", None)
+    return isinstance(codigo, int) and (codigo == 429 or codigo >= 500)
@@ -0,0 +1,135 @@
+"""
+Reranking en cascada: un prefiltro barato antes del reranker caro.
+
+`rank_fusion` entrega hasta `rerank_top_n` (150) candidatos y todos pasaban por
+bge-reranker-large o por Cohere. En modo cascada:
+
+1. Primera etapa barata: cada candidato recibe un puntaje que combina la
+   superposición léxica con la consulta y el puntaje RRF normalizado de la
+   fusión (o, si se configura, un CrossEncoder chico).
+2. Solo los `tamano_lista` mejores pasan al reranker final.
+3. Salida temprana: si los `top_k` primeros quedan claramente separados del
+   resto (diferencia normalizada >= `margen_salida`), se devuelven sin llamar
+   al reranker final.
+
+Configuración en config.ini, sección [SERVICIOS_SIMAP_ANTRO]:
+    rerank_cascada = false
+    cascada_tamano_lista = 30
+    cascada_margen_salida = 0.25      (0 = sin salida temprana)
+    cascada_peso_lexico = 0.5
+    cascada_modelo_rapido =           (vacío = prefiltro léxico)
+"""
+
+import logging
+import re
+import threading
+import unicodedata
+
+from servicio_reranker import ServicioReranker
+
+_RE_PALABRAS = re.compile(r'\w+')
+_STOPWORDS = frozenset(
+    "que del los las una uno por con para como son sus este esta esto ese esa hay the and "
+    "pero mas muy sin sobre tiene tengo puede puedo donde cual cuales cuando quien".split()
+)
+
+
+def terminos(texto):
+    """Términos sin acentos, en minúsculas, sin stopwords ni palabras de menos de 3 letras."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+    return {palabra for palabra in _RE_PALABRAS.findall(texto) if len(palabra) > 2 and palabra not in _STOPWORDS}
+
+
+def _normalizar(puntajes):
+    """Min-max a [0, 1] (todos iguales -> 1)."""
+    if not puntajes:
+        return []
+    minimo, maximo = min(puntajes), max(puntajes)
+    if maximo == minimo:
+        return [1.0] * len(puntajes)
+    return [(puntaje - minimo) / (maximo - minimo) for puntaje in puntajes]
+
+
+class RerankCascada:
+    """Prefiltro barato + reranker final sobre la lista corta, con salida temprana."""
+
+    def __init__(self, reranker_final, tamano_lista=30, margen_salida=0.25, peso_lexico=0.5,
+                 reranker_rapido=None):
+        """
+        Args:
+            reranker_final (callable): (consulta, documentos, top_k) -> documentos reordenados
+            tamano_lista (int): Candidatos que pasan a la segunda etapa
+            margen_salida (float): Separación normalizada entre el top_k y el resto para saltear
+                la segunda etapa (0 la desactiva)
+            peso_lexico (float): Peso de la superposición léxica frente al puntaje de la fusión
+            reranker_rapido (ServicioReranker): CrossEncoder chico para la primera etapa (opcional)
+        """
+        self.reranker_final = reranker_final
+        self.tamano_lista = max(1, tamano_lista)
+        self.margen_salida = margen_salida
+        self.peso_lexico = peso_lexico
+        self.reranker_rapido = reranker_rapido
+        self._lock = threading.Lock()
+        self._metricas = {"consultas": 0, "salidas_tempranas": 0, "candidatos": 0, "candidatos_segunda_etapa": 0}
+
+    def primera_etapa(self, consulta, documentos):
+        """Puntajes baratos normalizados a [0, 1], uno por documento."""
+        if self.reranker_rapido is not None:
+            return _normalizar(self.reranker_rapido.puntuar(consulta, [doc['content'] for doc in documentos]))
+        terminos_consulta = terminos(consulta)
+        lexicos = [
+            len(terminos_consulta & terminos(doc['content'])) / len(terminos_consulta) if terminos_consulta else 0.0
+            for doc in documentos
+        ]
+        fusion = _normalizar([doc.get('score', 0.0) for doc in documentos])
+        return [self.peso_lexico * lexico + (1 - self.peso_lexico) * puntaje
+                for lexico, puntaje in zip(lexicos, fusion)]
+
+    def reordenar(self, consulta, documentos, top_k):
+        """Los `top_k` documentos más relevantes, de mayor a menor."""
+        puntajes = self.primera_etapa(consulta, documentos)
+        orden = sorted(range(len(documentos)), key=lambda indice: puntajes[indice], reverse=True)
+
+        salida_temprana = (
+            self.margen_salida > 0 and len(orden) > top_k
+            and puntajes[orden[top_k - 1]] - puntajes[orden[top_k]] >= self.margen_salida
+        )
+        lista_corta = [documentos[indice] for indice in orden[:max(top_k, self.tamano_lista)]]
+        with self._lock:
+            self._metricas["consultas"] += 1
+            self._metricas["candidatos"] += len(documentos)
+            self._metricas["salidas_tempranas"] += salida_temprana
+            self._metricas["candidatos_segunda_etapa"] += 0 if salida_temprana else len(lista_corta)
+        if salida_temprana:
+            logging.info(f"Reranking en cascada: salida temprana con {top_k} candidatos separados del resto")
+            return lista_corta[:top_k]
+        return self.reranker_final(consulta, lista_corta, top_k)
+
+    def metricas(self):
+        """Consultas, salidas tempranas y proporción de candidatos que llegan al reranker final."""
+        with self._lock:
+            metricas = dict(self._metricas)
+        metricas["proporcion_segunda_etapa"] = (
+            metricas["candidatos_segunda_etapa"] / metricas["candidatos"] if metricas["candidatos"] else 0.0
+        )
+        return metricas
+
+
+def crear_rerank_cascada(config, reranker_final, seccion='SERVICIOS_SIMAP_ANTRO'):
+    """Crea la cascada si `rerank_cascada` está activo en config.ini; si no, devuelve None."""
+    seccion = config[seccion] if config.has_section(seccion) else config['DEFAULT']
+    if not seccion.getboolean('rerank_cascada', fallback=False):
+        return None
+    modelo_rapido = seccion.get('cascada_modelo_rapido', fallback='').strip()
+    return RerankCascada(
+        reranker_final,
+        tamano_lista=seccion.getint('cascada_tamano_lista', fallback=30),
+        margen_salida=seccion.getfloat('cascada_margen_salida', fallback=0.25),
+        peso_lexico=seccion.getfloat('cascada_peso_lexico', fallback=0.5),
+        reranker_rapido=ServicioReranker(
+            modelo=modelo_rapido,
+            tamano_lote=seccion.getint('reranker_tamano_lote', fallback=32),
+            hilos_torch=seccion.getint('reranker_hilos_torch', fallback=0),
+        ) if modelo_rapido else None,
+    )
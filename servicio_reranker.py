@@ -0,0 +1,213 @@
+"""
+Servicio de reranking con CrossEncoder para la recuperación híbrida.
+
+Antes el modelo (BAAI/bge-reranker-large) se cargaba al importar
+consulta_bm25_rerank y cada consulta puntuaba los `rerank_top_n` pares con la
+configuración por defecto de `predict`. Acá:
+
+- El modelo se carga de forma diferida, la primera vez que se usa o al
+  calentarlo (`calentar`, opcionalmente en un hilo de fondo al arrancar).
+- Los pares se ordenan por longitud antes de armar los lotes (menos padding)
+  y se puntúan con un tamaño de lote y una longitud máxima configurables.
+- La cantidad de hilos de torch es configurable y las inferencias se
+  serializan por proceso, así consultas concurrentes no se pisan los núcleos.
+- En CPU se puede cuantizar el modelo a int8 (cuantización dinámica de las
+  capas lineales de torch).
+- Los puntajes (consulta, fragmento) se guardan en un LRU en memoria: las
+  preguntas repetidas no vuelven a pasar por el modelo.
+
+Configuración en config.ini, sección [SERVICIOS_SIMAP_ANTRO]:
+    reranker_modelo = BAAI/bge-reranker-large
+    reranker_tamano_lote = 32
+    reranker_max_longitud = 512
+    reranker_hilos_torch = 0          (0 = valor por defecto de torch)
+    reranker_dispositivo =            (vacío = automático; cpu, cuda)
+    reranker_cuantizar = false
+    reranker_max_cache = 20000
+    reranker_presupuesto_ms = 800
+    reranker_calentar_al_inicio = true
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+MODELO_POR_DEFECTO = "BAAI/bge-reranker-large"
+_PAR_CALENTAMIENTO = ("consulta de calentamiento", "fragmento de calentamiento del reranker")
+
+
+def _hash_texto(texto):
+    return hashlib.blake2b(texto.encode("utf-8"), digest_size=16).digest()
+
+
+class ServicioReranker:
+    """CrossEncoder con carga diferida, lotes ordenados por longitud y caché LRU de puntajes."""
+
+    def __init__(self, modelo=MODELO_POR_DEFECTO, tamano_lote=32, max_longitud=512, hilos_torch=0,
+                 cuantizar=False, max_cache=20000, presupuesto_ms=800, dispositivo=None):
+        self.modelo = modelo
+        self.tamano_lote = max(1, tamano_lote)
+        self.max_longitud = max_longitud
+        self.hilos_torch = hilos_torch
+        self.cuantizar = cuantizar
+        self.max_cache = max_cache
+        self.presupuesto_ms = presupuesto_ms
+        self.dispositivo = dispositivo
+        self._cross_encoder = None
+        self._lock_carga = threading.Lock()
+        self._lock_inferencia = threading.Lock()
+        self._lock_cache = threading.Lock()
+        self._cache = OrderedDict()
+        self._calentamiento = None
+        self._metricas = {"consultas": 0, "pares_modelo": 0, "hits_cache": 0, "fuera_de_presupuesto": 0,
+                          "segundos_modelo": 0.0, "segundos_carga": 0.0}
+
+    # --------------------- Modelo ---------------------
+    def _cargar(self):
+        if self._cross_encoder is not None:
+            return self._cross_encoder
+        with self._lock_carga:
+            if self._cross_encoder is None:
+                inicio = time.perf_counter()
+                import torch
+                from sentence_transformers import CrossEncoder
+
+                if self.hilos_torch:
+                    torch.set_num_threads(self.hilos_torch)
+                cross_encoder = CrossEncoder(self.modelo, max_length=self.max_longitud, device=self.dispositivo)
+                if self.cuantizar:
+                    if str(cross_encoder.model.device) == "cpu":
+                        cross_encoder.model = torch.quantization.quantize_dynamic(
+                            cross_encoder.model, {torch.nn.Linear}, dtype=torch.qint8
+                        )
+                    else:
+                        logging.warning("La cuantización int8 del reranker solo aplica en CPU; se omite.")
+                self._metricas["segundos_carga"] = round(time.perf_counter() - inicio, 2)
+                logging.info(
+                    f"Reranker {self.modelo} cargado en {self._metricas['segundos_carga']} s "
+                    f"(cuantizado: {self.cuantizar}, hilos torch: {torch.get_num_threads()})"
+                )
+                self._cross_encoder = cross_encoder
+        return self._cross_encoder
+
+    @property
+    def cargado(self):
+        return self._cross_encoder is not None
+
+    def calentar(self, en_segundo_plano=False):
+        """
+        Carga el modelo y corre una inferencia de prueba.
+
+        Con `en_segundo_plano=True` lo hace en un hilo daemon y devuelve el hilo;
+        las consultas que lleguen antes esperan a que termine la carga.
+        """
+        def _calentar():
+            try:
+                modelo = self._cargar()
+                with self._lock_inferencia:
+                    modelo.predict([_PAR_CALENTAMIENTO], batch_size=1, show_progress_bar=False)
+            except Exception as e:
+                logging.error(f"No se pudo calentar el reranker: {str(e)}")
+
+        if not en_segundo_plano:
+            _calentar()
+            return None
+        if self._calentamiento is None or not self._calentamiento.is_alive():
+            self._calentamiento = threading.Thread(target=_calentar, name="reranker-calentamiento", daemon=True)
+            self._calentamiento.start()
+        return self._calentamiento
+
+    # --------------------- Caché de puntajes ---------------------
+    def _buscar_cache(self, claves):
+        with self._lock_cache:
+            puntajes = []
+            for clave in claves:
+                puntaje = self._cache.get(clave)
+                if puntaje is not None:
+                    self._cache.move_to_end(clave)
+                puntajes.append(puntaje)
+            return puntajes
+
+    def _guardar_cache(self, claves, puntajes):
+        with self._lock_cache:
+            for clave, puntaje in zip(claves, puntajes):
+                self._cache[clave] = puntaje
+                self._cache.move_to_end(clave)
+            while len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+
+    # --------------------- Interfaz ---------------------
+    def puntuar(self, consulta, textos):
+        """Puntaje de relevancia de cada texto para la consulta, en el mismo orden."""
+        inicio = time.perf_counter()
+        consulta_hash = _hash_texto(consulta)
+        claves = [(consulta_hash, _hash_texto(texto)) for texto in textos]
+        puntajes = self._buscar_cache(claves) if self.max_cache else [None] * len(textos)
+        pendientes = [indice for indice, puntaje in enumerate(puntajes) if puntaje is None]
+
+        if pendientes:
+            # Lotes de longitud pareja: menos padding por lote
+            pendientes.sort(key=lambda indice: len(textos[indice]))
+            modelo = self._cargar()
+            inicio_modelo = time.perf_counter()
+            with self._lock_inferencia:
+                nuevos = modelo.predict(
+                    [(consulta, textos[indice]) for indice in pendientes],
+                    batch_size=self.tamano_lote,
+                    show_progress_bar=False,
+                )
+            segundos_modelo = time.perf_counter() - inicio_modelo
+            nuevos = [float(puntaje) for puntaje in nuevos]
+            for indice, puntaje in zip(pendientes, nuevos):
+                puntajes[indice] = puntaje
+            if self.max_cache:
+                self._guardar_cache([claves[indice] for indice in pendientes], nuevos)
+
+        milisegundos = (time.perf_counter() - inicio) * 1000
+        fuera_de_presupuesto = bool(self.presupuesto_ms and milisegundos > self.presupuesto_ms)
+        with self._lock_cache:
+            self._metricas["consultas"] += 1
+            self._metricas["pares_modelo"] += len(pendientes)
+            self._metricas["hits_cache"] += len(textos) - len(pendientes)
+            self._metricas["segundos_modelo"] += segundos_modelo if pendientes else 0.0
+            self._metricas["fuera_de_presupuesto"] += fuera_de_presupuesto
+        if fuera_de_presupuesto:
+            logging.warning(
+                f"Reranking de {len(textos)} candidatos ({len(pendientes)} por el modelo) en {milisegundos:.0f} ms, "
+                f"fuera del presupuesto de {self.presupuesto_ms} ms"
+            )
+        return puntajes
+
+    def reordenar(self, consulta, documentos, top_k, campo="content"):
+        """Los `top_k` documentos de mayor puntaje, de mayor a menor."""
+        puntajes = self.puntuar(consulta, [doc[campo] for doc in documentos])
+        ordenados = sorted(zip(puntajes, range(len(documentos))), key=lambda par: par[0], reverse=True)
+        return [documentos[indice] for _, indice in ordenados[:top_k]]
+
+    def metricas(self):
+        """Consultas, pares puntuados por el modelo, aciertos del caché y tiempos."""
+        with self._lock_cache:
+            metricas = dict(self._metricas)
+            metricas["en_cache"] = len(self._cache)
+        metricas["segundos_modelo"] = round(metricas["segundos_modelo"], 2)
+        metricas["cargado"] = self.cargado
+        total = metricas["pares_modelo"] + metricas["hits_cache"]
+        metricas["tasa_aciertos"] = metricas["hits_cache"] / total if total else 0.0
+        return metricas
+
+
+def crear_servicio_reranker(config, seccion='SERVICIOS_SIMAP_ANTRO'):
+    """Crea el servicio según config.ini (no carga el modelo)."""
+    seccion = config[seccion] if config.has_section(seccion) else config['DEFAULT']
+    return ServicioReranker(
+        modelo=seccion.get('reranker_modelo', fallback=MODELO_POR_DEFECTO),
+        tamano_lote=seccion.getint('reranker_tamano_lote', fallback=32),
+        max_longitud=seccion.getint('reranker_max_longitud', fallback=512),
+        hilos_torch=seccion.getint('reranker_hilos_torch', fallback=0),
+        cuantizar=seccion.getboolean('reranker_cuantizar', fallback=False),
+        max_cache=seccion.getint('reranker_max_cache', fallback=20000),
+        presupuesto_ms=seccion.getint('reranker_presupuesto_ms', fallback=800),
+        dispositivo=seccion.get('reranker_dispositivo', fallback='').strip() or None,
+    )
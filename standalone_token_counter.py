@@ -6,7 +6,7 @@ que se usará en el archivo principal grafo_AGENTE_SERV_flask.py
 import logging
 import datetime
 import json
-import tiktoken
+from contador_tokens import contar_tokens
 
 # Configuración del logging
 log_filename = 'token_test_log.log'
@@ -32,33 +32,6 @@ def log_message(message, level='INFO'):
     # También mostrar en consola
     print(message)
 
-def contar_tokens(texto, modelo="gpt-3.5-turbo"):
-    """
-    Cuenta el número de tokens en un texto para un modelo específico.
-    
-    Args:
-        texto (str): El texto para contar tokens
-        modelo (str): El nombre del modelo (por defecto: gpt-3.5-turbo)
-        
-    Returns:
-        int: Número de tokens
-    """
-    try:
-        # Mapeamos nombres de modelos a codificadores
-        if modelo.startswith("gpt-4"):
-            codificador = tiktoken.encoding_for_model("gpt-4")
-        elif modelo.startswith("gpt-3.5"):
-            codificador = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        else:
-            # Usamos cl100k_base para modelos más recientes
-            codificador = tiktoken.get_encoding("cl100k_base")
-            
-        # Contar tokens
-        tokens = len(codificador.encode(texto))
-        return tokens
-    except Exception as e:
-        log_message(f"Error al contar tokens: {str(e)}", level='ERROR')
-        return 0
 
 def log_token_summary(tokens_entrada, tokens_salida, modelo):
     """
@@ -0,0 +1,69 @@
+"""
+Prueba del desalojo de threads en MemorySaverAcotado.
+
+Verifica que al liberar o desalojar un thread no quede nada en el
+checkpointer: ni checkpoints (`storage`), ni escrituras pendientes
+(`writes`), ni los valores serializados de los canales (`blobs`).
+
+    python -m pytest -q test_checkpoint_sesiones.py
+    python test_checkpoint_sesiones.py
+"""
+
+from langchain_core.messages import AIMessage
+from langgraph.graph import MessagesState, StateGraph
+
+from checkpoint_sesiones import MemorySaverAcotado, thread_id_de_sesion
+from registro_grafos import liberar_thread, nuevo_thread_id
+
+
+def _grafo(checkpointer):
+    def responder(state: MessagesState):
+        return {"messages": [AIMessage(content="Respuesta de prueba")]}
+
+    graph_builder = StateGraph(MessagesState)
+    graph_builder.add_node("responder", responder)
+    graph_builder.set_entry_point("responder")
+    return graph_builder.compile(checkpointer=checkpointer)
+
+
+def _preguntar(graph, thread_id):
+    graph.invoke(
+        {"messages": [{"role": "user", "content": "¿Cómo tramito pañales?"}]},
+        config={"configurable": {"thread_id": thread_id}},
+    )
+
+
+def _tamanos(checkpointer):
+    return len(checkpointer.storage), len(checkpointer.writes), len(checkpointer.blobs)
+
+
+def test_liberar_threads_efimeros():
+    checkpointer = MemorySaverAcotado(max_hilos=2000, ttl_segundos=0)
+    graph = _grafo(checkpointer)
+    for _ in range(50):
+        thread_id = nuevo_thread_id()
+        _preguntar(graph, thread_id)
+        liberar_thread(graph, thread_id)
+    assert _tamanos(checkpointer) == (0, 0, 0)
+
+
+def test_desalojo_lru_de_sesiones():
+    checkpointer = MemorySaverAcotado(max_hilos=3, ttl_segundos=0)
+    graph = _grafo(checkpointer)
+    for i in range(50):
+        _preguntar(graph, thread_id_de_sesion(f"sesion-{i}"))
+    # Solo quedan datos de los threads que siguen en el LRU
+    vivos = {thread_id_de_sesion(f"sesion-{i}") for i in range(47, 50)}
+    assert set(checkpointer.storage) <= vivos
+    assert {clave[0] for clave in checkpointer.writes} <= vivos
+    assert {clave[0] for clave in checkpointer.blobs} <= vivos
+
+    for thread_id in vivos:
+        checkpointer.delete_thread(thread_id)
+    assert _tamanos(checkpointer) == (0, 0, 0)
+
+
+if __name__ == "__main__":
+    test_liberar_threads_efimeros()
+    test_desalojo_lru_de_sesiones()
+    print("OK: storage, writes y blobs vacíos después del desalojo")
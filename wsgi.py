@@ -0,0 +1,11 @@
+"""
+Punto de entrada WSGI para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+`app.run` (python app.py) y `flask run` quedan para desarrollo.
+"""
+
+from app import app
+
+application = app